@@ -1,9 +1,11 @@
 from django.contrib import admin
-from appointments.models import Appointment, VisitHistory
+from appointments.models import Appointment, LabObservation, VisitHistory
+from users.search import TrigramSearchAdminMixin
+from users.utils import EstimatedCountPaginator
 
 
 # Register your models here.
-class AppointmentAdmin(admin.ModelAdmin):
+class AppointmentAdmin(TrigramSearchAdminMixin, admin.ModelAdmin):
     list_display = (
         "patient_name",
         "doctor_name",
@@ -21,8 +23,19 @@ class AppointmentAdmin(admin.ModelAdmin):
         "medical_professional__user__last_name",
         "note",
     )
+    trigram_user_fields = (
+        "patient__user",
+        "medical_professional__user",
+    )
+    trigram_text_fields = ("note",)
 
     list_filter = ("status",)
+    list_select_related = (
+        "patient__user",
+        "medical_professional__user",
+    )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def patient_name(self, obj: Appointment):
         return obj.patient.user.full_name
@@ -34,5 +47,25 @@ class AppointmentAdmin(admin.ModelAdmin):
         model = Appointment
 
 
+class LabObservationAdmin(admin.ModelAdmin):
+    list_display = (
+        "analyte_code",
+        "value",
+        "unit",
+        "flag",
+        "observed_at",
+    )
+    list_filter = ("flag",)
+    search_fields = ("analyte_code", "analyte_name")
+    raw_id_fields = ("patient", "visit_history")
+    date_hierarchy = "observed_at"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    class Meta:
+        model = LabObservation
+
+
 admin.site.register(Appointment, AppointmentAdmin)
 admin.site.register(VisitHistory)
+admin.site.register(LabObservation, LabObservationAdmin)
@@ -0,0 +1,208 @@
+"""
+Bulk export of patient data, in the manner of the FHIR bulk data `$export`
+operation.
+
+An export is kicked off over the API and run by a Celery task, which writes
+one gzipped NDJSON file per resource type to the default storage. Rows are
+read as plain values from a server-side cursor a chunk at a time and
+written straight to the compressed file, so no queryset is ever held in
+memory however many rows are exported.
+"""
+
+import gzip
+import json
+import logging
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.utils import timezone
+from appointments.choices import EXPORT_STATUS
+from appointments.models import (
+    Appointment,
+    BulkExport,
+    LabObservation,
+    TestResult,
+    VisitHistory,
+)
+from users.models import MedicalHistory, Patient, VitalSigns
+
+logger = logging.getLogger(__name__)
+
+# resource type: (model, exported fields, fields of related rows by the
+# name they are exported as, field `since` filters on). `since` keeps the
+# rows changed since then, as in FHIR; rows never changed once stored are
+# filtered on when they were stored.
+RESOURCES = {
+    "Patient": (
+        Patient,
+        (
+            "id",
+            "blood_group",
+            "genotype",
+            "allergies",
+            "height",
+            "weight",
+            "bmi",
+        ),
+        {
+            "email": "user__email",
+            "first_name": "user__first_name",
+            "last_name": "user__last_name",
+            "gender": "user__gender",
+            "date_of_birth": "user__date_of_birth",
+        },
+        "updated_at",
+    ),
+    "MedicalHistory": (
+        MedicalHistory,
+        (
+            "id",
+            "patient_id",
+            "medical_conditions",
+            "allergies",
+            "medications",
+            "immunization_history",
+            "family_medical_history",
+            "created_at",
+        ),
+        {},
+        "updated_at",
+    ),
+    "Appointment": (
+        Appointment,
+        (
+            "id",
+            "patient_id",
+            "medical_professional_id",
+            "status",
+            "start_time",
+            "end_time",
+            "note",
+            "created_at",
+        ),
+        {},
+        "updated_at",
+    ),
+    "VisitHistory": (
+        VisitHistory,
+        (
+            "id",
+            "appointment_id",
+            "patient_id",
+            "medical_professional_id",
+            "visit_date",
+            "reason_for_visit",
+            "treatments_received",
+            "physician_notes",
+        ),
+        {},
+        "updated_at",
+    ),
+    "TestResult": (
+        TestResult,
+        (
+            "id",
+            "patient_id",
+            "visit_history_id",
+            "blood_tests",
+            "imaging_studies",
+            "electrocardiogram",
+            "other_tests",
+        ),
+        {},
+        # changes to a test result move the updated_at of its visit, see
+        # users.signals
+        "visit_history__updated_at",
+    ),
+    "VitalSigns": (
+        VitalSigns,
+        ("id", "patient_id", "recorded_at") + VitalSigns.MEASUREMENTS,
+        {},
+        "created_at",
+    ),
+    "LabObservation": (
+        LabObservation,
+        (
+            "id",
+            "patient_id",
+            "visit_history_id",
+            "analyte_code",
+            "analyte_name",
+            "value",
+            "unit",
+            "reference_low",
+            "reference_high",
+            "flag",
+            "observed_at",
+        ),
+        {},
+        "created_at",
+    ),
+}
+
+
+def get_export_file_name(bulk_export: BulkExport, resource_type: str) -> str:
+    return f"exports/{bulk_export.id}/{resource_type}.ndjson.gz"
+
+
+def get_resource_values(resource_type: str, since=None, **filters):
+    """Exported values of the rows of `resource_type` matching `filters`,
+    changed `since` a time if given."""
+    model, fields, related_fields, since_field = RESOURCES[resource_type]
+    queryset = model.objects.filter(**filters).order_by()
+    if since:
+        queryset = queryset.filter(**{f"{since_field}__gte": since})
+    return queryset.values(
+        *fields,
+        **{name: F(lookup) for name, lookup in related_fields.items()},
+    )
+
+
+def export_resource(bulk_export: BulkExport, resource_type: str) -> dict:
+    """Write every row of `resource_type` to its gzipped NDJSON file.
+    Returns the output entry of the file."""
+    values = get_resource_values(resource_type, since=bulk_export.since)
+
+    count = 0
+    with tempfile.TemporaryFile() as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as compressed:
+            for row in values.iterator(
+                chunk_size=settings.BULK_EXPORT_CHUNK_SIZE
+            ):
+                row = {"resourceType": resource_type, **row}
+                compressed.write(
+                    json.dumps(row, cls=DjangoJSONEncoder).encode() + b"\n"
+                )
+                count += 1
+        raw.seek(0)
+        file_name = default_storage.save(
+            get_export_file_name(bulk_export, resource_type), File(raw)
+        )
+    return {"type": resource_type, "file": file_name, "count": count}
+
+
+def write_bulk_export(export_id) -> str:
+    bulk_export = BulkExport.objects.get(id=export_id)
+    bulk_export.status = EXPORT_STATUS.RUNNING
+    bulk_export.save(update_fields=["status"])
+
+    try:
+        for resource_type in bulk_export.resource_types:
+            bulk_export.output.append(
+                export_resource(bulk_export, resource_type)
+            )
+            # progress is visible to status polls
+            bulk_export.save(update_fields=["output"])
+    except Exception as exc:
+        logger.exception("Bulk export {} failed".format(export_id))
+        bulk_export.status = EXPORT_STATUS.FAILED
+        bulk_export.error = str(exc)
+    else:
+        bulk_export.status = EXPORT_STATUS.COMPLETED
+    bulk_export.completed_at = timezone.now()
+    bulk_export.save(update_fields=["status", "error", "completed_at"])
+    return bulk_export.status
@@ -7,3 +7,44 @@ class BOOKING_STATUS(TextChoices):
     ACCEPTED = "Accepted"
     ACTIVE = "Active"
     COMPLETED = "Completed"
+    EXPIRED = "Expired"
+    NO_SHOW = "No Show"
+
+
+class LAB_FLAG(TextChoices):
+    LOW = "L"
+    NORMAL = "N"
+    HIGH = "H"
+
+
+class EXPORT_STATUS(TextChoices):
+    PENDING = "Pending"
+    RUNNING = "Running"
+    COMPLETED = "Completed"
+    FAILED = "Failed"
+
+
+# Statuses an appointment may move to from a given status. Statuses that are
+# not a key here (Cancelled, Completed, Expired, No Show) are terminal.
+STATUS_TRANSITIONS = {
+    BOOKING_STATUS.PENDING: (
+        BOOKING_STATUS.ACCEPTED,
+        BOOKING_STATUS.CANCELLED,
+        BOOKING_STATUS.EXPIRED,
+    ),
+    BOOKING_STATUS.ACCEPTED: (
+        BOOKING_STATUS.ACTIVE,
+        BOOKING_STATUS.COMPLETED,
+        BOOKING_STATUS.CANCELLED,
+        BOOKING_STATUS.NO_SHOW,
+    ),
+    BOOKING_STATUS.ACTIVE: (BOOKING_STATUS.COMPLETED,),
+}
+
+# Statuses of appointments that took, or are taking, place and so have a
+# visit history
+VISIT_STATUSES = (
+    BOOKING_STATUS.ACCEPTED,
+    BOOKING_STATUS.ACTIVE,
+    BOOKING_STATUS.COMPLETED,
+)
@@ -0,0 +1,311 @@
+"""
+Bulk import of lab result files into LabObservation rows.
+
+Files are read a line at a time, as CSV with a header row or as a
+pipe-delimited HL7 v2 subset (PID, OBR and numeric OBX segments). Parsed
+rows are checked in plain Python and grouped in chunks. For each chunk the
+patients and their visits are read with one query each into lookup maps,
+and the valid rows are written with one bulk insert. Memory use only
+depends on the chunk size, never on the size of the file.
+"""
+
+import bisect
+import csv
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+from appointments.models import LabObservation, VisitHistory
+from users.models import Patient
+
+FORMAT_CSV = "csv"
+FORMAT_HL7 = "hl7"
+FORMATS = (FORMAT_CSV, FORMAT_HL7)
+HL7_DATETIME_FORMATS = ("%Y%m%d%H%M%S", "%Y%m%d%H%M", "%Y%m%d")
+# the value and the reference bounds are stored with the same digits
+DECIMAL_FIELD = LabObservation._meta.get_field("value")
+DECIMAL_QUANTUM = Decimal(1).scaleb(-DECIMAL_FIELD.decimal_places)
+INTEGER_DIGITS = DECIMAL_FIELD.max_digits - DECIMAL_FIELD.decimal_places
+
+
+class RowError(Exception):
+    pass
+
+
+def get_file_format(file_name: str) -> str:
+    return FORMAT_CSV if file_name.lower().endswith(".csv") else FORMAT_HL7
+
+
+def parse_csv(lines):
+    """Yield (line number, row) for every data row of a CSV file with a
+    header row. The column names are the LabObservation field names, with
+    `patient_email` allowed in place of `patient_id` and an optional
+    `visit_history_id` and `reference_range` ("low-high")."""
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _hl7_component(field: str, index: int) -> str:
+    components = field.split("^")
+    return components[index] if index < len(components) else ""
+
+
+def _hl7_field(fields: list, index: int) -> str:
+    return fields[index] if index < len(fields) else ""
+
+
+def parse_hl7(lines):
+    """Yield (line number, row) for every OBX segment of an HL7 v2 message
+    stream. PID-3 holds the patient id, OBR-2 the visit history id, OBX-3
+    the analyte code^name, OBX-5 the value, OBX-6 the unit, OBX-7 the
+    reference range and OBX-14 (or OBR-7) the observation time."""
+    patient_id = visit_history_id = observed_at = ""
+    line_number = 0
+    for line in lines:
+        # segments are separated by carriage returns, files often use
+        # newlines as well
+        for segment in line.replace("\r", "\n").split("\n"):
+            segment = segment.strip()
+            if not segment:
+                continue
+            line_number += 1
+            fields = segment.split("|")
+            if fields[0] == "MSH":
+                patient_id = visit_history_id = observed_at = ""
+            elif fields[0] == "PID":
+                patient_id = _hl7_component(_hl7_field(fields, 3), 0)
+            elif fields[0] == "OBR":
+                visit_history_id = _hl7_field(fields, 2)
+                observed_at = _hl7_field(fields, 7)
+            elif fields[0] == "OBX":
+                identifier = _hl7_field(fields, 3)
+                yield line_number, {
+                    "value_type": _hl7_field(fields, 2),
+                    "patient_id": patient_id,
+                    "visit_history_id": visit_history_id,
+                    "analyte_code": _hl7_component(identifier, 0),
+                    "analyte_name": _hl7_component(identifier, 1),
+                    "value": _hl7_field(fields, 5),
+                    "unit": _hl7_component(_hl7_field(fields, 6), 0),
+                    "reference_range": _hl7_field(fields, 7),
+                    "observed_at": _hl7_field(fields, 14) or observed_at,
+                }
+
+
+PARSERS = {FORMAT_CSV: parse_csv, FORMAT_HL7: parse_hl7}
+
+
+def _clean_decimal(value, field: str, required=False):
+    value = (value or "").strip()
+    if not value:
+        if required:
+            raise RowError({field: "A number is required."})
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise RowError({field: "A number is required."})
+    if not number.is_finite():
+        raise RowError({field: "A number is required."})
+    if abs(number) < 10**INTEGER_DIGITS:
+        number = number.quantize(DECIMAL_QUANTUM)
+    # rounding can carry a number over the limit as well
+    if abs(number) >= 10**INTEGER_DIGITS:
+        raise RowError(
+            {
+                field: "At most {} digits before the decimal point.".format(
+                    INTEGER_DIGITS
+                )
+            }
+        )
+    return number
+
+
+def _parse_datetime(value: str):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for datetime_format in HL7_DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, datetime_format)
+        except ValueError:
+            continue
+    raise RowError({"observed_at": "A valid datetime is required."})
+
+
+def _clean_observed_at(value):
+    observed_at = _parse_datetime((value or "").strip())
+    if timezone.is_naive(observed_at):
+        observed_at = observed_at.replace(tzinfo=dt_timezone.utc)
+    return observed_at
+
+
+def _clean_uuid(value, field: str):
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise RowError({field: "A valid id is required."})
+
+
+def clean_lab_row(row: dict) -> dict:
+    """Check a parsed row and return the model fields for it, with the
+    patient (`patient_id` or `patient_email`) and visit still to be
+    resolved."""
+    if row.get("value_type", "NM") != "NM":
+        raise RowError({"value": "Only numeric (NM) results are imported."})
+
+    patient_id = _clean_uuid(row.get("patient_id"), "patient_id")
+    patient_email = (row.get("patient_email") or "").strip().lower()
+    if not patient_id and not patient_email:
+        raise RowError({"patient_id": "A patient id or email is required."})
+    analyte_code = (row.get("analyte_code") or "").strip()
+    if not analyte_code or len(analyte_code) > 32:
+        raise RowError({"analyte_code": "A code of up to 32 characters."})
+
+    reference_low = _clean_decimal(row.get("reference_low"), "reference_low")
+    reference_high = _clean_decimal(
+        row.get("reference_high"), "reference_high"
+    )
+    reference_range = (row.get("reference_range") or "").strip()
+    if reference_range:
+        low, _, high = reference_range.partition("-")
+        reference_low = _clean_decimal(low, "reference_range")
+        reference_high = _clean_decimal(high, "reference_range")
+
+    return {
+        "patient_id": patient_id,
+        "patient_email": patient_email,
+        "visit_history_id": _clean_uuid(
+            row.get("visit_history_id"), "visit_history_id"
+        ),
+        "analyte_code": analyte_code,
+        "analyte_name": (row.get("analyte_name") or "").strip()[:255],
+        "value": _clean_decimal(row.get("value"), "value", required=True),
+        "unit": (row.get("unit") or "").strip()[:32],
+        "reference_low": reference_low,
+        "reference_high": reference_high,
+        "observed_at": _clean_observed_at(row.get("observed_at")),
+    }
+
+
+def _get_patient_ids(chunk: list) -> dict:
+    """Map of every patient id and email of `chunk` to the patient id."""
+    ids = {row["patient_id"] for _, row in chunk if row["patient_id"]}
+    emails = {row["patient_email"] for _, row in chunk if row["patient_email"]}
+    patient_ids = {}
+    # the emails of the chunk are lower cased, stored ones may not be
+    for patient_id, email in (
+        Patient.objects.alias(email=Lower("user__email"))
+        .filter(Q(id__in=ids) | Q(email__in=emails))
+        .values_list("id", "user__email")
+    ):
+        patient_id = uuid.UUID(str(patient_id))
+        patient_ids[patient_id] = patient_ids[email.lower()] = patient_id
+    return patient_ids
+
+
+def _get_visits(patient_ids) -> tuple:
+    """Patient of every visit, and the visit dates and ids of every
+    patient in date order."""
+    visit_patients, patient_visits = {}, defaultdict(list)
+    for visit_id, patient_id, visit_date in (
+        VisitHistory.objects.filter(patient_id__in=patient_ids)
+        .order_by("visit_date")
+        .values_list("id", "patient_id", "visit_date")
+    ):
+        visit_id, patient_id = uuid.UUID(str(visit_id)), uuid.UUID(
+            str(patient_id)
+        )
+        visit_patients[visit_id] = patient_id
+        if visit_date:
+            patient_visits[patient_id].append((visit_date, visit_id))
+    return visit_patients, patient_visits
+
+
+def _resolve_visit(row, patient_id, visit_patients, patient_visits):
+    if row["visit_history_id"]:
+        if visit_patients.get(row["visit_history_id"]) != patient_id:
+            raise RowError(
+                {"visit_history_id": "No visit found for that patient."}
+            )
+        return row["visit_history_id"]
+
+    # the patient's latest visit on or before the observation
+    visits = patient_visits.get(patient_id, [])
+    position = bisect.bisect_right(
+        visits, (row["observed_at"].date(), uuid.UUID(int=2**128 - 1))
+    )
+    if not position:
+        raise RowError(
+            {"visit_history_id": "The patient has no visit before this."}
+        )
+    return visits[position - 1][1]
+
+
+def _write_chunk(chunk: list, report: dict) -> int:
+    """Store the rows of `chunk`, a list of (position, cleaned row) pairs,
+    whose patient and visit resolve. Returns the number stored."""
+    patient_ids = _get_patient_ids(chunk)
+    visit_patients, patient_visits = _get_visits(set(patient_ids.values()))
+
+    observations = []
+    for position, row in chunk:
+        try:
+            patient_id = patient_ids.get(
+                row["patient_id"] or row["patient_email"]
+            )
+            if not patient_id:
+                raise RowError({"patient_id": "No patient found for that id."})
+            visit_history_id = _resolve_visit(
+                row, patient_id, visit_patients, patient_visits
+            )
+        except RowError as exc:
+            _add_error(report, position, exc)
+            continue
+        del row["patient_email"]
+        row.update(patient_id=patient_id, visit_history_id=visit_history_id)
+        observations.append(LabObservation(**row))
+
+    with transaction.atomic():
+        LabObservation.objects.bulk_create(observations, batch_size=1000)
+    return len(observations)
+
+
+def _add_error(report: dict, position: int, exc: RowError):
+    report["failed"] += 1
+    if len(report["errors"]) < settings.LAB_IMPORT_MAX_REPORTED_ERRORS:
+        report["errors"].append({"row": position, "errors": exc.args[0]})
+
+
+def import_lab_results(lines, file_format: str, chunk_size=None) -> dict:
+    """Import the lab results of a file given as an iterable of lines.
+    Returns how many rows were read and created and the position (line
+    number) and errors of the first LAB_IMPORT_MAX_REPORTED_ERRORS rejected
+    rows."""
+    chunk_size = chunk_size or settings.LAB_IMPORT_CHUNK_SIZE
+    report = {"received": 0, "created": 0, "failed": 0, "errors": []}
+    chunk = []
+    for position, row in PARSERS[file_format](lines):
+        report["received"] += 1
+        try:
+            chunk.append((position, clean_lab_row(row)))
+        except RowError as exc:
+            _add_error(report, position, exc)
+
+        if len(chunk) >= chunk_size:
+            report["created"] += _write_chunk(chunk, report)
+            chunk = []
+    if chunk:
+        report["created"] += _write_chunk(chunk, report)
+    return report
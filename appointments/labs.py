@@ -0,0 +1,55 @@
+"""
+Structured laboratory results.
+
+LabObservation rows hold one numeric result each, with the database
+computing whether it falls outside its reference range. Result searches,
+abnormal result lists and trends are filters and grouped aggregates over
+the (patient, analyte, observed_at) and (analyte, observed_at) indexes, so
+no result text is ever parsed in Python.
+"""
+
+from django.db.models import Avg, Count, Max, Min, Q
+from django.db.models.functions import Trunc
+from appointments.choices import LAB_FLAG
+from appointments.models import LabObservation
+
+# lab observation filter parameter and the lookup it applies
+OBSERVATION_FILTERS = {
+    "patient_id": "patient_id",
+    "analyte_code": "analyte_code",
+    "start": "observed_at__gte",
+    "end": "observed_at__lt",
+    "min_value": "value__gte",
+    "max_value": "value__lte",
+    "flag": "flag",
+}
+
+
+def filter_lab_observations(**filters):
+    """Observations matching the OBSERVATION_FILTERS given, `abnormal` ones
+    only if set, newest first."""
+    abnormal = filters.pop("abnormal", False)
+    queryset = LabObservation.objects.filter(
+        **{OBSERVATION_FILTERS[name]: value for name, value in filters.items()}
+    )
+    if abnormal:
+        queryset = queryset.exclude(flag=LAB_FLAG.NORMAL)
+    return queryset.order_by("-observed_at", "-pk")
+
+
+def get_lab_trend(resolution: str, **filters):
+    """Count, average, min, max and number of abnormal results of the
+    observations matching `filters` per hour, day or month."""
+    return (
+        filter_lab_observations(**filters)
+        .annotate(bucket_start=Trunc("observed_at", resolution))
+        .order_by("bucket_start")
+        .values("bucket_start")
+        .annotate(
+            count=Count("id"),
+            value_avg=Avg("value"),
+            value_min=Min("value"),
+            value_max=Max("value"),
+            abnormal=Count("id", filter=~Q(flag=LAB_FLAG.NORMAL)),
+        )
+    )
@@ -0,0 +1,77 @@
+import logging
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Computes the daily workload rows of every medical professional over "
+        "the appointment history, a few days at a time"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--start",
+            help="First day to compute (YYYY-MM-DD), the first appointment "
+            "day by default.",
+        )
+        parser.add_argument(
+            "--end",
+            help="Last day to compute (YYYY-MM-DD), the last appointment day "
+            "by default.",
+        )
+        parser.add_argument(
+            "--chunk-days",
+            type=int,
+            default=7,
+            help="Number of days recomputed per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        from django.db.models import Max, Min
+        from django.utils import timezone
+        from appointments.models import Appointment, Availability
+        from appointments.workload import refresh_workload
+
+        days = {}
+        for option in ("start", "end"):
+            if options[option] is None:
+                continue
+            try:
+                days[option] = date.fromisoformat(options[option])
+            except ValueError:
+                raise CommandError(
+                    "{} must be a day written as YYYY-MM-DD.".format(option)
+                )
+        if "start" in days and "end" in days and days["start"] > days["end"]:
+            raise CommandError("start must not be after end.")
+
+        bounds = [
+            model.objects.aggregate(
+                first=Min("start_time"), last=Max("end_time")
+            )
+            for model in (Appointment, Availability)
+        ]
+        first = [bound["first"] for bound in bounds if bound["first"]]
+        last = [bound["last"] for bound in bounds if bound["last"]]
+        if not first:
+            logger.info("No appointments or availability to backfill")
+            return
+
+        start = days.get("start") or timezone.localdate(min(first))
+        end = days.get("end") or timezone.localdate(max(last))
+        chunk = timedelta(days=options["chunk_days"])
+
+        written, day = 0, start
+        while day <= end:
+            chunk_end = min(day + chunk, end + timedelta(days=1))
+            written += refresh_workload(day, chunk_end)
+            logger.info(
+                "Backfilled professional workload up to {} ({} rows)".format(
+                    chunk_end - timedelta(days=1), written
+                )
+            )
+            day = chunk_end
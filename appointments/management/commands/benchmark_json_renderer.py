@@ -0,0 +1,89 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Times encoding and decoding a page of serialized appointments with "
+        "the standard library and every installed fast JSON backend"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            help="Appointments per page, the API page size by default.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Number of times each page is encoded and decoded.",
+        )
+
+    def handle(self, *args, **options):
+        import json
+        import timeit
+
+        from django.conf import settings
+        from rest_framework.renderers import JSONRenderer
+        from appointments.models import Appointment
+        from appointments.serilaizers import AppointmentSerializer
+        from users import renderers
+
+        page_size = (
+            options["page_size"] or settings.REST_FRAMEWORK["PAGE_SIZE"]
+        )
+        appointments = Appointment.objects.select_related(
+            "patient__user__medicalprofessional",
+            "medical_professional__user__medicalprofessional",
+        ).order_by("-start_time")[:page_size]
+        data = AppointmentSerializer(appointments, many=True).data
+        if not data:
+            logger.info("No appointments to benchmark")
+            return
+
+        stdlib_renderer = JSONRenderer()
+        body = stdlib_renderer.render(data)
+        backends = {
+            renderers.BACKEND_JSON: (
+                lambda: stdlib_renderer.render(data),
+                lambda: json.loads(body),
+            )
+        }
+        if renderers.orjson:
+            backends[renderers.BACKEND_ORJSON] = (
+                lambda: renderers.dumps(data, renderers.BACKEND_ORJSON),
+                lambda: renderers.loads(body, renderers.BACKEND_ORJSON),
+            )
+        if renderers.msgspec:
+            backends[renderers.BACKEND_MSGSPEC] = (
+                lambda: renderers.dumps(data, renderers.BACKEND_MSGSPEC),
+                lambda: renderers.loads(body, renderers.BACKEND_MSGSPEC),
+            )
+
+        logger.info(
+            "Page of {} appointments, {} bytes".format(len(data), len(body))
+        )
+        baseline = None
+        for backend, (encode, decode) in backends.items():
+            encode_ms = timeit.timeit(encode, number=options["repeat"])
+            decode_ms = timeit.timeit(decode, number=options["repeat"])
+            encode_ms, decode_ms = (
+                encode_ms * 1000 / options["repeat"],
+                decode_ms * 1000 / options["repeat"],
+            )
+            baseline = baseline or (encode_ms, decode_ms)
+            logger.info(
+                "{}: encode {:.2f} ms ({:.1f}x), decode {:.2f} ms "
+                "({:.1f}x)".format(
+                    backend,
+                    encode_ms,
+                    baseline[0] / encode_ms,
+                    decode_ms,
+                    baseline[1] / decode_ms,
+                )
+            )
@@ -0,0 +1,91 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Times reading a page of appointments with AppointmentSerializer "
+        "and with the .values() representations of the list endpoints"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            help="Appointments per page, the API page size by default.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of times each page is read.",
+        )
+
+    def handle(self, *args, **options):
+        import timeit
+
+        from django.conf import settings
+        from django.db import connection
+        from rest_framework.renderers import JSONRenderer
+        from appointments.models import Appointment
+        from appointments.representations import (
+            APPOINTMENT_FIELDS,
+            represent_appointments,
+        )
+        from appointments.serilaizers import AppointmentSerializer
+
+        page_size = (
+            options["page_size"] or settings.REST_FRAMEWORK["PAGE_SIZE"]
+        )
+        queryset = Appointment.objects.all()[:page_size]
+
+        def read_with_serializer():
+            # the serializer at its best, without a query per row
+            return AppointmentSerializer(
+                Appointment.objects.select_related(
+                    "patient__user__medicalprofessional",
+                    "medical_professional__user__medicalprofessional",
+                ).prefetch_related("patient__medical_history")[:page_size],
+                many=True,
+            ).data
+
+        def read_with_representations():
+            return represent_appointments(
+                list(queryset.values(*APPOINTMENT_FIELDS))
+            )
+
+        serialized = read_with_serializer()
+        if not serialized:
+            logger.info("No appointments to benchmark")
+            return
+        if JSONRenderer().render(serialized) != JSONRenderer().render(
+            read_with_representations()
+        ):
+            logger.warning("The representations differ from the serializer")
+
+        logger.info("Page of {} appointments".format(len(serialized)))
+        baseline = None
+        for name, read in (
+            ("serializer", read_with_serializer),
+            ("representations", read_with_representations),
+        ):
+            queries = []
+            with connection.execute_wrapper(
+                lambda execute, sql, *args: queries.append(sql)
+                or execute(sql, *args)
+            ):
+                read()
+            read_ms = (
+                timeit.timeit(read, number=options["repeat"])
+                * 1000
+                / options["repeat"]
+            )
+            baseline = baseline or read_ms
+            logger.info(
+                "{}: {:.2f} ms ({:.1f}x), {} queries".format(
+                    name, read_ms, baseline / read_ms, len(queries)
+                )
+            )
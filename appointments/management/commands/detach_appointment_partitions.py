@@ -0,0 +1,62 @@
+import logging
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Detaches the monthly appointment partitions older than a month so "
+        "they leave the live table. Their visit histories are unlinked the "
+        "same way deleting the appointments would."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "before",
+            help="First month to keep, as YYYY-MM. Older months are detached.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Drop the detached partitions instead of keeping them.",
+        )
+
+    def handle(self, *args, **options):
+        from django.db import connection
+        from appointments.partitioning import (
+            detach_partition,
+            get_partitions,
+            is_partitioned,
+            unlink_visit_histories,
+        )
+
+        try:
+            before = datetime.strptime(options["before"], "%Y-%m").date()
+        except ValueError:
+            raise CommandError("before must be a month written as YYYY-MM.")
+
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning needs a PostgreSQL database.")
+        with connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                raise CommandError("The appointment table is not partitioned.")
+            partitions = [
+                name
+                for month, name in get_partitions(cursor)
+                if month < before
+            ]
+
+        for partition in partitions:
+            unlinked = unlink_visit_histories(partition, options["chunk_size"])
+            detach_partition(partition, drop=options["drop"])
+            logger.info(
+                "{} partition {}, unlinked {} visit histories".format(
+                    "Dropped" if options["drop"] else "Detached",
+                    partition,
+                    unlinked,
+                )
+            )
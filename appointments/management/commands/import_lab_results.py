@@ -0,0 +1,43 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports the lab results of a CSV or pipe-delimited HL7 file into "
+        "lab observations, a chunk of rows at a time"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import.")
+        parser.add_argument(
+            "--format",
+            choices=("csv", "hl7"),
+            help="File format, guessed from the file name by default.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        from appointments.lab_import import (
+            get_file_format,
+            import_lab_results,
+        )
+
+        file_format = options["format"] or get_file_format(options["path"])
+        with open(
+            options["path"], encoding="utf-8-sig", errors="replace", newline=""
+        ) as lines:
+            report = import_lab_results(
+                lines, file_format, options["chunk_size"]
+            )
+
+        for error in report["errors"]:
+            logger.info("Line {}: {}".format(error["row"], error["errors"]))
+        logger.info(
+            "Imported {} of {} lab results, {} failed".format(
+                report["created"], report["received"], report["failed"]
+            )
+        )
@@ -0,0 +1,52 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Converts the appointment table to monthly range partitions on "
+        "created_at without blocking writes while existing rows are copied"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=settings.APPOINTMENT_PARTITION_MONTHS_AHEAD,
+        )
+
+    def handle(self, *args, **options):
+        from appointments.partitioning import (
+            PartitioningError,
+            UNPARTITIONED_TABLE,
+            copy_rows,
+            create_partitioned_table,
+            swap_tables,
+        )
+
+        try:
+            create_partitioned_table(options["months_ahead"])
+        except PartitioningError as e:
+            raise CommandError(str(e))
+        logger.info("Created partitioned table, copying appointments...")
+
+        copied, last_key = 0, None
+        while True:
+            count, last_key = copy_rows(options["chunk_size"], last_key)
+            if not count:
+                break
+            copied += count
+            logger.info("Copied {} appointments".format(copied))
+
+        swap_tables()
+        logger.info(
+            "Appointments are partitioned. The old table is kept as {}, "
+            "drop it once the data has been checked.".format(
+                UNPARTITIONED_TABLE
+            )
+        )
@@ -0,0 +1,46 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Frees availability left booked by cancelled or deleted appointments "
+        "and gives it back the free slots it was cut from"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many slots would be freed.",
+        )
+
+    def handle(self, *args, **options):
+        from appointments.utils import (
+            free_availability,
+            get_leaked_availability_queryset,
+        )
+
+        leaked_qs = get_leaked_availability_queryset()
+        if options["dry_run"]:
+            logger.info(
+                "{} leaked availability slots found".format(leaked_qs.count())
+            )
+            return
+
+        # each slot is freed on its own, leaving the rest of the schedule
+        # as it is
+        freed = 0
+        while True:
+            chunk = list(leaked_qs[: options["chunk_size"]])
+            if not chunk:
+                break
+            for availability in chunk:
+                free_availability(availability)
+            freed += len(chunk)
+            logger.info("Freed {} leaked availability slots".format(freed))
+        logger.info("Freed {} availability slots".format(freed))
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_alter_visithistory_physician_notes_and_more'),
+        ('users', '0015_remove_testresult_patient_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='status',
+            field=models.CharField(choices=[('Cancelled', 'Cancelled'), ('Pending', 'Pending'), ('Accepted', 'Accepted'), ('Active', 'Active'), ('Completed', 'Completed'), ('Expired', 'Expired'), ('No Show', 'No Show')], default='Pending', max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'end_time'], name='appointment_status_e5951b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='availability',
+            index=models.Index(fields=['medical_professional', 'is_booked', 'start_time'], name='appointment_medical_184c90_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='availability',
+            index=models.Index(fields=['is_booked', 'end_time'], name='appointment_is_book_d2417b_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_alter_appointment_status_and_more'),
+        ('users', '0015_remove_testresult_patient_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='visithistory',
+            name='appointment',
+            field=models.OneToOneField(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='appointments.appointment'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', '-created_at'], name='appointment_patient_de4f7c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['medical_professional', '-created_at'], name='appointment_medical_c082c7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visithistory',
+            index=models.Index(fields=['patient', '-visit_date'], name='appointment_patient_c49c2d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visithistory',
+            index=models.Index(fields=['medical_professional', '-visit_date'], name='appointment_medical_5a1103_idx'),
+        ),
+    ]
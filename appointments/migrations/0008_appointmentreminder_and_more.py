@@ -0,0 +1,37 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:32
+
+import django.db.models.deletion
+import users.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_alter_visithistory_appointment_and_more'),
+        ('users', '0015_remove_testresult_patient_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentReminder',
+            fields=[
+                ('id', models.UUIDField(default=users.utils.get_uuid, editable=False, primary_key=True, serialize=False)),
+                ('window', models.PositiveIntegerField()),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'start_time'], name='appointment_status_74937b_idx'),
+        ),
+        migrations.AddField(
+            model_name='appointmentreminder',
+            name='appointment',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='appointments.appointment'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointmentreminder',
+            constraint=models.UniqueConstraint(fields=('appointment', 'window'), name='unique_appointment_reminder_window'),
+        ),
+    ]
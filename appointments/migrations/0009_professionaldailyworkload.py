@@ -0,0 +1,59 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:42
+
+import django.db.models.deletion
+import users.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0008_appointmentreminder_and_more'),
+        ('users', '0017_vital_signs_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfessionalDailyWorkload',
+            fields=[
+                ('id', models.UUIDField(default=users.utils.get_uuid, editable=False, primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('appointments', models.PositiveIntegerField(default=0)),
+                ('pending', models.PositiveIntegerField(default=0)),
+                ('accepted', models.PositiveIntegerField(default=0)),
+                ('active', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('cancelled', models.PositiveIntegerField(default=0)),
+                ('expired', models.PositiveIntegerField(default=0)),
+                ('no_show', models.PositiveIntegerField(default=0)),
+                ('patients', models.PositiveIntegerField(default=0)),
+                ('booked_minutes', models.PositiveIntegerField(default=0)),
+                ('available_minutes', models.PositiveIntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['day'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['start_time'], name='appointment_start_t_fb73a8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='availability',
+            index=models.Index(fields=['start_time', 'end_time'], name='appointment_start_t_6c3ad0_idx'),
+        ),
+        migrations.AddField(
+            model_name='professionaldailyworkload',
+            name='medical_professional',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_workloads', to='users.medicalprofessional'),
+        ),
+        migrations.AddIndex(
+            model_name='professionaldailyworkload',
+            index=models.Index(fields=['day'], name='appointment_day_d1b6ad_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='professionaldailyworkload',
+            constraint=models.UniqueConstraint(fields=('medical_professional', 'day'), name='unique_professional_daily_workload'),
+        ),
+    ]
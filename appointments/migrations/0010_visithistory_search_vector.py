@@ -0,0 +1,50 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:43
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+CREATE_TRIGGER_SQL = """
+CREATE FUNCTION appointments_visithistory_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.reason_for_visit, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.treatments_received, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.physician_notes, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER appointments_visithistory_search_vector_update
+BEFORE INSERT OR UPDATE OF reason_for_visit, treatments_received, physician_notes
+ON appointments_visithistory FOR EACH ROW EXECUTE FUNCTION appointments_visithistory_search_vector_update();
+
+UPDATE appointments_visithistory SET reason_for_visit = reason_for_visit;
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS appointments_visithistory_search_vector_update ON appointments_visithistory;
+DROP FUNCTION IF EXISTS appointments_visithistory_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0009_professionaldailyworkload'),
+        ('users', '0018_medicalhistory_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visithistory',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER_SQL, DROP_TRIGGER_SQL),
+        migrations.AddIndex(
+            model_name='visithistory',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='visithistory_search_gin'),
+        ),
+    ]
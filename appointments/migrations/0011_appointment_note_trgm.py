@@ -0,0 +1,20 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:46
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0010_visithistory_search_vector'),
+        ('users', '0019_user_search_text'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('note'), name='gin_trgm_ops'), name='appointment_note_trgm'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0011_appointment_note_trgm'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='medicalupload',
+            name='visit_history',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='appointments.visithistory'),
+        ),
+        migrations.AlterField(
+            model_name='testresult',
+            name='visit_history',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='test_results', to='appointments.visithistory'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:55
+
+import django.db.models.deletion
+import users.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0012_visit_history_test_results_and_uploads'),
+        ('users', '0019_user_search_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabObservation',
+            fields=[
+                ('id', models.UUIDField(default=users.utils.get_uuid, editable=False, primary_key=True, serialize=False)),
+                ('analyte_code', models.CharField(max_length=32)),
+                ('analyte_name', models.CharField(blank=True, default='', max_length=255)),
+                ('value', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('unit', models.CharField(blank=True, default='', max_length=32)),
+                ('reference_low', models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True)),
+                ('reference_high', models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True)),
+                ('flag', models.GeneratedField(db_persist=True, expression=models.Case(models.When(then=models.Value('L'), value__lt=models.F('reference_low')), models.When(then=models.Value('H'), value__gt=models.F('reference_high')), default=models.Value('N')), output_field=models.CharField(choices=[('L', 'Low'), ('N', 'Normal'), ('H', 'High')], max_length=1))),
+                ('observed_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lab_observations', to='users.patient')),
+                ('visit_history', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lab_observations', to='appointments.visithistory')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', 'analyte_code', 'observed_at'], name='appointment_patient_62d1c6_idx'), models.Index(fields=['analyte_code', 'observed_at'], name='appointment_analyte_a00170_idx'), models.Index(condition=models.Q(('flag', 'N'), _negated=True), fields=['analyte_code', 'flag', 'observed_at'], name='labobservation_abnormal')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.3 on 2026-10-19 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0015_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='availability',
+            name='parent_end_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='availability',
+            name='parent_start_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.3 on 2026-10-19 12:48
+
+import django.db.models.deletion
+import users.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0016_availability_parent_bounds'),
+        ('users', '0022_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfessionalWorkloadChange',
+            fields=[
+                ('id', models.UUIDField(default=users.utils.get_uuid, editable=False, primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('changed_at', models.DateTimeField()),
+                ('medical_professional', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='users.medicalprofessional')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='professionalworkloadchange',
+            constraint=models.UniqueConstraint(fields=('medical_professional', 'day'), name='unique_professional_workload_change'),
+        ),
+    ]
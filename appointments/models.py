@@ -1,9 +1,14 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Upper
 from appointments.choices import (
     BOOKING_STATUS,
+    EXPORT_STATUS,
+    LAB_FLAG,
 )
 from users.utils import get_uuid
-from users.models import MedicalProfessional, Patient
+from users.models import MedicalProfessional, Patient, User
 from users.utils import (
     medical_upload_file_name,
 )
@@ -20,9 +25,21 @@ class Availability(models.Model):
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
     is_booked = models.BooleanField(default=False)
+    # bounds of the free slot a booked slot was cut from, given back when it
+    # is freed, see appointments.utils.free_availability
+    parent_start_time = models.DateTimeField(null=True, blank=True)
+    parent_end_time = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name_plural = "Availabilities"
+        indexes = [
+            models.Index(
+                fields=["medical_professional", "is_booked", "start_time"]
+            ),
+            models.Index(fields=["is_booked", "end_time"]),
+            models.Index(fields=["start_time", "end_time"]),
+        ]
 
 
 class Appointment(models.Model):
@@ -44,16 +61,118 @@ class Appointment(models.Model):
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "end_time"]),
+            models.Index(fields=["status", "start_time"]),
+            models.Index(fields=["patient", "-created_at"]),
+            models.Index(fields=["medical_professional", "-created_at"]),
+            models.Index(fields=["start_time"]),
+            # serves the case-insensitive note search of the admin
+            GinIndex(
+                OpClass(Upper("note"), name="gin_trgm_ops"),
+                name="appointment_note_trgm",
+            ),
+        ]
+
+
+class AppointmentReminder(models.Model):
+    """Marks a reminder as sent so each window is only mailed once."""
+
+    id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.CASCADE,
+        related_name="reminders",
+        db_constraint=False,
+    )
+    # minutes before the appointment start time
+    window = models.PositiveIntegerField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["appointment", "window"],
+                name="unique_appointment_reminder_window",
+            )
+        ]
+
+
+class ProfessionalDailyWorkload(models.Model):
+    """Precomputed appointment counts and hours of a medical professional for
+    one day, see appointments.workload."""
+
+    id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
+    medical_professional = models.ForeignKey(
+        MedicalProfessional,
+        on_delete=models.CASCADE,
+        related_name="daily_workloads",
+    )
+    day = models.DateField()
+    appointments = models.PositiveIntegerField(default=0)
+    pending = models.PositiveIntegerField(default=0)
+    accepted = models.PositiveIntegerField(default=0)
+    active = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+    expired = models.PositiveIntegerField(default=0)
+    no_show = models.PositiveIntegerField(default=0)
+    patients = models.PositiveIntegerField(default=0)
+    booked_minutes = models.PositiveIntegerField(default=0)
+    available_minutes = models.PositiveIntegerField(default=0)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["day"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["medical_professional", "day"],
+                name="unique_professional_daily_workload",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["day"]),
+        ]
+
+
+class ProfessionalWorkloadChange(models.Model):
+    """A day of a medical professional whose ProfessionalDailyWorkload row is
+    out of date. Writes to appointments and availability mark their days,
+    and the marks are cleared once the rows are recomputed, see
+    appointments.workload."""
+
+    id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
+    # no constraint as the professional may be deleted along with the
+    # appointments that marked the day
+    medical_professional = models.ForeignKey(
+        MedicalProfessional,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+    )
+    day = models.DateField()
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["medical_professional", "day"],
+                name="unique_professional_workload_change",
+            )
+        ]
 
 
 # Define model for Visit History
 class VisitHistory(models.Model):
     id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
+    # Appointment can be range partitioned on created_at (see
+    # appointments.partitioning), so no foreign key constraint may point at it.
     appointment = models.OneToOneField(
-        Appointment, on_delete=models.SET_NULL, null=True
+        Appointment, on_delete=models.SET_NULL, null=True, db_constraint=False
     )
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
     medical_professional = models.ForeignKey(
@@ -65,6 +184,17 @@ class VisitHistory(models.Model):
     reason_for_visit = models.TextField(null=True, blank=True)
     treatments_received = models.TextField(null=True, blank=True)
     physician_notes = models.TextField(null=True, blank=True)
+    # also moved by changes to the test results and uploads, see users.sync
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # kept up to date by a database trigger, see appointments.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name="visithistory_search_gin"),
+            models.Index(fields=["patient", "-visit_date"]),
+            models.Index(fields=["medical_professional", "-visit_date"]),
+        ]
 
     def __str__(self):
         return (
@@ -76,7 +206,9 @@ class VisitHistory(models.Model):
 class TestResult(models.Model):
     id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
-    visit_history = models.ForeignKey(VisitHistory, on_delete=models.CASCADE)
+    visit_history = models.ForeignKey(
+        VisitHistory, on_delete=models.CASCADE, related_name="test_results"
+    )
     blood_tests = models.TextField()
     imaging_studies = models.TextField()
     electrocardiogram = models.TextField()
@@ -86,8 +218,91 @@ class TestResult(models.Model):
 class MedicalUpload(models.Model):
     id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
     visit_history = models.ForeignKey(
-        VisitHistory, on_delete=models.CASCADE, related_name="test_results"
+        VisitHistory, on_delete=models.CASCADE, related_name="uploads"
     )
     upload = models.FileField(
         upload_to=medical_upload_file_name, max_length=500
     )
+
+
+class LabObservation(models.Model):
+    """A single numeric laboratory result, e.g. the HbA1c of a blood test.
+    `flag` is computed by the database from the reference range, so
+    abnormal results are found with a plain indexed filter."""
+
+    id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
+    patient = models.ForeignKey(
+        Patient, on_delete=models.CASCADE, related_name="lab_observations"
+    )
+    visit_history = models.ForeignKey(
+        VisitHistory,
+        on_delete=models.CASCADE,
+        related_name="lab_observations",
+    )
+    # LOINC code where the lab sends one, e.g. 4548-4 for HbA1c
+    analyte_code = models.CharField(max_length=32)
+    analyte_name = models.CharField(max_length=255, blank=True, default="")
+    value = models.DecimalField(max_digits=12, decimal_places=4)
+    unit = models.CharField(max_length=32, blank=True, default="")
+    reference_low = models.DecimalField(
+        max_digits=12, decimal_places=4, null=True, blank=True
+    )
+    reference_high = models.DecimalField(
+        max_digits=12, decimal_places=4, null=True, blank=True
+    )
+    flag = models.GeneratedField(
+        expression=models.Case(
+            models.When(
+                value__lt=models.F("reference_low"),
+                then=models.Value(LAB_FLAG.LOW),
+            ),
+            models.When(
+                value__gt=models.F("reference_high"),
+                then=models.Value(LAB_FLAG.HIGH),
+            ),
+            default=models.Value(LAB_FLAG.NORMAL),
+        ),
+        output_field=models.CharField(max_length=1, choices=LAB_FLAG.choices),
+        db_persist=True,
+    )
+    observed_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["patient", "analyte_code", "observed_at"]),
+            models.Index(fields=["analyte_code", "observed_at"]),
+            models.Index(
+                fields=["analyte_code", "flag", "observed_at"],
+                condition=~models.Q(flag=LAB_FLAG.NORMAL),
+                name="labobservation_abnormal",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.analyte_code} {self.value} {self.unit}".strip()
+
+
+class BulkExport(models.Model):
+    """A bulk export of patient data, written by a Celery task as one
+    gzipped NDJSON file per resource type, see appointments.bulk_export."""
+
+    id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
+    requested_by = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="bulk_exports"
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=EXPORT_STATUS.choices,
+        default=EXPORT_STATUS.PENDING,
+    )
+    resource_types = models.JSONField(default=list)
+    since = models.DateTimeField(null=True, blank=True)
+    # type, storage file name and row count of every file written
+    output = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
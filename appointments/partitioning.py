@@ -0,0 +1,403 @@
+"""
+Monthly range partitioning of the appointment table on created_at.
+
+The live table is converted online: a partitioned copy is created, a
+trigger mirrors every write on the live table into it while existing rows
+are copied over in chunks, and the two tables are swapped under a short
+lock once the copy has caught up.
+"""
+
+import hashlib
+import re
+from datetime import date
+
+from django.db import connection, transaction
+from django.utils import timezone
+from appointments.models import Appointment, VisitHistory
+from users.models import Tombstone
+
+TABLE = Appointment._meta.db_table
+PARTITION_KEY = "created_at"
+PARTITIONED_TABLE = f"{TABLE}_partitioned"
+UNPARTITIONED_TABLE = f"{TABLE}_unpartitioned"
+DEFAULT_PARTITION = f"{TABLE}_pdefault"
+MIRROR_FUNCTION = f"{TABLE}_mirror"
+
+INDEX_DEF_RE = re.compile(r"^CREATE (UNIQUE )?INDEX \S+ ON \S+ (USING .*)$")
+PARTITION_NAME_RE = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def add_months(month: date, months: int) -> date:
+    year, month_index = divmod(month.month - 1 + months, 12)
+    return date(month.year + year, month_index + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_p{month:%Y_%m}"
+
+
+def _temp_name(prefix: str, name: str) -> str:
+    return f"{prefix}_{hashlib.md5(name.encode()).hexdigest()[:20]}"
+
+
+def is_partitioned(cursor, table=TABLE) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+        [table],
+    )
+    return cursor.fetchone() is not None
+
+
+def create_month_partition(cursor, month: date, table=TABLE):
+    """Create the partition of `table` for `month`. Rows of the month
+    already in the default partition, which would stop the partition from
+    being created, are moved into it."""
+    name = partition_name(month)
+    start = f"{month:%Y-%m-%d} 00:00:00+00"
+    end = f"{add_months(month, 1):%Y-%m-%d} 00:00:00+00"
+    cursor.execute(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+        f"WHERE {PARTITION_KEY} >= %s AND {PARTITION_KEY} < %s)",
+        [start, end],
+    )
+    (in_default,) = cursor.fetchone()
+    if not in_default:
+        cursor.execute(
+            f"CREATE TABLE {name} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+        return
+
+    # no new rows may reach the default partition until they can go to the
+    # new one
+    cursor.execute(f"LOCK TABLE {DEFAULT_PARTITION} IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(
+        f"CREATE TABLE {name} (LIKE {table} "
+        "INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)"
+    )
+    cursor.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE {PARTITION_KEY} >= %s AND {PARTITION_KEY} < %s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+        """,
+        [start, end],
+    )
+    cursor.execute(
+        f"ALTER TABLE {table} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+
+
+def create_month_partitions(
+    cursor, first_month: date, last_month: date, table=TABLE
+):
+    """Create the monthly partitions of `table` from `first_month` to
+    `last_month`, both included. Existing partitions are left alone."""
+    month = first_month.replace(day=1)
+    while month <= last_month:
+        cursor.execute("SELECT to_regclass(%s)", [partition_name(month)])
+        if cursor.fetchone()[0] is None:
+            create_month_partition(cursor, month, table)
+        month = add_months(month, 1)
+
+
+def ensure_future_partitions(months_ahead: int) -> bool:
+    """Make sure the coming months have a partition so new rows never land
+    in the default partition. Does nothing until the table is
+    partitioned."""
+    if connection.vendor != "postgresql":
+        return False
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return False
+        this_month = timezone.now().date().replace(day=1)
+        create_month_partitions(
+            cursor, this_month, add_months(this_month, months_ahead)
+        )
+    return True
+
+
+def get_partitions(cursor) -> list:
+    """Monthly partitions of the appointment table as (month, name) pairs,
+    oldest first."""
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = %s::regclass",
+        [TABLE],
+    )
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            partitions.append((month, name))
+    return sorted(partitions)
+
+
+def _get_columns(cursor, table) -> list:
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_name = %s ORDER BY ordinal_position",
+        [table],
+    )
+    return [column for (column,) in cursor.fetchall()]
+
+
+def _get_indexes(cursor, table) -> list:
+    """Non primary key indexes of `table` as (name, definition) pairs."""
+    cursor.execute(
+        "SELECT index_class.relname, pg_get_indexdef(pg_index.indexrelid) "
+        "FROM pg_index "
+        "JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid "
+        "WHERE pg_index.indrelid = %s::regclass AND NOT pg_index.indisprimary",
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def _get_constraints(cursor, table, types) -> list:
+    """Constraints of `table` as (name, type, definition) triples."""
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) "
+        "FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = ANY(%s)",
+        [table, list(types)],
+    )
+    return cursor.fetchall()
+
+
+def _get_referencing_constraints(cursor, table) -> list:
+    cursor.execute(
+        "SELECT conname, conrelid::regclass::text FROM pg_constraint "
+        "WHERE confrelid = %s::regclass AND contype = 'f'",
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def check_can_partition(cursor):
+    if connection.vendor != "postgresql":
+        raise PartitioningError("Partitioning needs a PostgreSQL database.")
+    if is_partitioned(cursor):
+        raise PartitioningError(f"{TABLE} is already partitioned.")
+
+    referencing = _get_referencing_constraints(cursor, TABLE)
+    if referencing:
+        raise PartitioningError(
+            "Foreign key constraints point at {}: {}. Declare those "
+            "relations with db_constraint=False first.".format(
+                TABLE,
+                ", ".join(f"{name} on {table}" for name, table in referencing),
+            )
+        )
+    for name, definition in _get_indexes(cursor, TABLE):
+        if definition.startswith("CREATE UNIQUE") and (
+            PARTITION_KEY not in definition
+        ):
+            raise PartitioningError(
+                f"Unique index {name} does not include {PARTITION_KEY}."
+            )
+
+
+def create_partitioned_table(months_ahead: int):
+    """Create the partitioned copy of the appointment table with all of its
+    indexes and constraints under temporary names, and start mirroring
+    writes into it."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        check_can_partition(cursor)
+
+        cursor.execute(
+            f"CREATE TABLE {PARTITIONED_TABLE} (LIKE {TABLE} "
+            "INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) "
+            f"PARTITION BY RANGE ({PARTITION_KEY})"
+        )
+        ((primary_key, _, _),) = _get_constraints(cursor, TABLE, "p")
+        cursor.execute(
+            f"ALTER TABLE {PARTITIONED_TABLE} ADD CONSTRAINT "
+            f"{_temp_name('part', primary_key)} "
+            f"PRIMARY KEY (id, {PARTITION_KEY})"
+        )
+        cursor.execute(
+            f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF "
+            f"{PARTITIONED_TABLE} DEFAULT"
+        )
+
+        cursor.execute(f"SELECT min({PARTITION_KEY}) FROM {TABLE}")
+        (oldest,) = cursor.fetchone()
+        this_month = timezone.now().date().replace(day=1)
+        create_month_partitions(
+            cursor,
+            oldest.date().replace(day=1) if oldest else this_month,
+            add_months(this_month, months_ahead),
+            table=PARTITIONED_TABLE,
+        )
+
+        for name, definition in _get_indexes(cursor, TABLE):
+            match = INDEX_DEF_RE.match(definition)
+            cursor.execute(
+                "CREATE {}INDEX {} ON {} {}".format(
+                    match.group(1) or "",
+                    _temp_name("part", name),
+                    PARTITIONED_TABLE,
+                    match.group(2),
+                )
+            )
+        for name, _, definition in _get_constraints(cursor, TABLE, "f"):
+            cursor.execute(
+                f"ALTER TABLE {PARTITIONED_TABLE} ADD CONSTRAINT "
+                f"{_temp_name('part', name)} {definition}"
+            )
+
+        columns = _get_columns(cursor, TABLE)
+        assignments = ", ".join(
+            f"{column} = EXCLUDED.{column}" for column in columns
+        )
+        cursor.execute(f"""
+            CREATE FUNCTION {MIRROR_FUNCTION}() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    DELETE FROM {PARTITIONED_TABLE}
+                    WHERE id = OLD.id
+                    AND {PARTITION_KEY} = OLD.{PARTITION_KEY};
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO {PARTITIONED_TABLE} VALUES (NEW.*)
+                    ON CONFLICT (id, {PARTITION_KEY})
+                    DO UPDATE SET {assignments};
+                END IF;
+                RETURN NULL;
+            END $$
+            """)
+        cursor.execute(
+            f"CREATE TRIGGER {MIRROR_FUNCTION} "
+            f"AFTER INSERT OR UPDATE OR DELETE ON {TABLE} "
+            f"FOR EACH ROW EXECUTE FUNCTION {MIRROR_FUNCTION}()"
+        )
+
+
+def copy_rows(chunk_size: int, after=None):
+    """Copy the next `chunk_size` rows, in (created_at, id) order, into the
+    partitioned table. Rows already mirrored by the trigger are newer and are
+    kept. The rows are locked while they are copied, so a row deleted after
+    the batch is read waits for the copy, and its mirrored delete then
+    removes the copy, while a row deleted before is skipped rather than
+    brought back. Returns the number of rows read and the key to resume
+    after."""
+    condition, params = "", []
+    if after:
+        condition = f"WHERE ({PARTITION_KEY}, id) > (%s, %s)"
+        params = list(after)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH batch AS (
+                SELECT * FROM {TABLE} {condition}
+                ORDER BY {PARTITION_KEY}, id LIMIT %s
+                FOR SHARE
+            ), copied AS (
+                INSERT INTO {PARTITIONED_TABLE} SELECT * FROM batch
+                ON CONFLICT DO NOTHING
+            )
+            SELECT {PARTITION_KEY}, id, count(*) OVER () FROM batch
+            ORDER BY {PARTITION_KEY} DESC, id DESC LIMIT 1
+            """,
+            params + [chunk_size],
+        )
+        row = cursor.fetchone()
+    if not row:
+        return 0, after
+    return row[2], (row[0], row[1])
+
+
+def swap_tables():
+    """Put the partitioned table in place of the live one. The old table is
+    kept, without its foreign keys, as appointments_appointment_unpartitioned
+    until it is dropped by hand."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"DROP TRIGGER {MIRROR_FUNCTION} ON {TABLE}")
+        cursor.execute(f"DROP FUNCTION {MIRROR_FUNCTION}()")
+
+        indexes = [name for name, _ in _get_indexes(cursor, TABLE)]
+        constraints = _get_constraints(cursor, TABLE, "fp")
+        for name in indexes:
+            cursor.execute(
+                f"ALTER INDEX {name} RENAME TO {_temp_name('unpart', name)}"
+            )
+        for name, constraint_type, _ in constraints:
+            # left in place, the old foreign keys would block deleting the
+            # patients and medical professionals they point at
+            if constraint_type == "f":
+                cursor.execute(f"ALTER TABLE {TABLE} DROP CONSTRAINT {name}")
+            else:
+                cursor.execute(
+                    f"ALTER TABLE {TABLE} RENAME CONSTRAINT {name} "
+                    f"TO {_temp_name('unpart', name)}"
+                )
+        cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {UNPARTITIONED_TABLE}")
+
+        cursor.execute(f"ALTER TABLE {PARTITIONED_TABLE} RENAME TO {TABLE}")
+        for name in indexes:
+            cursor.execute(
+                f"ALTER INDEX {_temp_name('part', name)} RENAME TO {name}"
+            )
+        for name, _, _ in constraints:
+            cursor.execute(
+                f"ALTER TABLE {TABLE} RENAME CONSTRAINT "
+                f"{_temp_name('part', name)} TO {name}"
+            )
+
+
+def unlink_visit_histories(partition: str, chunk_size: int) -> int:
+    """Apply the SET_NULL of VisitHistory.appointment to the visit
+    histories of the appointments in `partition`, a chunk at a time."""
+    visit_history_table = VisitHistory._meta.db_table
+    unlinked = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {visit_history_table} SET appointment_id = NULL
+                WHERE id IN (
+                    SELECT visit_history.id
+                    FROM {visit_history_table} visit_history
+                    JOIN {partition} appointment
+                    ON appointment.id = visit_history.appointment_id
+                    LIMIT %s
+                )
+                """,
+                [chunk_size],
+            )
+            if not cursor.rowcount:
+                return unlinked
+            unlinked += cursor.rowcount
+
+
+def detach_partition(partition: str, drop: bool = False):
+    with transaction.atomic(), connection.cursor() as cursor:
+        # the rows leave the API as if deleted, see users.sync
+        cursor.execute(
+            f"""
+            INSERT INTO {Tombstone._meta.db_table}
+            (id, model, object_id, patient_id, medical_professional_id,
+            deleted_at)
+            SELECT gen_random_uuid(), %s, id, patient_id,
+            medical_professional_id, now()
+            FROM {partition}
+            """,
+            [Appointment._meta.label_lower],
+        )
+        cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {partition}")
+        if drop:
+            cursor.execute(f"DROP TABLE {partition}")
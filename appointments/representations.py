@@ -0,0 +1,53 @@
+"""
+Fast read path of the appointment list endpoints, see users.representations.
+"""
+
+from users.representations import (
+    format_datetime,
+    get_medical_professional_representations,
+    get_patient_representations,
+)
+
+APPOINTMENT_FIELDS = (
+    "id",
+    "patient_id",
+    "medical_professional_id",
+    "note",
+    "status",
+    "start_time",
+    "end_time",
+    "created_at",
+)
+# updated_at of the appointment and of the rows it nests, see users.sync
+# and users.versions
+APPOINTMENT_DELTA_FIELDS = (
+    "updated_at",
+    "patient__updated_at",
+    "medical_professional__updated_at",
+)
+
+
+def represent_appointments(rows, request=None) -> list:
+    """AppointmentSerializer of the appointments read with
+    APPOINTMENT_FIELDS."""
+    patients = get_patient_representations(
+        {row["patient_id"] for row in rows}, request
+    )
+    medical_professionals = get_medical_professional_representations(
+        {row["medical_professional_id"] for row in rows}, request
+    )
+    return [
+        {
+            "id": str(row["id"]),
+            "patient": patients[row["patient_id"]],
+            "medical_professional": medical_professionals[
+                row["medical_professional_id"]
+            ],
+            "note": row["note"],
+            "status": row["status"],
+            "start_time": format_datetime(row["start_time"]),
+            "end_time": format_datetime(row["end_time"]),
+            "created_at": format_datetime(row["created_at"]),
+        }
+        for row in rows
+    ]
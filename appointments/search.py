@@ -0,0 +1,89 @@
+"""
+Full-text search over visit histories and medical histories.
+
+Both tables carry a `search_vector` column that a database trigger rebuilds
+whenever the searched text changes (see the migrations adding it), with a
+GIN index on it. Searches match the vector against a websearch query, so
+they never scan the text itself, and are limited to the patients the
+requesting medical professional has an appointment or visit with.
+"""
+
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchRank,
+)
+from django.db.models import Exists, F, OuterRef, Value
+from django.db.models.functions import Coalesce, Concat
+from appointments.models import Appointment, VisitHistory
+from users.models import MedicalHistory
+
+# must match the configuration used by the search vector triggers
+SEARCH_CONFIG = "english"
+HEADLINE_OPTIONS = {
+    "start_sel": "<mark>",
+    "stop_sel": "</mark>",
+    "max_fragments": 3,
+    "fragment_delimiter": " … ",
+}
+VISIT_HISTORY_SEARCH_FIELDS = (
+    "reason_for_visit",
+    "treatments_received",
+    "physician_notes",
+)
+MEDICAL_HISTORY_SEARCH_FIELDS = ("medical_conditions", "medications")
+
+
+def _is_doctors_patient(doctor):
+    """Condition on a queryset with a `patient` field keeping only the
+    patients `doctor` has an appointment or a visit with."""
+    return Exists(
+        Appointment.objects.filter(
+            patient=OuterRef("patient"), medical_professional=doctor
+        )
+    ) | Exists(
+        VisitHistory.objects.filter(
+            patient=OuterRef("patient"), medical_professional=doctor
+        )
+    )
+
+
+def _searched_text(fields):
+    text = []
+    for field in fields:
+        text += [Coalesce(field, Value("")), Value("\n")]
+    return Concat(*text[:-1])
+
+
+def _search(queryset, text: str, fields):
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+    return (
+        queryset.filter(search_vector=query)
+        .annotate(
+            rank=SearchRank(F("search_vector"), query),
+            # only computed for the rows of the returned page
+            headline=SearchHeadline(
+                _searched_text(fields),
+                query,
+                config=SEARCH_CONFIG,
+                **HEADLINE_OPTIONS,
+            ),
+        )
+        .order_by("-rank", "-pk")
+    )
+
+
+def search_visit_histories(doctor, text: str):
+    return _search(
+        VisitHistory.objects.filter(_is_doctors_patient(doctor)),
+        text,
+        VISIT_HISTORY_SEARCH_FIELDS,
+    )
+
+
+def search_medical_histories(doctor, text: str):
+    return _search(
+        MedicalHistory.objects.filter(_is_doctors_patient(doctor)),
+        text,
+        MEDICAL_HISTORY_SEARCH_FIELDS,
+    )
@@ -1,15 +1,35 @@
+from django.conf import settings
+from django.urls import reverse
 from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 from appointments.models import (
     Availability,
     Appointment,
     VisitHistory,
     TestResult,
+    MedicalUpload,
+    LabObservation,
+    BulkExport,
 )
 from datetime import timedelta
-from appointments.choices import BOOKING_STATUS
+from appointments.choices import BOOKING_STATUS, LAB_FLAG, VISIT_STATUSES
+from appointments.bulk_export import RESOURCES
+from appointments.lab_import import FORMATS, get_file_format
+from appointments.spreadsheets import WRITERS
+from appointments.tasks import send_appointment_status_mails
+from appointments.utils import (
+    book_availability,
+    can_transition,
+    create_visit_histories,
+    get_source_statuses,
+    release_availability,
+)
+from appointments.workload import mark_workload_of
+from users.chart import invalidate_patient_chart
 from users.serializers import PatientSerializer, MedicalProfessionalSerializer
-from users.models import MedicalProfessional
+from users.choices import ROLLUP_RESOLUTION
+from users.models import MedicalHistory, MedicalProfessional
 from users.tasks import (
     send_appointment_booking_mail,
     send_appointment_update_mail,
@@ -81,6 +101,34 @@ class AppointmentSerializer(serializers.ModelSerializer):
         start_time = attrs["start_time"]
         end_time = attrs["end_time"]
 
+        if (
+            self.instance
+            and "status" in attrs
+            and not can_transition(self.instance.status, attrs["status"])
+        ):
+            raise serializers.ValidationError(
+                {
+                    "status": "Cannot change appointment status from {} to "
+                    "{}.".format(self.instance.status, attrs["status"])
+                }
+            )
+        # moving an appointment to another medical professional makes it
+        # Pending again
+        if (
+            self.instance
+            and medical_professional.id
+            != self.instance.medical_professional_id
+            and not can_transition(
+                self.instance.status, BOOKING_STATUS.PENDING
+            )
+        ):
+            raise serializers.ValidationError(
+                {
+                    "medical_professional_id": "Only pending appointments can "
+                    "be moved to another medical professional."
+                }
+            )
+
         is_status_update = bool(attrs.get("is_status_update"))
         if not is_status_update:
             if start_time > end_time:
@@ -111,50 +159,9 @@ class AppointmentSerializer(serializers.ModelSerializer):
         availability: Availability = validated_data["availability"]
 
         with transaction.atomic():
-            # Calculate the difference in days between the appointment and
-            # the availability
-            appointment_duration = (
-                appointment_end_time - appointment_start_time
-            ).days
-            availability_duration = (
-                availability.end_time - availability.start_time
-            ).days
-
-            # If the appointment covers the entire availability period,
-            # mark it as booked
-            if appointment_duration == availability_duration:
-                availability.is_booked = True
-                availability.save()
-            else:
-                # check if there are free days prior to user appointment
-                # start date
-                if (appointment_start_time - availability.start_time).days > 0:
-                    prev_day = appointment_start_time - timedelta(days=1)
-                    Availability.objects.create(
-                        medical_professional=medical_professional,
-                        start_time=availability.start_time,
-                        end_time=prev_day.replace(
-                            hour=22, minute=59, second=0, microsecond=0
-                        ),
-                    )
-
-                # Create a new availability for the remaining days after
-                if (
-                    appointment_end_time + timedelta(days=1)
-                    <= availability.end_time
-                ):
-                    next_day = appointment_end_time + timedelta(days=1)
-                    Availability.objects.create(
-                        medical_professional=medical_professional,
-                        start_time=next_day.replace(
-                            hour=0, minute=0, second=0, microsecond=0
-                        ),
-                        end_time=availability.end_time,
-                    )
-                availability.start_time = appointment_start_time
-                availability.end_time = appointment_end_time
-                availability.is_booked = True
-                availability.save()
+            book_availability(
+                availability, appointment_start_time, appointment_end_time
+            )
 
             # create appointment
             appointment = Appointment.objects.create(
@@ -185,29 +192,56 @@ class AppointmentSerializer(serializers.ModelSerializer):
             return appointment
 
     def update(self, instance: Appointment, validated_data):
-        instance.status = validated_data.get("status", instance.status)
-        if (
-            validated_data.get("medical_professional_id").id
-            != instance.medical_professional.id
-        ):
-            instance.status = BOOKING_STATUS.PENDING
-        instance.medical_professional = validated_data.get(
-            "medical_professional_id", instance.medical_professional
-        )
-        instance.start_time = validated_data.get(
-            "start_time", instance.start_time
-        )
-        instance.end_time = validated_data.get("end_time", instance.end_time)
-        instance.note = validated_data.get("note", instance.note)
-        instance.save()
-
-        vh, _ = VisitHistory.objects.get_or_create(
-            appointment=instance,
-            medical_professional=instance.medical_professional,
-            patient=instance.patient,
-        )
-        vh.visit_date = instance.start_time
-        vh.save()
+        with transaction.atomic():
+            is_cancellation = (
+                instance.status != BOOKING_STATUS.CANCELLED
+                and validated_data.get("status") == BOOKING_STATUS.CANCELLED
+            )
+            medical_professional = validated_data["medical_professional_id"]
+            start_time = validated_data.get("start_time", instance.start_time)
+            end_time = validated_data.get("end_time", instance.end_time)
+            is_move = (
+                medical_professional.id != instance.medical_professional_id
+                or start_time != instance.start_time
+                or end_time != instance.end_time
+            )
+            if is_cancellation:
+                release_availability(instance)
+            elif is_move and instance.status != BOOKING_STATUS.CANCELLED:
+                # booked before the old booking is freed, which could merge
+                # the slot found by validate into the freed one
+                if "availability" in validated_data:
+                    book_availability(
+                        validated_data["availability"], start_time, end_time
+                    )
+                release_availability(instance)
+
+            instance.status = validated_data.get("status", instance.status)
+            if (
+                validated_data.get("medical_professional_id").id
+                != instance.medical_professional.id
+            ):
+                instance.status = BOOKING_STATUS.PENDING
+            instance.medical_professional = validated_data.get(
+                "medical_professional_id", instance.medical_professional
+            )
+            instance.start_time = validated_data.get(
+                "start_time", instance.start_time
+            )
+            instance.end_time = validated_data.get(
+                "end_time", instance.end_time
+            )
+            instance.note = validated_data.get("note", instance.note)
+            instance.save()
+
+            # the visit history follows a moved appointment
+            visit = VisitHistory.objects.filter(appointment=instance).first()
+            if visit:
+                visit.medical_professional = instance.medical_professional
+                visit.visit_date = instance.start_time.date()
+                visit.save()
+            elif instance.status in VISIT_STATUSES:
+                create_visit_histories([instance.pk])
 
         # email to patient.
         send_appointment_update_mail.delay(
@@ -222,6 +256,103 @@ class AppointmentSerializer(serializers.ModelSerializer):
         return instance
 
 
+class AppointmentBulkStatusSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.UUIDField(), required=False, allow_empty=False
+    )
+    date = serializers.DateField(required=False)
+    status = serializers.ChoiceField(choices=BOOKING_STATUS.choices)
+
+    def validate(self, attrs):
+        if "ids" not in attrs and "date" not in attrs:
+            raise serializers.ValidationError(
+                {"detail": "Provide appointment ids, a date or both."}
+            )
+        return attrs
+
+    def create(self, validated_data):
+        doctor = self.context["request"].user.medicalprofessional
+        status = validated_data["status"]
+        source_statuses = get_source_statuses(status)
+
+        appointment_qs = Appointment.objects.filter(
+            medical_professional=doctor
+        )
+        if "ids" in validated_data:
+            appointment_qs = appointment_qs.filter(
+                id__in=validated_data["ids"]
+            )
+        if "date" in validated_data:
+            appointment_qs = appointment_qs.filter(
+                start_time__date=validated_data["date"]
+            )
+
+        with transaction.atomic():
+            updated_rows = list(
+                appointment_qs.filter(status__in=source_statuses)
+                .select_for_update()
+                .values_list("id", "patient_id")
+            )
+            updated_ids = [
+                appointment_id for appointment_id, _ in updated_rows
+            ]
+            Appointment.objects.filter(
+                id__in=updated_ids, status__in=source_statuses
+            ).update(status=status, updated_at=timezone.now())
+            mark_workload_of(Appointment.objects.filter(id__in=updated_ids))
+            if status in VISIT_STATUSES:
+                create_visit_histories(updated_ids)
+
+            if status == BOOKING_STATUS.CANCELLED:
+                for appointment in Appointment.objects.filter(
+                    id__in=updated_ids
+                ):
+                    release_availability(appointment)
+
+            if updated_ids:
+                transaction.on_commit(
+                    lambda: send_appointment_status_mails.delay(
+                        [str(pk) for pk in updated_ids], status
+                    )
+                )
+                # queryset updates send no signals
+                transaction.on_commit(
+                    lambda: invalidate_patient_chart(
+                        *{patient_id for _, patient_id in updated_rows}
+                    )
+                )
+
+        skipped_ids = set(validated_data.get("ids", [])) - set(updated_ids)
+        return {
+            "status": status,
+            "updated": updated_ids,
+            "skipped": list(skipped_ids),
+        }
+
+
+class WorkloadReportSerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    medical_professional_id = serializers.UUIDField(required=False)
+
+    def validate(self, attrs):
+        end = attrs.setdefault("end", timezone.localdate())
+        start = attrs.setdefault("start", end - timedelta(days=30))
+        if start > end:
+            raise serializers.ValidationError(
+                {"detail": "start must be before end."}
+            )
+        if (end - start).days > settings.WORKLOAD_REPORT_MAX_DAYS:
+            raise serializers.ValidationError(
+                {
+                    "detail": "Reports cover at most {} days.".format(
+                        settings.WORKLOAD_REPORT_MAX_DAYS
+                    )
+                }
+            )
+        return attrs
+
+
 class TestResultSerializer(serializers.ModelSerializer):
     class Meta:
         model = TestResult
@@ -236,8 +367,19 @@ class TestResultSerializer(serializers.ModelSerializer):
         )
 
 
+class MedicalUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MedicalUpload
+        fields = (
+            "id",
+            "visit_history",
+            "upload",
+        )
+
+
 class VisitHistorySerializer(serializers.ModelSerializer):
     test_results = TestResultSerializer(many=True, read_only=True)
+    uploads = MedicalUploadSerializer(many=True, read_only=True)
     # patient_id = serializers.UUIDField(write_only=True)
     appointment = AppointmentSerializer(read_only=True)
 
@@ -254,4 +396,192 @@ class VisitHistorySerializer(serializers.ModelSerializer):
             "treatments_received",
             "physician_notes",
             "test_results",
+            "uploads",
         )
+
+
+class ClinicalSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(min_length=2, max_length=200)
+
+
+class VisitHistorySearchResultSerializer(serializers.ModelSerializer):
+    rank = serializers.FloatField(read_only=True)
+    headline = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = VisitHistory
+        fields = (
+            "id",
+            "appointment",
+            "patient",
+            "medical_professional",
+            "visit_date",
+            "reason_for_visit",
+            "rank",
+            "headline",
+        )
+
+
+class MedicalHistorySearchResultSerializer(serializers.ModelSerializer):
+    rank = serializers.FloatField(read_only=True)
+    headline = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = MedicalHistory
+        fields = (
+            "id",
+            "patient",
+            "medical_conditions",
+            "medications",
+            "created_at",
+            "rank",
+            "headline",
+        )
+
+
+class LabObservationListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        return LabObservation.objects.bulk_create(
+            [LabObservation(**attrs) for attrs in validated_data],
+            batch_size=1000,
+        )
+
+
+class LabObservationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LabObservation
+        list_serializer_class = LabObservationListSerializer
+        fields = (
+            "id",
+            "patient",
+            "visit_history",
+            "analyte_code",
+            "analyte_name",
+            "value",
+            "unit",
+            "reference_low",
+            "reference_high",
+            "flag",
+            "observed_at",
+            "created_at",
+        )
+        read_only_fields = (
+            "id",
+            "patient",
+            "visit_history",
+            "flag",
+            "created_at",
+        )
+
+    def validate(self, attrs):
+        low, high = attrs.get("reference_low"), attrs.get("reference_high")
+        if low is not None and high is not None and low > high:
+            raise serializers.ValidationError(
+                {"detail": "reference_low must not be above reference_high."}
+            )
+        return attrs
+
+
+class LabObservationFilterSerializer(serializers.Serializer):
+    patient_id = serializers.UUIDField(required=False)
+    analyte_code = serializers.CharField(required=False, max_length=32)
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    min_value = serializers.DecimalField(
+        max_digits=12, decimal_places=4, required=False
+    )
+    max_value = serializers.DecimalField(
+        max_digits=12, decimal_places=4, required=False
+    )
+    flag = serializers.ChoiceField(choices=LAB_FLAG.choices, required=False)
+    abnormal = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, attrs):
+        start, end = attrs.get("start"), attrs.get("end")
+        if start and end and start > end:
+            raise serializers.ValidationError(
+                {"detail": "start must be before end."}
+            )
+        return attrs
+
+
+class LabTrendSerializer(LabObservationFilterSerializer):
+    patient_id = serializers.UUIDField()
+    analyte_code = serializers.CharField(max_length=32)
+    resolution = serializers.ChoiceField(
+        choices=ROLLUP_RESOLUTION.choices, default=ROLLUP_RESOLUTION.DAY
+    )
+
+
+class LabImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=FORMATS, required=False)
+
+    def validate(self, attrs):
+        attrs.setdefault("format", get_file_format(attrs["file"].name))
+        return attrs
+
+
+class BulkExportRequestSerializer(serializers.Serializer):
+    types = serializers.CharField(required=False, default="")
+    since = serializers.DateTimeField(required=False)
+
+    def validate_types(self, value):
+        types = [
+            resource_type
+            for resource_type in value.split(",")
+            if resource_type
+        ]
+        invalid = set(types) - set(RESOURCES)
+        if invalid:
+            raise serializers.ValidationError(
+                "Export types out of: {}.".format(", ".join(RESOURCES))
+            )
+        return list(dict.fromkeys(types)) or list(RESOURCES)
+
+
+class BulkExportSerializer(serializers.ModelSerializer):
+    output = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BulkExport
+        fields = (
+            "id",
+            "status",
+            "resource_types",
+            "since",
+            "output",
+            "error",
+            "created_at",
+            "completed_at",
+        )
+        read_only_fields = fields
+
+    def get_output(self, obj: BulkExport):
+        request = self.context["request"]
+        return [
+            {
+                "type": output["type"],
+                "count": output["count"],
+                "url": request.build_absolute_uri(
+                    reverse("bulk_export_file", args=[obj.pk, output["type"]])
+                ),
+            }
+            for output in obj.output
+        ]
+
+
+class SpreadsheetExportSerializer(serializers.Serializer):
+    file_type = serializers.ChoiceField(
+        choices=list(WRITERS), required=False, default="csv"
+    )
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        start, end = attrs.get("start"), attrs.get("end")
+        if start and end and start > end:
+            raise serializers.ValidationError(
+                {"detail": "start must be before end."}
+            )
+        return attrs
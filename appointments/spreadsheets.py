@@ -0,0 +1,244 @@
+"""
+Spreadsheet downloads of staff lists.
+
+Appointments, patients and availability are exported as CSV or XLSX. Rows
+are read as values_list tuples from a server-side cursor a chunk at a time
+and written straight into the response as it streams, so a download starts
+at once and its memory use does not depend on how many rows it holds. XLSX
+files are zipped on the fly into a minimal workbook with inline strings,
+no spreadsheet library is needed.
+"""
+
+import csv
+import itertools
+import re
+import zipfile
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from appointments.models import Appointment, Availability
+from users.models import Patient
+
+FORMAT_CSV = "csv"
+FORMAT_XLSX = "xlsx"
+CONTENT_TYPES = {
+    FORMAT_CSV: "text/csv",
+    FORMAT_XLSX: (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    ),
+}
+
+# spreadsheet name: (model, (column, lookup) pairs, ordering, lookup of
+# the medical professional's user the rows are limited to, field `start`
+# and `end` filter on)
+SPREADSHEETS = {
+    "appointments": (
+        Appointment,
+        (
+            ("id", "id"),
+            ("patient_first_name", "patient__user__first_name"),
+            ("patient_last_name", "patient__user__last_name"),
+            ("patient_email", "patient__user__email"),
+            ("status", "status"),
+            ("start_time", "start_time"),
+            ("end_time", "end_time"),
+            ("note", "note"),
+            ("created_at", "created_at"),
+        ),
+        ("start_time", "pk"),
+        "medical_professional__user",
+        "start_time",
+    ),
+    "availability": (
+        Availability,
+        (
+            ("id", "id"),
+            ("start_time", "start_time"),
+            ("end_time", "end_time"),
+            ("is_booked", "is_booked"),
+        ),
+        ("start_time", "pk"),
+        "medical_professional__user",
+        "start_time",
+    ),
+    "patients": (
+        Patient,
+        (
+            ("id", "id"),
+            ("first_name", "user__first_name"),
+            ("last_name", "user__last_name"),
+            ("email", "user__email"),
+            ("phone_number", "user__phone_number"),
+            ("gender", "user__gender"),
+            ("date_of_birth", "user__date_of_birth"),
+            ("blood_group", "blood_group"),
+            ("genotype", "genotype"),
+            ("height", "height"),
+            ("weight", "weight"),
+            ("bmi", "bmi"),
+        ),
+        ("user__last_name", "user__first_name", "pk"),
+        None,
+        None,
+    ),
+}
+
+XLSX_PARTS = (
+    (
+        "[Content_Types].xml",
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'content-types">'
+        '<Default Extension="rels" ContentType="application/'
+        'vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType='
+        '"application/vnd.openxmlformats-officedocument.spreadsheetml.'
+        'worksheet+xml"/>'
+        "</Types>",
+    ),
+    (
+        "_rels/.rels",
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+        '2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        "</Relationships>",
+    ),
+    (
+        "xl/_rels/workbook.xml.rels",
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+        '2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        "</Relationships>",
+    ),
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/'
+    'main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/'
+    'relationships">'
+    '<sheets><sheet name="{}" sheetId="1" r:id="rId1"/></sheets>'
+    "</workbook>"
+)
+XLSX_SHEET_START = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+    b'2006/main"><sheetData>'
+)
+XLSX_SHEET_END = b"</sheetData></worksheet>"
+XLSX_STRING_CELL = (
+    '<c t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>'
+)
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+# characters XML 1.0 does not allow
+XML_INVALID_CHARACTERS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class StreamBuffer:
+    """Write-only file whose contents are taken out as they are written."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class Echo:
+    """File whose write returns what is written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def get_spreadsheet_rows(name: str, user, start=None, end=None):
+    """Column names and an iterator of value tuples of the `name`
+    spreadsheet as seen by `user`."""
+    model, columns, ordering, user_lookup, date_field = SPREADSHEETS[name]
+    queryset = model.objects.order_by(*ordering)
+    if user_lookup:
+        queryset = queryset.filter(**{user_lookup: user})
+    if date_field and start:
+        queryset = queryset.filter(**{f"{date_field}__gte": start})
+    if date_field and end:
+        queryset = queryset.filter(**{f"{date_field}__lt": end})
+    rows = queryset.values_list(*(lookup for _, lookup in columns))
+    return (
+        [column for column, _ in columns],
+        rows.iterator(chunk_size=settings.BULK_EXPORT_CHUNK_SIZE),
+    )
+
+
+def _csv_cell(value):
+    # keep spreadsheet apps from running user entered text as a formula
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_csv(header, rows, sheet_name=None):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([_csv_cell(value) for value in row])
+
+
+def _xlsx_cell(value) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, bool):
+        return '<c t="b"><v>{}</v></c>'.format(int(value))
+    if isinstance(value, (int, float, Decimal)):
+        return "<c><v>{}</v></c>".format(value)
+    text = XML_INVALID_CHARACTERS.sub("", str(value))
+    return XLSX_STRING_CELL.format(escape(text))
+
+
+def stream_xlsx(header, rows, sheet_name="Sheet1"):
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(
+        buffer, "w", compression=zipfile.ZIP_DEFLATED
+    ) as archive:
+        for part, content in XLSX_PARTS:
+            archive.writestr(part, content)
+        archive.writestr(
+            "xl/workbook.xml", XLSX_WORKBOOK.format(escape(sheet_name))
+        )
+        yield buffer.take()
+
+        with archive.open(
+            "xl/worksheets/sheet1.xml", "w", force_zip64=True
+        ) as sheet:
+            sheet.write(XLSX_SHEET_START)
+            for row in itertools.chain([header], rows):
+                sheet.write(
+                    "<row>{}</row>".format(
+                        "".join(_xlsx_cell(value) for value in row)
+                    ).encode()
+                )
+                # the compressor hands over output in blocks
+                if buffer.chunks:
+                    yield buffer.take()
+            sheet.write(XLSX_SHEET_END)
+    yield buffer.take()
+
+
+WRITERS = {FORMAT_CSV: stream_csv, FORMAT_XLSX: stream_xlsx}
@@ -0,0 +1,252 @@
+import logging
+import time
+
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, Min, OuterRef
+from django.utils import timezone
+from health_api.celery import app as celery_app
+from appointments.choices import BOOKING_STATUS
+from users.tasks import (
+    send_appointment_reminder_mail,
+    send_appointment_update_mail,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@celery_app.task(name="send_appointment_status_mails")
+def send_appointment_status_mails(appointment_ids: list, status: str):
+    from appointments.models import Appointment
+
+    logger.info(
+        "Sending status update emails for {} appointments".format(
+            len(appointment_ids)
+        )
+    )
+
+    appointments = Appointment.objects.filter(
+        id__in=appointment_ids
+    ).select_related("patient__user", "medical_professional__user")
+    for appointment in appointments:
+        send_appointment_update_mail(
+            appointment.patient.user.full_name,
+            appointment.medical_professional.user.full_name,
+            appointment.patient.user.email,
+            appointment.start_time.date(),
+            (appointment.start_time + timedelta(hours=1)).time(),
+            status,
+        )
+
+
+SWEEPER_METRICS_CACHE_KEY = "appointment_sweeper_metrics"
+REMINDER_LOCK_CACHE_KEY = "appointment_reminders_lock"
+
+
+@celery_app.task(name="sweep_stale_appointments")
+def sweep_stale_appointments():
+    """Close appointments whose end time has passed without them being
+    completed and drop free availability that is already in the past."""
+    from appointments.models import Appointment, Availability
+    from appointments.utils import delete_in_batches, update_in_batches
+
+    batch_size = settings.APPOINTMENT_SWEEPER_BATCH_SIZE
+    now = timezone.now()
+    started = time.monotonic()
+
+    stale_qs = Appointment.objects.filter(
+        status__in=[BOOKING_STATUS.PENDING, BOOKING_STATUS.ACCEPTED],
+        end_time__lt=now,
+    )
+    oldest_end_time = stale_qs.aggregate(oldest=Min("end_time"))["oldest"]
+
+    expired, expired_batches = update_in_batches(
+        stale_qs.filter(status=BOOKING_STATUS.PENDING),
+        batch_size,
+        status=BOOKING_STATUS.EXPIRED,
+    )
+    no_show, no_show_batches = update_in_batches(
+        stale_qs.filter(status=BOOKING_STATUS.ACCEPTED),
+        batch_size,
+        status=BOOKING_STATUS.NO_SHOW,
+    )
+    availability_deleted, availability_batches = delete_in_batches(
+        Availability.objects.filter(
+            is_booked=False,
+            end_time__lt=now - settings.STALE_AVAILABILITY_RETENTION,
+        ),
+        batch_size,
+    )
+
+    metrics = {
+        "ran_at": now.isoformat(),
+        "duration_seconds": round(time.monotonic() - started, 3),
+        "batch_size": batch_size,
+        "batches": expired_batches + no_show_batches + availability_batches,
+        "expired": expired,
+        "no_show": no_show,
+        "availability_deleted": availability_deleted,
+        # how far behind the oldest appointment the sweeper closed was
+        "lag_seconds": (
+            round((now - oldest_end_time).total_seconds())
+            if oldest_end_time
+            else 0
+        ),
+    }
+    cache.set(SWEEPER_METRICS_CACHE_KEY, metrics, None)
+    logger.info("Stale appointment sweep finished: {}".format(metrics))
+    return metrics
+
+
+@celery_app.task(name="create_appointment_partitions")
+def create_appointment_partitions():
+    from appointments.partitioning import ensure_future_partitions
+
+    if ensure_future_partitions(settings.APPOINTMENT_PARTITION_MONTHS_AHEAD):
+        logger.info("Appointment partitions are in place")
+
+
+def _full_name(first_name: str, last_name: str) -> str:
+    return f"{first_name} {last_name}".strip()
+
+
+@celery_app.task(name="send_appointment_reminder_mails")
+def send_appointment_reminder_mails(rows: list):
+    """Mail the patient and the medical professional of every appointment
+    row queued by send_appointment_reminders."""
+    logger.info(
+        "Sending reminder emails for {} appointments".format(len(rows))
+    )
+
+    for (
+        start_time,
+        patient_first_name,
+        patient_last_name,
+        patient_email,
+        doctor_first_name,
+        doctor_last_name,
+        doctor_email,
+    ) in rows:
+        patient_name = _full_name(patient_first_name, patient_last_name)
+        doctor_name = _full_name(doctor_first_name, doctor_last_name)
+        appointment_date = start_time.date()
+        appointment_time = (start_time + timedelta(hours=1)).time()
+
+        # email to patient.
+        send_appointment_reminder_mail(
+            patient_name,
+            doctor_name,
+            patient_email,
+            appointment_date,
+            appointment_time,
+        )
+        # mail to doctor
+        send_appointment_reminder_mail(
+            doctor_name,
+            patient_name,
+            doctor_email,
+            appointment_date,
+            appointment_time,
+        )
+
+
+@celery_app.task(name="send_appointment_reminders")
+def send_appointment_reminders():
+    """Mail a reminder for every live appointment starting within one of the
+    APPOINTMENT_REMINDER_WINDOWS, one mail task per batch. A reminder row
+    is written per appointment and window once its batch is queued, so a
+    window is mailed once unless writing the rows fails. Appointments
+    already inside a smaller window only get that window's reminder."""
+    from appointments.models import Appointment, AppointmentReminder
+
+    # ticks must not overlap, or both could pick up the same appointments
+    if not cache.add(REMINDER_LOCK_CACHE_KEY, True, 60 * 30):
+        logger.info("Appointment reminders are already being sent")
+        return {}
+
+    try:
+        batch_size = settings.APPOINTMENT_REMINDER_BATCH_SIZE
+        now = timezone.now()
+        sent, smaller_window = {}, timedelta(0)
+        for window in sorted(settings.APPOINTMENT_REMINDER_WINDOWS):
+            window_minutes = int(window.total_seconds() // 60)
+            due_qs = (
+                Appointment.objects.filter(
+                    status__in=[
+                        BOOKING_STATUS.PENDING,
+                        BOOKING_STATUS.ACCEPTED,
+                    ],
+                    start_time__gte=now,
+                    start_time__lt=now + window,
+                )
+                .exclude(
+                    Exists(
+                        AppointmentReminder.objects.filter(
+                            appointment=OuterRef("pk"), window=window_minutes
+                        )
+                    )
+                )
+                .order_by()
+            )
+
+            sent[window_minutes] = 0
+            while True:
+                rows = list(
+                    due_qs.values_list(
+                        "id",
+                        "start_time",
+                        "patient__user__first_name",
+                        "patient__user__last_name",
+                        "patient__user__email",
+                        "medical_professional__user__first_name",
+                        "medical_professional__user__last_name",
+                        "medical_professional__user__email",
+                    )[:batch_size]
+                )
+                if not rows:
+                    break
+
+                due_rows = [
+                    row[1:] for row in rows if row[1] >= now + smaller_window
+                ]
+                # a batch whose publish fails gets no reminder rows and is
+                # picked up again by the next tick
+                if due_rows:
+                    send_appointment_reminder_mails.delay(due_rows)
+                AppointmentReminder.objects.bulk_create(
+                    [
+                        AppointmentReminder(
+                            appointment_id=row[0], window=window_minutes
+                        )
+                        for row in rows
+                    ],
+                    ignore_conflicts=True,
+                )
+                sent[window_minutes] += len(due_rows)
+            smaller_window = window
+    finally:
+        cache.delete(REMINDER_LOCK_CACHE_KEY)
+
+    logger.info("Appointment reminders sent per window: {}".format(sent))
+    return sent
+
+
+@celery_app.task(name="refresh_professional_workload")
+def refresh_professional_workload():
+    from appointments.workload import refresh_changed_workload
+
+    refreshed = refresh_changed_workload()
+    logger.info(
+        "Refreshed {} professional daily workload rows".format(refreshed)
+    )
+    return refreshed
+
+
+@celery_app.task(name="run_bulk_export")
+def run_bulk_export(export_id: str):
+    from appointments.bulk_export import write_bulk_export
+
+    status = write_bulk_export(export_id)
+    logger.info("Bulk export {} finished: {}".format(export_id, status))
+    return status
@@ -1,3 +1,1787 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import tempfile
+import threading
+import time
+import zipfile
+from decimal import Decimal
+from unittest import mock
+from datetime import timedelta
+from xml.etree import ElementTree
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from appointments.choices import BOOKING_STATUS
+from appointments.models import (
+    Appointment,
+    AppointmentReminder,
+    Availability,
+    LabObservation,
+    MedicalUpload,
+    ProfessionalDailyWorkload,
+    ProfessionalWorkloadChange,
+    TestResult,
+    VisitHistory,
+)
+from appointments.bulk_export import get_resource_values
+from appointments.partitioning import (
+    DEFAULT_PARTITION,
+    MIRROR_FUNCTION,
+    PARTITIONED_TABLE,
+    TABLE,
+    add_months,
+    copy_rows,
+    create_partitioned_table,
+    ensure_future_partitions,
+    is_partitioned,
+    partition_name,
+    swap_tables,
+)
+from appointments.representations import (
+    APPOINTMENT_FIELDS,
+    represent_appointments,
+)
+from appointments.serilaizers import AppointmentSerializer
+from appointments.tasks import (
+    SWEEPER_METRICS_CACHE_KEY,
+    send_appointment_reminders,
+    sweep_stale_appointments,
+)
+from appointments.utils import (
+    can_transition,
+    get_leaked_availability_queryset,
+    get_source_statuses,
+    release_availability,
+    update_in_batches,
+)
+from appointments.workload import (
+    refresh_changed_workload,
+    refresh_workload,
+)
+from users.models import MedicalHistory, MedicalProfessional, Patient, User
+from users.representations import (
+    MEDICAL_PROFESSIONAL_FIELDS,
+    get_user_values,
+    represent_medical_professionals,
+)
+from users.serializers import MedicalProfessionalSerializer
+
+
+def create_doctor_and_patient(prefix: str):
+    doctor_user, patient_user = User.objects.bulk_create(
+        [
+            User(
+                email=f"{prefix}-{role}@example.com",
+                username=f"{prefix}-{role}@example.com",
+                first_name=role.title(),
+                is_staff=role == "doctor",
+                is_email_verified=True,
+            )
+            for role in ("doctor", "patient")
+        ]
+    )
+    # read back so the ids are UUIDs rather than the hex they are made as
+    return (
+        MedicalProfessional.objects.get(
+            pk=MedicalProfessional.objects.create(user=doctor_user).pk
+        ),
+        Patient.objects.get(pk=Patient.objects.create(user=patient_user).pk),
+    )
+
+
+def create_appointment(patient, doctor, start_time, hours=1, **kwargs):
+    appointment = Appointment.objects.create(
+        patient=patient,
+        medical_professional=doctor,
+        start_time=start_time,
+        end_time=start_time + timedelta(hours=hours),
+        **kwargs,
+    )
+    return Appointment.objects.get(pk=appointment.pk)
+
+
+class AppointmentAdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            "admin@example.com", "S3cure!pass-xyz"
+        )
+        self.client.force_login(self.admin)
+
+    def add_appointments(self, count: int):
+        users = User.objects.bulk_create(
+            [
+                User(
+                    email=f"user{count}-{i}@example.com",
+                    username=f"user{count}-{i}@example.com",
+                )
+                for i in range(count * 2)
+            ]
+        )
+        patients = Patient.objects.bulk_create(
+            [Patient(user=user) for user in users[:count]]
+        )
+        doctors = MedicalProfessional.objects.bulk_create(
+            [MedicalProfessional(user=user) for user in users[count:]]
+        )
+        now = timezone.now()
+        Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    patient=patient,
+                    medical_professional=doctor,
+                    start_time=now,
+                    end_time=now + timedelta(hours=1),
+                )
+                for patient, doctor in zip(patients, doctors)
+            ]
+        )
+
+    def count_changelist_queries(self) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("admin:appointments_appointment_changelist")
+            )
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_appointments(2)
+        few_rows_queries = self.count_changelist_queries()
+        self.add_appointments(20)
+        self.assertEqual(self.count_changelist_queries(), few_rows_queries)
+
+
+class VisitHistoryQueryCountTests(TestCase):
+    def setUp(self):
+        patient_user, doctor_user = User.objects.bulk_create(
+            [
+                User(
+                    email=f"{name}@example.com",
+                    username=f"{name}@example.com",
+                    is_email_verified=True,
+                    is_staff=name == "doctor",
+                )
+                for name in ("patient", "doctor")
+            ]
+        )
+        self.patient = Patient.objects.create(user=patient_user)
+        self.doctor = MedicalProfessional.objects.create(user=doctor_user)
+        self.patient_client = APIClient()
+        self.patient_client.force_authenticate(patient_user)
+        self.doctor_client = APIClient()
+        self.doctor_client.force_authenticate(doctor_user)
+
+    def add_visits(self, count: int) -> list:
+        now = timezone.now()
+        appointments = Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    patient=self.patient,
+                    medical_professional=self.doctor,
+                    start_time=now,
+                    end_time=now + timedelta(hours=1),
+                )
+                for _ in range(count)
+            ]
+        )
+        visits = VisitHistory.objects.bulk_create(
+            [
+                VisitHistory(
+                    appointment=appointment,
+                    patient=self.patient,
+                    medical_professional=self.doctor,
+                    visit_date=now.date(),
+                )
+                for appointment in appointments
+            ]
+        )
+        TestResult.objects.bulk_create(
+            [
+                TestResult(
+                    patient=self.patient,
+                    visit_history=visit,
+                    blood_tests="HbA1c 6.1%",
+                    imaging_studies="",
+                    electrocardiogram="",
+                    other_tests="",
+                )
+                for visit in visits
+            ]
+        )
+        MedicalUpload.objects.bulk_create(
+            [
+                MedicalUpload(visit_history=visit, upload="scan.pdf")
+                for visit in visits
+            ]
+        )
+        return visits
+
+    def count_list_queries(self) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patient_client.get(
+                "/api/v1/appointments/visit-history/"
+            )
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_queries_do_not_grow_with_rows(self):
+        self.add_visits(2)
+        few_rows_queries = self.count_list_queries()
+        self.add_visits(20)
+        self.assertEqual(self.count_list_queries(), few_rows_queries)
+
+    def test_test_results_and_uploads_are_separate(self):
+        visit = self.add_visits(1)[0]
+        response = self.doctor_client.get(
+            "/api/v1/appointments/staff/visit-history/",
+            {"appointment_id": visit.appointment_id},
+        )
+        self.assertEqual(
+            response.json()["test_results"][0]["blood_tests"], "HbA1c 6.1%"
+        )
+        self.assertTrue(
+            response.json()["uploads"][0]["upload"].endswith("scan.pdf")
+        )
+
+
+class LabObservationTests(TestCase):
+    def setUp(self):
+        patient_user, doctor_user = User.objects.bulk_create(
+            [
+                User(
+                    email=f"lab-{name}@example.com",
+                    username=f"lab-{name}@example.com",
+                    is_staff=name == "doctor",
+                )
+                for name in ("patient", "doctor")
+            ]
+        )
+        self.patient = Patient.objects.create(user=patient_user)
+        self.doctor = MedicalProfessional.objects.create(user=doctor_user)
+        self.visit = VisitHistory.objects.create(
+            patient=self.patient, medical_professional=self.doctor
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(doctor_user)
+
+    def test_batch_is_flagged_against_reference_range(self):
+        observed_at = timezone.now() - timedelta(days=1)
+        response = self.client.post(
+            f"/api/v1/appointments/staff/visit-history/{self.visit.pk}/"
+            "lab-observations/",
+            [
+                {
+                    "analyte_code": "4548-4",
+                    "value": value,
+                    "unit": "%",
+                    "reference_low": "4.0",
+                    "reference_high": "5.6",
+                    "observed_at": observed_at.isoformat(),
+                }
+                for value in ("3.5", "5.0", "7.2")
+            ],
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            sorted(LabObservation.objects.values_list("flag", flat=True)),
+            ["H", "L", "N"],
+        )
+
+        response = self.client.get(
+            "/api/v1/appointments/staff/lab-observations/",
+            {"analyte_code": "4548-4", "min_value": "7"},
+        )
+        self.assertEqual(response.json()["count"], 1)
+
+        response = self.client.get(
+            "/api/v1/appointments/staff/lab-observations/trend/",
+            {"patient_id": self.patient.pk, "analyte_code": "4548-4"},
+        )
+        (bucket,) = response.json()
+        self.assertEqual(bucket["count"], 3)
+        self.assertEqual(bucket["abnormal"], 2)
+
+
+class LabImportTests(TestCase):
+    def setUp(self):
+        patient_user, doctor_user = User.objects.bulk_create(
+            [
+                User(
+                    email=f"import-{name}@example.com",
+                    username=f"import-{name}@example.com",
+                    is_staff=name == "doctor",
+                )
+                for name in ("patient", "doctor")
+            ]
+        )
+        self.patient = Patient.objects.create(user=patient_user)
+        doctor = MedicalProfessional.objects.create(user=doctor_user)
+        self.visit = VisitHistory.objects.create(
+            patient=self.patient,
+            medical_professional=doctor,
+            visit_date=timezone.now().date() - timedelta(days=2),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(doctor_user)
+
+    def upload(self, name: str, content: str):
+        return self.client.post(
+            "/api/v1/appointments/staff/lab-observations/import/",
+            {"file": SimpleUploadedFile(name, content.encode())},
+            format="multipart",
+        )
+
+    def test_email_match_ignores_case(self):
+        User.objects.filter(pk=self.patient.user_id).update(
+            email="Import-Patient@Example.com"
+        )
+        response = self.upload(
+            "results.csv",
+            "patient_email,analyte_code,value,observed_at\n"
+            "IMPORT-patient@example.com,4548-4,7.1,"
+            f"{timezone.now().isoformat()}\n",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["created"], 1)
+        self.assertTrue(
+            LabObservation.objects.filter(visit_history=self.visit).exists()
+        )
+
+    def test_numbers_must_fit_the_columns(self):
+        observed_at = timezone.now().isoformat()
+        response = self.upload(
+            "results.csv",
+            "patient_email,analyte_code,value,reference_range,observed_at\n"
+            f"import-patient@example.com,4548-4,123456789,,{observed_at}\n"
+            f"import-patient@example.com,4548-4,99999999.99999,,{observed_at}\n"
+            f"import-patient@example.com,4548-4,7.1,1-1E+9,{observed_at}\n"
+            f"import-patient@example.com,4548-4,7.123456,,{observed_at}\n",
+        )
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual((report["created"], report["failed"]), (1, 3))
+        self.assertEqual(
+            sorted(error["row"] for error in report["errors"]), [2, 3, 4]
+        )
+        self.assertEqual(LabObservation.objects.get().value, Decimal("7.1235"))
+
+    def test_csv_rows_resolve_patients_by_email_and_latest_visit(self):
+        observed_at = timezone.now().isoformat()
+        response = self.upload(
+            "results.csv",
+            "patient_email,analyte_code,value,unit,reference_range,"
+            "observed_at\n"
+            f"import-patient@example.com,4548-4,7.1,%,4.0-5.6,{observed_at}\n"
+            f"nobody@example.com,4548-4,5.0,%,4.0-5.6,{observed_at}\n"
+            f"import-patient@example.com,4548-4,high,%,,{observed_at}\n",
+        )
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual((report["created"], report["failed"]), (1, 2))
+        self.assertEqual(
+            sorted(error["row"] for error in report["errors"]), [3, 4]
+        )
+        observation = LabObservation.objects.get()
+        self.assertEqual(observation.visit_history_id.hex, self.visit.pk)
+        self.assertEqual(observation.flag, "H")
+
+    def test_hl7_numeric_results_are_imported(self):
+        response = self.upload(
+            "results.hl7",
+            "MSH|^~\\&|LAB|HOSP|||20240101120000||ORU^R01|1|P|2.5\r"
+            f"PID|1||{self.patient.pk}\r"
+            f"OBR|1|{self.visit.pk}||24331-1^Lipid panel|||20240101090000\r"
+            "OBX|1|NM|2093-3^Cholesterol^LN||250|mg/dL|0-200|H\r"
+            "OBX|2|ST|2093-3^Cholesterol^LN||see note\r",
+        )
+        report = response.json()
+        self.assertEqual((report["created"], report["failed"]), (1, 1))
+        observation = LabObservation.objects.get()
+        self.assertEqual(
+            (observation.analyte_code, observation.flag), ("2093-3", "H")
+        )
+
+
+class BulkExportTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        patient_user, doctor_user = User.objects.bulk_create(
+            [
+                User(
+                    email=f"export-{name}@example.com",
+                    username=f"export-{name}@example.com",
+                    is_staff=name == "doctor",
+                )
+                for name in ("patient", "doctor")
+            ]
+        )
+        Patient.objects.create(user=patient_user)
+        self.client = APIClient()
+        self.client.force_authenticate(doctor_user)
+
+    def test_export_is_written_as_gzipped_ndjson(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/v1/appointments/staff/export/",
+                {"types": "Patient,Appointment"},
+            )
+        self.assertEqual(response.status_code, 202)
+
+        response = self.client.get(response["Content-Location"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "Completed")
+        output = {file["type"]: file for file in response.json()["output"]}
+        self.assertEqual(output["Patient"]["count"], 1)
+        self.assertEqual(output["Appointment"]["count"], 0)
+
+        response = self.client.get(output["Patient"]["url"])
+        rows = [
+            json.loads(line)
+            for line in gzip.decompress(
+                b"".join(response.streaming_content)
+            ).splitlines()
+        ]
+        self.assertEqual(rows[0]["resourceType"], "Patient")
+        self.assertEqual(rows[0]["email"], "export-patient@example.com")
+
+    def test_since_keeps_rows_changed_since(self):
+        doctor, patient = create_doctor_and_patient("export-since")
+        visits = [
+            VisitHistory.objects.create(
+                patient=patient, medical_professional=doctor
+            )
+            for _ in range(2)
+        ]
+        for visit in visits:
+            TestResult.objects.create(
+                patient=patient,
+                visit_history=visit,
+                blood_tests="",
+                imaging_studies="",
+                electrocardiogram="",
+                other_tests="",
+            )
+        appointment = create_appointment(patient, doctor, timezone.now())
+        since = timezone.now() - timedelta(hours=1)
+        for model in (Patient, VisitHistory, Appointment):
+            model.objects.update(updated_at=since - timedelta(days=1))
+
+        # an old row changed since, and a test result added to an old visit
+        Patient.objects.filter(pk=patient.pk).update(updated_at=since)
+        TestResult.objects.create(
+            patient=patient,
+            visit_history=visits[0],
+            blood_tests="",
+            imaging_studies="",
+            electrocardiogram="",
+            other_tests="",
+        )
+
+        counts = {
+            resource_type: get_resource_values(resource_type, since).count()
+            for resource_type in (
+                "Patient",
+                "Appointment",
+                "VisitHistory",
+                "TestResult",
+            )
+        }
+        self.assertEqual(
+            counts,
+            {
+                "Patient": 1,
+                "Appointment": 0,
+                "VisitHistory": 1,
+                "TestResult": 2,
+            },
+        )
+        Appointment.objects.filter(pk=appointment.pk).update(
+            updated_at=timezone.now()
+        )
+        self.assertEqual(get_resource_values("Appointment", since).count(), 1)
+
+    def test_unknown_types_are_rejected(self):
+        response = self.client.post(
+            "/api/v1/appointments/staff/export/", {"types": "Billing"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class SpreadsheetExportTests(TestCase):
+    def setUp(self):
+        doctor_user, patient_user = User.objects.bulk_create(
+            [
+                User(
+                    email=f"sheet-{name}@example.com",
+                    username=f"sheet-{name}@example.com",
+                    first_name=name.title(),
+                    is_staff=name == "doctor",
+                )
+                for name in ("doctor", "patient")
+            ]
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(doctor_user)
+        self.doctor = MedicalProfessional.objects.create(user=doctor_user)
+        self.patient = Patient.objects.create(user=patient_user)
+
+    def add_appointments(self, count: int):
+        now = timezone.now()
+        Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    patient=self.patient,
+                    medical_professional=self.doctor,
+                    start_time=now + timedelta(hours=i),
+                    end_time=now + timedelta(hours=i + 1),
+                    note="=HYPERLINK(1)" if i == 0 else "",
+                )
+                for i in range(count)
+            ]
+        )
+
+    def get_spreadsheet(self, name: str, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("spreadsheet_export", args=[name]), params
+            )
+            content = b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return content, len(queries)
+
+    def test_appointments_stream_as_csv_in_one_query(self):
+        self.add_appointments(3)
+        content, few_rows_queries = self.get_spreadsheet("appointments")
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(
+            rows[0][:4],
+            ["id", "patient_first_name", "patient_last_name", "patient_email"],
+        )
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][1], "Patient")
+        self.assertEqual(rows[1][7], "'=HYPERLINK(1)")
+
+        self.add_appointments(30)
+        content, queries = self.get_spreadsheet("appointments")
+        self.assertEqual(queries, few_rows_queries)
+        self.assertEqual(content.count(b"\r\n"), 34)
+
+    def test_patients_stream_as_xlsx(self):
+        content, _ = self.get_spreadsheet("patients", file_type="xlsx")
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        self.assertIn("[Content_Types].xml", archive.namelist())
+        namespace = {
+            "s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+        }
+        rows = ElementTree.fromstring(
+            archive.read("xl/worksheets/sheet1.xml")
+        ).findall("s:sheetData/s:row", namespace)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(
+            rows[1].find("s:c[4]/s:is/s:t", namespace).text,
+            "sheet-patient@example.com",
+        )
+
+    def test_unknown_spreadsheets_are_not_found(self):
+        response = self.client.get(
+            reverse("spreadsheet_export", args=["billing"])
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class AppointmentRepresentationTests(TestCase):
+    def setUp(self):
+        users = User.objects.bulk_create(
+            [
+                User(
+                    email=f"fast-{i}@example.com",
+                    username=f"fast-{i}@example.com",
+                    first_name=f"First{i}",
+                    last_name="" if i == 2 else f"Last{i}",
+                    avatar="avatars/fast.png" if i == 0 else "",
+                    phone_number="+2348012345678" if i == 1 else None,
+                    address_1="1 Marina" if i == 1 else None,
+                    country="Nigeria",
+                    is_staff=i == 0,
+                    date_of_birth=timezone.localdate() if i == 1 else None,
+                )
+                for i in range(4)
+            ]
+        )
+        self.doctor = MedicalProfessional.objects.create(
+            user=users[0], department="Cardiology"
+        )
+        # a patient who also works as a medical professional
+        MedicalProfessional.objects.create(user=users[3])
+        patients = Patient.objects.bulk_create(
+            [
+                Patient(user=user, height=180.5, blood_group="O+")
+                for user in users[1:]
+            ]
+        )
+        MedicalHistory.objects.bulk_create(
+            [
+                MedicalHistory(patient=patient, medications=f"Dose {i}")
+                for patient in patients[:2]
+                for i in range(2)
+            ]
+        )
+        now = timezone.now()
+        self.add_appointments(patients, now)
+        self.client = APIClient()
+        self.client.force_authenticate(users[0])
+
+    def add_appointments(self, patients, now):
+        Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    patient=patient,
+                    medical_professional=self.doctor,
+                    start_time=now + timedelta(hours=i),
+                    end_time=now + timedelta(hours=i, minutes=30),
+                    note=f"Note {i}" if i % 2 else None,
+                )
+                for i, patient in enumerate(patients * 2)
+            ]
+        )
+
+    def test_representations_match_the_serializer(self):
+        request = Request(APIRequestFactory().get("/"))
+        queryset = Appointment.objects.filter(medical_professional=self.doctor)
+        self.assertEqual(
+            JSONRenderer().render(
+                represent_appointments(
+                    list(queryset.values(*APPOINTMENT_FIELDS)), request
+                )
+            ),
+            JSONRenderer().render(
+                AppointmentSerializer(
+                    queryset, many=True, context={"request": request}
+                ).data
+            ),
+        )
+
+    def test_medical_professional_representations_match_the_serializer(
+        self,
+    ):
+        # with a phone number, an address and a date of birth, next to the
+        # doctor with an avatar
+        MedicalProfessional.objects.create(
+            user=User.objects.get(email="fast-1@example.com"),
+            department="Radiology",
+        )
+        request = Request(APIRequestFactory().get("/"))
+        queryset = MedicalProfessional.objects.order_by("pk")
+        self.assertEqual(
+            JSONRenderer().render(
+                represent_medical_professionals(
+                    queryset.values(
+                        *MEDICAL_PROFESSIONAL_FIELDS,
+                        *get_user_values("user__"),
+                    ),
+                    request,
+                )
+            ),
+            JSONRenderer().render(
+                MedicalProfessionalSerializer(
+                    queryset, many=True, context={"request": request}
+                ).data
+            ),
+        )
+
+    def test_list_is_read_in_constant_queries(self):
+        def count_list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/api/v1/appointments/staff/")
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        few_rows_queries = count_list_queries()
+        self.add_appointments(list(Patient.objects.all()) * 5, timezone.now())
+        self.assertEqual(count_list_queries(), few_rows_queries)
+
+
+class AppointmentListETagTests(TestCase):
+    url = "/api/v1/appointments/staff/"
+
+    def setUp(self):
+        user = User.objects.create(
+            email="etag@example.com",
+            username="etag@example.com",
+            is_staff=True,
+        )
+        patient = Patient.objects.create(user=user)
+        self.doctor = MedicalProfessional.objects.create(user=user)
+        now = timezone.now()
+        self.appointments = Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    patient=patient,
+                    medical_professional=self.doctor,
+                    start_time=now + timedelta(hours=i),
+                    end_time=now + timedelta(hours=i, minutes=30),
+                    note="Follow up " * 20,
+                )
+                for i in range(10)
+            ]
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_matching_etag_is_answered_without_reading_the_list(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        # the single aggregate the ETag is made of
+        (query,) = [
+            query
+            for query in queries
+            if Appointment._meta.db_table in query["sql"]
+        ]
+        self.assertIn("MAX(", query["sql"])
+
+    def test_etag_changes_with_the_rows(self):
+        def assert_etag_changes(change):
+            etag = self.client.get(self.url)["ETag"]
+            change()
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+
+        def save():
+            self.appointments[0].note = "Rescheduled"
+            self.appointments[0].save()
+
+        def rename_patient():
+            user = User.objects.get(email="etag@example.com")
+            user.first_name = "Renamed"
+            user.save()
+
+        assert_etag_changes(save)
+        assert_etag_changes(rename_patient)
+        assert_etag_changes(
+            lambda: Appointment.objects.filter(
+                pk=self.appointments[1].pk
+            ).delete()
+        )
+        assert_etag_changes(
+            lambda: update_in_batches(
+                Appointment.objects.filter(status=BOOKING_STATUS.PENDING),
+                5,
+                status=BOOKING_STATUS.ACCEPTED,
+            )
+        )
+
+    def test_responses_are_compressed_with_encoded_etags(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["ETag"], etag[:-1] + '-gzip"')
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(
+            json.loads(gzip.decompress(response.content))["count"], 10
+        )
+
+        response = self.client.get(
+            self.url,
+            HTTP_ACCEPT_ENCODING="gzip",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag[:-1] + '-gzip"')
+
+    def test_small_responses_are_not_compressed(self):
+        Appointment.objects.all().delete()
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+        # the 304 keeps the ETag of the unencoded body
+        etag = response["ETag"]
+        response = self.client.get(
+            self.url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+
+class DeltaSyncTests(TestCase):
+    url = "/api/v1/appointments/"
+
+    def setUp(self):
+        doctor_user, patient_user = User.objects.bulk_create(
+            [
+                User(email=f"sync-{i}@example.com", username=f"sync-{i}")
+                for i in range(2)
+            ]
+        )
+        patient_user.is_email_verified = True
+        patient_user.save()
+        self.doctor = MedicalProfessional.objects.create(user=doctor_user)
+        self.patient = Patient.objects.create(user=patient_user)
+        now = timezone.now()
+        self.appointments = Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    patient=self.patient,
+                    medical_professional=self.doctor,
+                    start_time=now + timedelta(hours=i),
+                    end_time=now + timedelta(hours=i, minutes=30),
+                )
+                for i in range(3)
+            ]
+        )
+        # everything was last synced a day ago
+        self.synced_at = now - timedelta(hours=1)
+        Appointment.objects.update(updated_at=now - timedelta(days=1))
+        Patient.objects.update(updated_at=now - timedelta(days=1))
+        MedicalProfessional.objects.update(updated_at=now - timedelta(days=1))
+        self.client = APIClient()
+        self.client.force_authenticate(patient_user)
+
+    def sync(self):
+        response = self.client.get(
+            self.url, {"since": self.synced_at.isoformat()}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_only_changes_since_the_last_sync_are_listed(self):
+        self.assertEqual(self.sync()["results"], [])
+
+        changed, deleted = Appointment.objects.order_by("start_time")[:2]
+        changed.note = "Bring your scans"
+        changed.save()
+        deleted_id = str(deleted.id)
+        deleted.delete()
+
+        data = self.sync()
+        self.assertEqual(
+            [row["id"] for row in data["results"]], [str(changed.id)]
+        )
+        self.assertEqual(data["deleted"], [deleted_id])
+        self.assertTrue(data["synced_at"])
+        self.assertEqual(len(self.client.get(self.url).json()["results"]), 2)
+
+    def test_nested_and_bulk_changes_are_listed(self):
+        self.patient.user.first_name = "Renamed"
+        self.patient.user.save()
+        self.assertEqual(len(self.sync()["results"]), 3)
+
+        Patient.objects.update(updated_at=self.synced_at - timedelta(days=1))
+        update_in_batches(
+            Appointment.objects.filter(
+                id=self.appointments[0].id, status=BOOKING_STATUS.PENDING
+            ),
+            10,
+            status=BOOKING_STATUS.EXPIRED,
+        )
+        self.assertEqual(
+            [row["status"] for row in self.sync()["results"]],
+            [BOOKING_STATUS.EXPIRED],
+        )
+
+    def test_other_patients_deletions_are_not_listed(self):
+        Appointment.objects.create(
+            patient=Patient.objects.create(user=self.doctor.user),
+            medical_professional=self.doctor,
+            start_time=timezone.now(),
+            end_time=timezone.now() + timedelta(minutes=30),
+        ).delete()
+        self.assertEqual(self.sync()["deleted"], [])
+
+    def test_reassigned_appointment_leaves_the_previous_doctors_list(self):
+        User.objects.filter(pk=self.doctor.user_id).update(is_staff=True)
+        other = MedicalProfessional.objects.create(
+            user=User.objects.create(
+                email="sync-other@example.com",
+                username="sync-other",
+                is_staff=True,
+            )
+        )
+        moved = Appointment.objects.get(pk=self.appointments[0].pk)
+        moved.medical_professional = other
+        moved.save()
+
+        def sync_staff(user):
+            client = APIClient()
+            client.force_authenticate(User.objects.get(pk=user.pk))
+            response = client.get(
+                "/api/v1/appointments/staff/",
+                {"since": self.synced_at.isoformat()},
+            )
+            self.assertEqual(response.status_code, 200)
+            return response.json()
+
+        self.assertEqual(
+            sync_staff(self.doctor.user)["deleted"], [str(moved.id)]
+        )
+        data = sync_staff(other.user)
+        self.assertEqual(
+            ([row["id"] for row in data["results"]], data["deleted"]),
+            ([str(moved.id)], []),
+        )
+        data = self.sync()
+        self.assertEqual(
+            ([row["id"] for row in data["results"]], data["deleted"]),
+            ([str(moved.id)], []),
+        )
+
+    def test_invalid_or_expired_since_is_rejected(self):
+        for since in ("yesterday", (timezone.now() - timedelta(days=365))):
+            response = self.client.get(
+                self.url, {"since": str(since).replace(" ", "T")}
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+class AppointmentStatusTests(TestCase):
+    def setUp(self):
+        self.doctor, self.patient = create_doctor_and_patient("status")
+        now = timezone.now()
+        self.pending, self.accepted = [
+            create_appointment(
+                self.patient, self.doctor, now + timedelta(days=i), status=s
+            )
+            for i, s in enumerate(
+                [BOOKING_STATUS.PENDING, BOOKING_STATUS.ACCEPTED]
+            )
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor.user)
+
+    def bulk_update(self, status):
+        response = self.client.post(
+            "/api/v1/appointments/staff/bulk-status/",
+            {"ids": [self.pending.id, self.accepted.id], "status": status},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_transition_table(self):
+        self.assertTrue(
+            can_transition(BOOKING_STATUS.PENDING, BOOKING_STATUS.ACCEPTED)
+        )
+        self.assertTrue(
+            can_transition(BOOKING_STATUS.ACTIVE, BOOKING_STATUS.ACTIVE)
+        )
+        for terminal in (BOOKING_STATUS.COMPLETED, BOOKING_STATUS.CANCELLED):
+            self.assertFalse(can_transition(terminal, BOOKING_STATUS.PENDING))
+        self.assertFalse(
+            can_transition(BOOKING_STATUS.PENDING, BOOKING_STATUS.COMPLETED)
+        )
+        self.assertEqual(
+            get_source_statuses(BOOKING_STATUS.COMPLETED),
+            [BOOKING_STATUS.ACCEPTED, BOOKING_STATUS.ACTIVE],
+        )
+
+    def test_bulk_completion_skips_invalid_transitions(self):
+        data = self.bulk_update(BOOKING_STATUS.COMPLETED)
+        self.assertEqual(data["updated"], [str(self.accepted.id)])
+        self.assertEqual(data["skipped"], [str(self.pending.id)])
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, BOOKING_STATUS.PENDING)
+        self.assertEqual(
+            list(VisitHistory.objects.values_list("appointment", flat=True)),
+            [self.accepted.pk],
+        )
+
+    def test_bulk_cancellation_creates_no_visit_histories(self):
+        data = self.bulk_update(BOOKING_STATUS.CANCELLED)
+        self.assertEqual(len(data["updated"]), 2)
+        self.assertEqual(
+            set(Appointment.objects.values_list("status", flat=True)),
+            {BOOKING_STATUS.CANCELLED},
+        )
+        self.assertFalse(VisitHistory.objects.exists())
+
+    def test_only_pending_appointments_move_to_another_doctor(self):
+        other_doctor, _ = create_doctor_and_patient("status-other")
+        self.accepted.status = BOOKING_STATUS.COMPLETED
+        self.accepted.save()
+        for appointment in (self.accepted, self.pending):
+            response = self.client.put(
+                f"/api/v1/appointments/staff/{appointment.id}/",
+                {
+                    "medical_professional_id": str(other_doctor.id),
+                    "start_time": appointment.start_time.isoformat(),
+                    "end_time": appointment.end_time.isoformat(),
+                    "is_status_update": True,
+                },
+                format="json",
+            )
+            appointment.refresh_from_db()
+            if appointment.status == BOOKING_STATUS.COMPLETED:
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    appointment.medical_professional_id, self.doctor.id
+                )
+            else:
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    appointment.medical_professional_id, other_doctor.id
+                )
+
+    def update(self, appointment, **data):
+        response = self.client.put(
+            f"/api/v1/appointments/staff/{appointment.id}/",
+            {
+                "medical_professional_id": str(self.doctor.id),
+                "start_time": appointment.start_time.isoformat(),
+                "end_time": appointment.end_time.isoformat(),
+                "is_status_update": True,
+                **data,
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_creates_visit_histories_for_visits_only(self):
+        self.update(self.pending, status=BOOKING_STATUS.CANCELLED)
+        self.assertFalse(VisitHistory.objects.exists())
+
+        self.update(self.accepted, status=BOOKING_STATUS.ACTIVE)
+        self.assertEqual(
+            list(VisitHistory.objects.values_list("appointment", flat=True)),
+            [self.accepted.pk],
+        )
+
+    def test_moved_appointment_keeps_its_visit_history(self):
+        other_doctor, _ = create_doctor_and_patient("status-moved")
+        visit = VisitHistory.objects.create(
+            appointment=self.pending,
+            patient=self.patient,
+            medical_professional=self.doctor,
+        )
+        self.update(self.pending, medical_professional_id=str(other_doctor.id))
+        self.assertEqual(VisitHistory.objects.count(), 1)
+        self.assertEqual(
+            list(
+                VisitHistory.objects.filter(pk=visit.pk).values_list(
+                    "medical_professional", "visit_date"
+                )
+            ),
+            [(other_doctor.pk, self.pending.start_time.date())],
+        )
+
+
+class AvailabilityReleaseTests(TestCase):
+    def setUp(self):
+        self.doctor, self.patient = create_doctor_and_patient("release")
+        # 09:00 on the Monday after next
+        today = timezone.now().replace(
+            hour=9, minute=0, second=0, microsecond=0
+        )
+        self.monday = today + timedelta(days=14 - today.weekday())
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+
+    def add_slots(self, *days, hours=8):
+        for day in days:
+            Availability.objects.create(
+                medical_professional=self.doctor,
+                start_time=self.monday + timedelta(days=day),
+                end_time=self.monday + timedelta(days=day, hours=hours),
+            )
+        return self.get_slots()
+
+    def get_slots(self):
+        return list(
+            Availability.objects.order_by("start_time").values_list(
+                "start_time", "end_time", "is_booked"
+            )
+        )
+
+    def book(self, day, hour):
+        start_time = self.monday + timedelta(days=day, hours=hour)
+        response = self.client.post(
+            "/api/v1/appointments/book/",
+            {
+                "medical_professional_id": str(self.doctor.id),
+                "start_time": start_time.isoformat(),
+                "end_time": (start_time + timedelta(hours=1)).isoformat(),
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        return Appointment.objects.get(id=response.json()["id"])
+
+    def test_cancellation_gives_back_only_the_booked_slot(self):
+        slots = self.add_slots(0, 1, 2)
+        appointment = self.book(1, 1)
+        self.assertIn(
+            (appointment.start_time, appointment.end_time, True),
+            self.get_slots(),
+        )
+
+        response = self.client.put(
+            f"/api/v1/appointments/{appointment.id}/",
+            {
+                "medical_professional_id": str(self.doctor.id),
+                "start_time": appointment.start_time.isoformat(),
+                "end_time": appointment.end_time.isoformat(),
+                "status": BOOKING_STATUS.CANCELLED,
+                "is_status_update": True,
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        # the three days stay separate slots
+        self.assertEqual(self.get_slots(), slots)
+
+    def test_deletion_joins_the_pieces_of_a_split_slot(self):
+        slots = self.add_slots(0, hours=4 * 24 + 8)
+        appointment = self.book(2, 1)
+        self.assertEqual(len(self.get_slots()), 3)
+
+        response = self.client.delete(
+            f"/api/v1/appointments/{appointment.id}/"
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_slots(), slots)
+
+    def test_reschedule_then_cancel_leaves_no_booked_slot(self):
+        slots = self.add_slots(0, 1, 2)
+        appointment = self.book(1, 1)
+        start_time = self.monday + timedelta(days=2, hours=3)
+        data = {
+            "medical_professional_id": str(self.doctor.id),
+            "start_time": start_time.isoformat(),
+            "end_time": (start_time + timedelta(hours=1)).isoformat(),
+        }
+        url = f"/api/v1/appointments/{appointment.id}/"
+
+        response = self.client.put(url, data, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(
+                Availability.objects.filter(is_booked=True).values_list(
+                    "start_time", flat=True
+                )
+            ),
+            [start_time],
+        )
+
+        response = self.client.put(
+            url,
+            {
+                **data,
+                "status": BOOKING_STATUS.CANCELLED,
+                "is_status_update": True,
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_slots(), slots)
+
+    def test_release_matches_the_exact_booking(self):
+        self.add_slots(0, hours=4 * 24 + 8)
+        first, second = self.book(1, 1), self.book(3, 1)
+        first.delete()
+        second_slot = (second.start_time, second.end_time, True)
+
+        release_availability(first)
+        self.assertIn(second_slot, self.get_slots())
+        self.assertFalse(
+            Availability.objects.filter(
+                start_time=first.start_time, is_booked=True
+            ).exists()
+        )
+
+    def test_reconcile_frees_leaked_slots_only(self):
+        slots = self.add_slots(0, 1, 2)
+        # deleted without freeing its availability
+        Appointment.objects.filter(id=self.book(1, 1).id).delete()
+        self.assertEqual(get_leaked_availability_queryset().count(), 1)
+
+        call_command("reconcile_availability")
+        self.assertEqual(self.get_slots(), slots)
+
+
+@override_settings(APPOINTMENT_SWEEPER_BATCH_SIZE=2)
+class StaleAppointmentSweeperTests(TestCase):
+    def setUp(self):
+        self.doctor, self.patient = create_doctor_and_patient("sweeper")
+        self.now = timezone.now()
+        for i, status in enumerate(
+            [BOOKING_STATUS.PENDING] * 3
+            + [BOOKING_STATUS.ACCEPTED] * 2
+            + [BOOKING_STATUS.COMPLETED, BOOKING_STATUS.CANCELLED]
+        ):
+            create_appointment(
+                self.patient,
+                self.doctor,
+                self.now - timedelta(days=3, hours=i),
+                status=status,
+            )
+        # not over yet
+        self.upcoming = create_appointment(
+            self.patient, self.doctor, self.now + timedelta(hours=1)
+        )
+        for start_time, is_booked in (
+            (self.now - timedelta(days=5), False),
+            (self.now - timedelta(days=4), True),
+            (self.now - timedelta(hours=12), False),
+        ):
+            Availability.objects.create(
+                medical_professional=self.doctor,
+                start_time=start_time,
+                end_time=start_time + timedelta(hours=1),
+                is_booked=is_booked,
+            )
+
+    def test_stale_appointments_are_closed_in_batches(self):
+        metrics = sweep_stale_appointments()
+
+        self.assertEqual(metrics["expired"], 3)
+        self.assertEqual(metrics["no_show"], 2)
+        # two batches expire 2 + 1, one closes the 2 no shows and one
+        # deletes the availability
+        self.assertEqual(metrics["batches"], 4)
+        self.assertGreaterEqual(metrics["lag_seconds"], 3 * 24 * 3600)
+        self.assertEqual(cache.get(SWEEPER_METRICS_CACHE_KEY), metrics)
+        self.assertEqual(
+            dict(
+                Appointment.objects.values_list("status").annotate(
+                    count=Count("id")
+                )
+            ),
+            {
+                BOOKING_STATUS.EXPIRED: 3,
+                BOOKING_STATUS.NO_SHOW: 2,
+                BOOKING_STATUS.COMPLETED: 1,
+                BOOKING_STATUS.CANCELLED: 1,
+                BOOKING_STATUS.PENDING: 1,
+            },
+        )
+        self.upcoming.refresh_from_db()
+        self.assertEqual(self.upcoming.status, BOOKING_STATUS.PENDING)
+
+    def test_only_old_free_availability_is_deleted(self):
+        self.assertEqual(sweep_stale_appointments()["availability_deleted"], 1)
+        self.assertEqual(
+            sorted(Availability.objects.values_list("is_booked", flat=True)),
+            [False, True],
+        )
+
+    def test_nothing_to_sweep(self):
+        sweep_stale_appointments()
+        metrics = sweep_stale_appointments()
+        self.assertEqual(
+            (metrics["expired"], metrics["no_show"], metrics["batches"]),
+            (0, 0, 0),
+        )
+        self.assertEqual(metrics["lag_seconds"], 0)
+
+
+@override_settings(APPOINTMENT_REMINDER_BATCH_SIZE=2)
+class AppointmentReminderTests(TestCase):
+    def setUp(self):
+        self.doctor, self.patient = create_doctor_and_patient("reminder")
+        now = timezone.now()
+        for hours in (3, 4, 5):
+            create_appointment(
+                self.patient, self.doctor, now + timedelta(hours=hours)
+            )
+
+    @mock.patch("appointments.tasks.send_appointment_reminder_mails.delay")
+    def test_one_mail_task_per_batch(self, delay):
+        self.assertEqual(send_appointment_reminders(), {60: 0, 1440: 3})
+        self.assertEqual(
+            [len(call.args[0]) for call in delay.call_args_list], [2, 1]
+        )
+        self.assertEqual(AppointmentReminder.objects.count(), 3)
+
+        self.assertEqual(send_appointment_reminders(), {60: 0, 1440: 0})
+        self.assertEqual(delay.call_count, 2)
+
+    @mock.patch("appointments.tasks.send_appointment_reminder_mails.delay")
+    def test_failed_publish_is_retried(self, delay):
+        delay.side_effect = OSError("broker down")
+        with self.assertRaises(OSError):
+            send_appointment_reminders()
+        self.assertFalse(AppointmentReminder.objects.exists())
+
+        delay.side_effect = None
+        self.assertEqual(send_appointment_reminders(), {60: 0, 1440: 3})
+
+    @mock.patch("appointments.tasks.send_appointment_reminder_mail")
+    def test_batch_task_mails_patient_and_doctor(self, send_mail):
+        send_appointment_reminders()
+        self.assertEqual(send_mail.call_count, 6)
+        self.assertEqual(
+            {call.args[2] for call in send_mail.call_args_list},
+            {self.patient.user.email, self.doctor.user.email},
+        )
+
+
+def count_rows(table: str, **conditions) -> int:
+    where = " AND ".join(f"{column} = %s" for column in conditions)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT count(*) FROM {table}"
+            + (f" WHERE {where}" if where else ""),
+            list(conditions.values()),
+        )
+        return cursor.fetchone()[0]
+
+
+def copy_all_rows(chunk_size: int) -> int:
+    copied, last_key = 0, None
+    while True:
+        count, last_key = copy_rows(chunk_size, last_key)
+        if not count:
+            return copied
+        copied += count
+
+
+class PartitioningTests(TestCase):
+    def setUp(self):
+        self.doctor, self.patient = create_doctor_and_patient("partition")
+        self.now = timezone.now()
+        self.appointments = [
+            create_appointment(
+                self.patient, self.doctor, self.now + timedelta(days=i)
+            )
+            for i in range(5)
+        ]
+        # spread over past months so several partitions get rows
+        for i, appointment in enumerate(self.appointments):
+            Appointment.objects.filter(pk=appointment.pk).update(
+                created_at=self.now - timedelta(days=40 * i)
+            )
+
+    def convert(self):
+        create_partitioned_table(months_ahead=2)
+        # writes made while the rows are copied are mirrored
+        created = create_appointment(
+            self.patient, self.doctor, self.now + timedelta(days=10)
+        )
+        deleted = self.appointments[1].pk
+        Appointment.objects.filter(pk=deleted).delete()
+        Appointment.objects.filter(pk=self.appointments[2].pk).update(
+            status=BOOKING_STATUS.ACCEPTED
+        )
+        copied = copy_all_rows(chunk_size=2)
+        # the test transaction holds deferred foreign key checks, which a
+        # run of the command commits before the swap
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        swap_tables()
+        return created, deleted, copied
+
+    def test_live_table_is_converted(self):
+        created, deleted, copied = self.convert()
+
+        self.assertEqual(copied, 5)
+        with connection.cursor() as cursor:
+            self.assertTrue(is_partitioned(cursor))
+        self.assertEqual(Appointment.objects.count(), 5)
+        self.assertFalse(Appointment.objects.filter(pk=deleted).exists())
+        self.assertTrue(Appointment.objects.filter(pk=created.pk).exists())
+        self.assertEqual(
+            Appointment.objects.get(pk=self.appointments[2].pk).status,
+            BOOKING_STATUS.ACCEPTED,
+        )
+        for appointment in self.appointments[3:]:
+            month = appointment.created_at.date().replace(day=1)
+            self.assertEqual(
+                count_rows(partition_name(month), id=appointment.pk), 0
+            )
+        self.assertEqual(count_rows(DEFAULT_PARTITION), 0)
+
+        # the ORM keeps working on the partitioned table
+        appointment = create_appointment(
+            self.patient, self.doctor, self.now + timedelta(days=20)
+        )
+        appointment.status = BOOKING_STATUS.CANCELLED
+        appointment.save()
+        appointment.delete()
+        self.assertEqual(Appointment.objects.count(), 5)
+
+    def test_rows_land_in_their_month(self):
+        self.convert()
+        for appointment in Appointment.objects.all():
+            month = appointment.created_at.date().replace(day=1)
+            self.assertEqual(
+                count_rows(partition_name(month), id=appointment.pk), 1
+            )
+
+    def test_future_partition_takes_rows_from_default_partition(self):
+        self.convert()
+        month = add_months(self.now.date().replace(day=1), 6)
+        appointment = self.appointments[0]
+        Appointment.objects.filter(pk=appointment.pk).update(
+            created_at=self.now + timedelta(days=6 * 31)
+        )
+        self.assertEqual(count_rows(DEFAULT_PARTITION, id=appointment.pk), 1)
+
+        self.assertTrue(ensure_future_partitions(months_ahead=7))
+
+        self.assertEqual(count_rows(DEFAULT_PARTITION), 0)
+        self.assertEqual(
+            count_rows(partition_name(month), id=appointment.pk), 1
+        )
+        self.assertTrue(Appointment.objects.filter(pk=appointment.pk).exists())
+        # already there, left alone
+        self.assertTrue(ensure_future_partitions(months_ahead=7))
+
+    def test_not_partitioned_yet(self):
+        self.assertFalse(ensure_future_partitions(months_ahead=2))
+
+
+class PartitionCopyRaceTests(TransactionTestCase):
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DROP TRIGGER IF EXISTS {MIRROR_FUNCTION} ON {TABLE}"
+            )
+            cursor.execute(f"DROP FUNCTION IF EXISTS {MIRROR_FUNCTION}()")
+            cursor.execute(f"DROP TABLE IF EXISTS {PARTITIONED_TABLE}")
+
+    def test_row_deleted_during_copy_is_not_brought_back(self):
+        doctor, patient = create_doctor_and_patient("race")
+        now = timezone.now()
+        kept, deleted = (
+            create_appointment(patient, doctor, now + timedelta(days=i))
+            for i in range(2)
+        )
+        create_partitioned_table(months_ahead=1)
+
+        def copy():
+            try:
+                copy_all_rows(chunk_size=10)
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            Appointment.objects.filter(pk=deleted.pk).delete()
+            thread = threading.Thread(target=copy)
+            thread.start()
+            # let the copy reach the row being deleted
+            time.sleep(0.5)
+        thread.join()
+
+        self.assertEqual(count_rows(PARTITIONED_TABLE, id=kept.pk), 1)
+        self.assertEqual(count_rows(PARTITIONED_TABLE, id=deleted.pk), 0)
+
+
+class WorkloadRefreshTests(TestCase):
+    def setUp(self):
+        self.doctor, self.patient = create_doctor_and_patient("workload")
+        self.start = timezone.now().replace(
+            hour=10, minute=0, second=0, microsecond=0
+        ) + timedelta(days=3)
+        self.day = timezone.localdate(self.start)
+
+    def get_marked_days(self):
+        return set(
+            ProfessionalWorkloadChange.objects.values_list(
+                "medical_professional_id", "day"
+            )
+        )
+
+    def get_workload(self, day):
+        return ProfessionalDailyWorkload.objects.filter(
+            medical_professional=self.doctor, day=day
+        ).first()
+
+    def test_saved_appointment_marks_its_day(self):
+        create_appointment(self.patient, self.doctor, self.start)
+        self.assertEqual(self.get_marked_days(), {(self.doctor.pk, self.day)})
+
+        self.assertEqual(refresh_changed_workload(), 1)
+
+        self.assertEqual(self.get_workload(self.day).pending, 1)
+        self.assertFalse(ProfessionalWorkloadChange.objects.exists())
+
+    def test_moved_appointment_marks_both_days(self):
+        appointment = create_appointment(self.patient, self.doctor, self.start)
+        refresh_changed_workload()
+
+        appointment.start_time += timedelta(days=2)
+        appointment.end_time += timedelta(days=2)
+        appointment.save()
+        self.assertEqual(
+            self.get_marked_days(),
+            {
+                (self.doctor.pk, self.day),
+                (self.doctor.pk, self.day + timedelta(days=2)),
+            },
+        )
+
+        refresh_changed_workload()
+        self.assertIsNone(self.get_workload(self.day))
+        self.assertEqual(
+            self.get_workload(self.day + timedelta(days=2)).appointments, 1
+        )
+
+    def test_backfill_rejects_bad_days(self):
+        create_appointment(self.patient, self.doctor, self.start)
+        for options, message in (
+            ({"start": "yesterday"}, "start must be a day"),
+            ({"end": "2024-02-30"}, "end must be a day"),
+            ({"start": "2024-03-02", "end": "2024-03-01"}, "not be after"),
+        ):
+            with self.assertRaisesMessage(CommandError, message):
+                call_command("backfill_professional_workload", **options)
+
+        call_command(
+            "backfill_professional_workload",
+            start=self.day.isoformat(),
+            end=self.day.isoformat(),
+        )
+        self.assertEqual(self.get_workload(self.day).pending, 1)
+
+    def test_status_only_save_does_not_read_the_old_row(self):
+        appointment = create_appointment(self.patient, self.doctor, self.start)
+        appointment.status = BOOKING_STATUS.ACCEPTED
+        with CaptureQueriesContext(connection) as queries:
+            appointment.save(update_fields=["status"])
+        self.assertFalse(
+            any(
+                query["sql"].startswith('SELECT "appointments_appointment"')
+                for query in queries.captured_queries
+            )
+        )
+
+    def test_slot_marks_every_day_it_covers(self):
+        Availability.objects.create(
+            medical_professional=self.doctor,
+            start_time=self.start + timedelta(hours=10),
+            end_time=self.start + timedelta(days=1, hours=14),
+        )
+        self.assertEqual(
+            self.get_marked_days(),
+            {
+                (self.doctor.pk, self.day),
+                (self.doctor.pk, self.day + timedelta(days=1)),
+            },
+        )
+
+    def test_bulk_status_change_marks_its_days(self):
+        appointment = create_appointment(self.patient, self.doctor, self.start)
+        refresh_changed_workload()
+
+        update_in_batches(
+            Appointment.objects.filter(
+                pk=appointment.pk, status=BOOKING_STATUS.PENDING
+            ),
+            10,
+            status=BOOKING_STATUS.EXPIRED,
+        )
+        self.assertEqual(self.get_marked_days(), {(self.doctor.pk, self.day)})
+
+        refresh_changed_workload()
+        workload = self.get_workload(self.day)
+        self.assertEqual((workload.pending, workload.expired), (0, 1))
+
+    def test_queryset_delete_marks_its_days(self):
+        create_appointment(self.patient, self.doctor, self.start)
+        refresh_changed_workload()
+
+        Appointment.objects.filter(medical_professional=self.doctor).delete()
+        self.assertEqual(self.get_marked_days(), {(self.doctor.pk, self.day)})
+        refresh_changed_workload()
+        self.assertIsNone(self.get_workload(self.day))
+
+    def test_unmarked_days_are_left_alone(self):
+        other_day = self.day + timedelta(days=5)
+        create_appointment(
+            self.patient, self.doctor, self.start + timedelta(days=5)
+        )
+        refresh_workload(other_day, other_day + timedelta(days=1))
+        ProfessionalWorkloadChange.objects.all().delete()
+        ProfessionalDailyWorkload.objects.filter(day=other_day).update(
+            appointments=99
+        )
+
+        create_appointment(self.patient, self.doctor, self.start)
+        refresh_changed_workload()
+
+        self.assertEqual(self.get_workload(other_day).appointments, 99)
+        self.assertEqual(self.get_workload(self.day).appointments, 1)
+
+    @override_settings(WORKLOAD_REFRESH_BATCH_SIZE=1)
+    def test_mark_renewed_during_refresh_is_kept(self):
+        for days in range(3):
+            create_appointment(
+                self.patient, self.doctor, self.start + timedelta(days=days)
+            )
+
+        def renew(start_day, end_day, ids):
+            written = refresh_workload(start_day, end_day, ids)
+            if start_day == self.day:
+                ProfessionalWorkloadChange.objects.filter(
+                    day=start_day
+                ).update(changed_at=timezone.now() + timedelta(seconds=1))
+            return written
+
+        with mock.patch(
+            "appointments.workload.refresh_workload", side_effect=renew
+        ):
+            self.assertEqual(refresh_changed_workload(), 3)
+        self.assertEqual(self.get_marked_days(), {(self.doctor.pk, self.day)})
+
+
+class ClinicalSearchTests(TestCase):
+    visit_history_url = "/api/v1/appointments/staff/search/visit-history/"
+    medical_history_url = "/api/v1/appointments/staff/search/medical-history/"
+
+    def setUp(self):
+        self.doctor, self.patient = create_doctor_and_patient("search")
+        self.other_doctor, self.other_patient = create_doctor_and_patient(
+            "search-other"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor.user)
+        self.start = timezone.now() + timedelta(days=1)
+        create_appointment(self.patient, self.doctor, self.start)
+
+    def create_visit(self, patient=None, doctor=None, **text):
+        visit = VisitHistory.objects.create(
+            patient=patient or self.patient,
+            medical_professional=doctor or self.doctor,
+            **text,
+        )
+        return VisitHistory.objects.get(pk=visit.pk)
+
+    def get_vector(self, instance):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT search_vector::text FROM {instance._meta.db_table} "
+                "WHERE id = %s",
+                [instance.pk],
+            )
+            return cursor.fetchone()[0]
+
+    def search(self, url, q):
+        response = self.client.get(url, {"q": q})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_visit_history_vector_follows_the_text(self):
+        visit = self.create_visit(
+            reason_for_visit="Persistent headaches",
+            physician_notes="Prescribed rest",
+        )
+        vector = self.get_vector(visit)
+        self.assertIn("'headach':2A", vector)
+        self.assertIn("'prescrib':3C", vector)
+
+        VisitHistory.objects.filter(pk=visit.pk).update(
+            treatments_received="Ibuprofen"
+        )
+        self.assertIn("'ibuprofen':", self.get_vector(visit))
+
+        VisitHistory.objects.filter(pk=visit.pk).update(reason_for_visit=None)
+        self.assertNotIn("headach", self.get_vector(visit))
+
+    def test_medical_history_vector_follows_the_text(self):
+        history = MedicalHistory.objects.create(
+            patient=self.patient,
+            medical_conditions="Asthma",
+            medications="Salbutamol inhaler",
+        )
+        vector = self.get_vector(history)
+        self.assertIn("'asthma':1A", vector)
+        self.assertIn("'salbutamol':2B", vector)
+
+        # unsearched columns do not fire the trigger
+        MedicalHistory.objects.filter(pk=history.pk).update(
+            allergies="Penicillin"
+        )
+        self.assertNotIn("penicillin", self.get_vector(history))
+
+    def test_visit_histories_are_ranked_by_field(self):
+        notes = self.create_visit(physician_notes="Mild migraine reported")
+        reason = self.create_visit(reason_for_visit="Migraine")
+        self.create_visit(reason_for_visit="Sprained ankle")
+
+        results = self.search(self.visit_history_url, "migraines")
+
+        self.assertEqual(
+            [result["id"] for result in results],
+            [str(reason.pk), str(notes.pk)],
+        )
+        self.assertGreater(results[0]["rank"], results[1]["rank"])
+        self.assertIn("<mark>migraine</mark>", results[1]["headline"])
+
+    def test_only_the_doctors_patients_are_searched(self):
+        mine = self.create_visit(reason_for_visit="Fever")
+        self.create_visit(
+            patient=self.other_patient,
+            doctor=self.other_doctor,
+            reason_for_visit="Fever",
+        )
+        # a visit with another doctor of one of this doctor's patients
+        seen_elsewhere = self.create_visit(
+            doctor=self.other_doctor, reason_for_visit="Fever"
+        )
+        MedicalHistory.objects.create(
+            patient=self.other_patient, medical_conditions="Fever"
+        )
+
+        self.assertEqual(
+            {
+                result["id"]
+                for result in self.search(self.visit_history_url, "fever")
+            },
+            {str(mine.pk), str(seen_elsewhere.pk)},
+        )
+        self.assertEqual(self.search(self.medical_history_url, "fever"), [])
+
+    def test_websearch_syntax(self):
+        MedicalHistory.objects.create(
+            patient=self.patient,
+            medical_conditions="Type 2 diabetes",
+            medications="Metformin",
+        )
+        MedicalHistory.objects.create(
+            patient=self.patient, medical_conditions="Type 1 diabetes"
+        )
+
+        results = self.search(self.medical_history_url, "diabetes -metformin")
+        self.assertEqual(
+            [result["medical_conditions"] for result in results],
+            ["Type 1 diabetes"],
+        )
+        self.assertEqual(
+            len(self.search(self.medical_history_url, '"type 2 diabetes"')), 1
+        )
+
+    def test_query_is_validated_and_staff_only(self):
+        response = self.client.get(self.visit_history_url, {"q": "a"})
+        self.assertEqual(response.status_code, 400)
+
+        client = APIClient()
+        client.force_authenticate(self.patient.user)
+        response = client.get(self.visit_history_url, {"q": "fever"})
+        self.assertEqual(response.status_code, 403)
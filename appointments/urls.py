@@ -6,7 +6,54 @@ urlpatterns = [
     path("availabilities/", views.AvailabilityListAPIView.as_view()),
     path("book/", views.BookAppointmentAPIView.as_view()),
     path("staff/visit-history/", views.AdminVisitHistoryView.as_view()),
+    path(
+        "staff/visit-history/<str:pk>/lab-observations/",
+        views.AdminLabObservationListCreateAPIView.as_view(),
+    ),
+    path(
+        "staff/lab-observations/",
+        views.AdminLabObservationSearchAPIView.as_view(),
+    ),
+    path(
+        "staff/lab-observations/trend/", views.AdminLabTrendAPIView.as_view()
+    ),
+    path(
+        "staff/lab-observations/import/",
+        views.AdminLabImportAPIView.as_view(),
+    ),
+    path("staff/export/", views.AdminBulkExportAPIView.as_view()),
+    path(
+        "staff/export/<str:pk>/",
+        views.AdminBulkExportStatusAPIView.as_view(),
+        name="bulk_export_status",
+    ),
+    path(
+        "staff/export/<str:pk>/<str:resource_type>/",
+        views.AdminBulkExportFileAPIView.as_view(),
+        name="bulk_export_file",
+    ),
+    path(
+        "staff/spreadsheets/<str:name>/",
+        views.AdminSpreadsheetExportAPIView.as_view(),
+        name="spreadsheet_export",
+    ),
     path("staff/", views.AdminListAppointmentAPIView.as_view()),
+    path(
+        "staff/bulk-status/",
+        views.AdminBulkUpdateAppointmentStatusAPIView.as_view(),
+    ),
+    path(
+        "staff/sweeper-metrics/", views.AdminSweeperMetricsAPIView.as_view()
+    ),
+    path("staff/workload/", views.AdminWorkloadReportAPIView.as_view()),
+    path(
+        "staff/search/visit-history/",
+        views.AdminVisitHistorySearchAPIView.as_view(),
+    ),
+    path(
+        "staff/search/medical-history/",
+        views.AdminMedicalHistorySearchAPIView.as_view(),
+    ),
     path("staff/<str:pk>/", views.AdminUpdateAppointmentAPIView.as_view()),
     path("visit-history/", views.VisitHistoryListAPIView.as_view()),
     path(
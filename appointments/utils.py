@@ -0,0 +1,303 @@
+from datetime import timedelta
+from django.db import models, transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+from appointments.choices import BOOKING_STATUS, STATUS_TRANSITIONS
+from appointments.models import Appointment, Availability, VisitHistory
+from appointments.workload import (
+    WORKLOAD_DAY_FIELDS,
+    mark_workload_changed,
+    mark_workload_of,
+)
+from users.sync import with_updated_at
+
+
+def can_transition(current_status: str, new_status: str) -> bool:
+    return current_status == new_status or new_status in (
+        STATUS_TRANSITIONS.get(current_status, ())
+    )
+
+
+def get_source_statuses(new_status: str) -> list:
+    """Statuses an appointment must be in to be moved to `new_status`."""
+    return [
+        status
+        for status, targets in STATUS_TRANSITIONS.items()
+        if new_status in targets
+    ]
+
+
+def create_visit_histories(appointment_ids):
+    """Create the missing visit histories for the given appointments in one
+    insert. Appointments that already have a visit history are skipped."""
+    appointments = Appointment.objects.filter(id__in=appointment_ids).values(
+        "id", "patient_id", "medical_professional_id", "start_time"
+    )
+    VisitHistory.objects.bulk_create(
+        [
+            VisitHistory(
+                appointment_id=appointment["id"],
+                patient_id=appointment["patient_id"],
+                medical_professional_id=appointment["medical_professional_id"],
+                visit_date=appointment["start_time"].date(),
+            )
+            for appointment in appointments
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def coalesce_availability(availability: Availability) -> Availability:
+    """Merge `availability` with the free slots of the same medical
+    professional that overlap or touch it."""
+    with transaction.atomic():
+        while True:
+            neighbours = list(
+                Availability.objects.select_for_update()
+                .filter(
+                    medical_professional_id=(
+                        availability.medical_professional_id
+                    ),
+                    is_booked=False,
+                    start_time__lte=availability.end_time,
+                    end_time__gte=availability.start_time,
+                )
+                .exclude(id=availability.id)
+            )
+            if not neighbours:
+                return availability
+
+            availability.start_time = min(
+                [availability.start_time]
+                + [neighbour.start_time for neighbour in neighbours]
+            )
+            availability.end_time = max(
+                [availability.end_time]
+                + [neighbour.end_time for neighbour in neighbours]
+            )
+            Availability.objects.filter(
+                id__in=[neighbour.id for neighbour in neighbours]
+            ).delete()
+            availability.save()
+
+
+def book_availability(
+    availability: Availability, start_time, end_time
+) -> Availability:
+    """Book the part of the free `availability` from `start_time` to
+    `end_time`. The free days before and after it are split off into slots
+    of their own."""
+    with transaction.atomic():
+        # Calculate the difference in days between the appointment and
+        # the availability
+        appointment_duration = (end_time - start_time).days
+        availability_duration = (
+            availability.end_time - availability.start_time
+        ).days
+
+        # remembered so freeing the booking gives the whole slot back,
+        # see free_availability
+        availability.parent_start_time = availability.start_time
+        availability.parent_end_time = availability.end_time
+
+        # Unless the appointment covers the entire availability period,
+        # split off the free days around it
+        if appointment_duration != availability_duration:
+            # check if there are free days prior to user appointment
+            # start date
+            if (start_time - availability.start_time).days > 0:
+                prev_day = start_time - timedelta(days=1)
+                Availability.objects.create(
+                    medical_professional_id=(
+                        availability.medical_professional_id
+                    ),
+                    start_time=availability.start_time,
+                    end_time=prev_day.replace(
+                        hour=22, minute=59, second=0, microsecond=0
+                    ),
+                )
+
+            # Create a new availability for the remaining days after
+            if end_time + timedelta(days=1) <= availability.end_time:
+                next_day = end_time + timedelta(days=1)
+                Availability.objects.create(
+                    medical_professional_id=(
+                        availability.medical_professional_id
+                    ),
+                    start_time=next_day.replace(
+                        hour=0, minute=0, second=0, microsecond=0
+                    ),
+                    end_time=availability.end_time,
+                )
+        # the booked slot holds exactly the appointment
+        availability.start_time = start_time
+        availability.end_time = end_time
+        availability.is_booked = True
+        availability.save()
+        return availability
+
+
+def free_availability(availability: Availability) -> Availability:
+    """Free a booked slot. It gets back the part of the free slot it was cut
+    from that no other booking holds, and is merged with the free slots it
+    then overlaps or touches, e.g. the other pieces of the booking split."""
+    with transaction.atomic():
+        availability.is_booked = False
+        if availability.parent_start_time is not None:
+            bounds = (
+                Availability.objects.filter(
+                    medical_professional_id=(
+                        availability.medical_professional_id
+                    ),
+                    is_booked=True,
+                )
+                .exclude(id=availability.id)
+                .aggregate(
+                    booked_before=Max(
+                        "end_time",
+                        filter=Q(
+                            end_time__lte=availability.start_time,
+                            end_time__gt=availability.parent_start_time,
+                        ),
+                    ),
+                    booked_after=Min(
+                        "start_time",
+                        filter=Q(
+                            start_time__gte=availability.end_time,
+                            start_time__lt=availability.parent_end_time,
+                        ),
+                    ),
+                )
+            )
+            availability.start_time = max(
+                availability.parent_start_time,
+                bounds["booked_before"] or availability.parent_start_time,
+            )
+            availability.end_time = min(
+                availability.parent_end_time,
+                bounds["booked_after"] or availability.parent_end_time,
+            )
+            availability.parent_start_time = None
+            availability.parent_end_time = None
+        availability.save()
+        return coalesce_availability(availability)
+
+
+def release_availability(appointment: Appointment):
+    """Free the availability booked for `appointment`, see
+    free_availability. Returns the freed availability, if any."""
+    with transaction.atomic():
+        availability = (
+            Availability.objects.select_for_update()
+            .filter(
+                medical_professional_id=appointment.medical_professional_id,
+                is_booked=True,
+                start_time=appointment.start_time,
+                end_time=appointment.end_time,
+            )
+            .first()
+        )
+        if not availability:
+            return None
+        return free_availability(availability)
+
+
+def coalesce_professional_availability(medical_professional_id) -> int:
+    """Merge the overlapping and touching free slots of a medical
+    professional in a single pass. Returns the number of slots absorbed into
+    their neighbours."""
+    with transaction.atomic():
+        availabilities = list(
+            Availability.objects.select_for_update()
+            .filter(
+                medical_professional_id=medical_professional_id,
+                is_booked=False,
+            )
+            .order_by("start_time")
+        )
+        slots = [
+            (
+                availability.medical_professional_id,
+                availability.start_time,
+                availability.end_time,
+            )
+            for availability in availabilities
+        ]
+
+        merged, absorbed_ids = [], []
+        for availability in availabilities:
+            current = merged[-1] if merged else None
+            if current and availability.start_time <= current.end_time:
+                current.end_time = max(current.end_time, availability.end_time)
+                absorbed_ids.append(availability.id)
+            else:
+                merged.append(availability)
+
+        if absorbed_ids:
+            mark_workload_changed(Availability, slots)
+            Availability.objects.filter(id__in=absorbed_ids).delete()
+            # bulk_update skips auto_now
+            now = timezone.now()
+            for availability in merged:
+                availability.updated_at = now
+            Availability.objects.bulk_update(
+                merged, ["end_time", "updated_at"]
+            )
+        return len(absorbed_ids)
+
+
+def get_visit_history_queryset():
+    """Visit histories with everything VisitHistorySerializer reads, in a
+    fixed number of queries however many rows are serialized."""
+    return VisitHistory.objects.select_related(
+        # UserBaseSerializer looks up the medical professional of the user
+        "appointment__patient__user__medicalprofessional",
+        "appointment__medical_professional__user",
+    ).prefetch_related(
+        "appointment__patient__medical_history",
+        "test_results",
+        "uploads",
+    )
+
+
+def get_leaked_availability_queryset():
+    """Booked availability that no live (non cancelled) appointment sits
+    in."""
+    live_appointments = Appointment.objects.filter(
+        medical_professional=models.OuterRef("medical_professional"),
+        start_time__gte=models.OuterRef("start_time"),
+        end_time__lte=models.OuterRef("end_time"),
+    ).exclude(status=BOOKING_STATUS.CANCELLED)
+    return Availability.objects.filter(is_booked=True).exclude(
+        models.Exists(live_appointments)
+    )
+
+
+def update_in_batches(queryset, batch_size: int, **values):
+    """Apply `values` to the rows of `queryset` a batch at a time so no
+    single UPDATE holds locks on the whole set. The update must take the
+    rows out of `queryset`. Returns (rows updated, batches run)."""
+    updated = batches = 0
+    while True:
+        ids = list(queryset.values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return updated, batches
+        rows = queryset.model.objects.filter(pk__in=ids)
+        mark_workload_of(rows)
+        updated += rows.update(**with_updated_at(queryset.model, values))
+        if WORKLOAD_DAY_FIELDS & values.keys():
+            mark_workload_of(rows)
+        batches += 1
+
+
+def delete_in_batches(queryset, batch_size: int):
+    """Delete the rows of `queryset` a batch at a time. Returns
+    (rows deleted, batches run)."""
+    deleted = batches = 0
+    while True:
+        ids = list(queryset.values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return deleted, batches
+        count, _ = queryset.model.objects.filter(pk__in=ids).delete()
+        deleted += count
+        batches += 1
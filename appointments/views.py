@@ -1,21 +1,88 @@
+import io
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import FileResponse, StreamingHttpResponse
+from django.urls import reverse
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import MultiPartParser
+from rest_framework import status
 from users.permissions import IsAccountVerified
+from users.representations import RepresentationListMixin
+from users.sync import DeltaListMixin
+from users.versions import VersionedListMixin
+from users.utils import SearchResultsPagination
 from rest_framework.views import APIView
 from rest_framework.generics import (
     CreateAPIView,
     ListAPIView,
+    ListCreateAPIView,
     RetrieveAPIView,
     RetrieveUpdateDestroyAPIView,
 )
-from appointments.models import Availability, Appointment, VisitHistory
+from appointments.choices import BOOKING_STATUS, EXPORT_STATUS
+from appointments.models import (
+    Availability,
+    Appointment,
+    BulkExport,
+    ProfessionalDailyWorkload,
+    VisitHistory,
+)
 from appointments.serilaizers import (
     AvailabilitySerializer,
     AppointmentSerializer,
+    AppointmentBulkStatusSerializer,
     VisitHistorySerializer,
+    WorkloadReportSerializer,
+    ClinicalSearchSerializer,
+    VisitHistorySearchResultSerializer,
+    MedicalHistorySearchResultSerializer,
+    LabObservationSerializer,
+    LabObservationFilterSerializer,
+    LabTrendSerializer,
+    LabImportSerializer,
+    BulkExportRequestSerializer,
+    BulkExportSerializer,
+    SpreadsheetExportSerializer,
+)
+from appointments.tasks import SWEEPER_METRICS_CACHE_KEY, run_bulk_export
+from appointments.utils import (
+    get_visit_history_queryset,
+    release_availability,
+)
+from appointments.workload import WORKLOAD_FIELDS
+from appointments.search import (
+    search_medical_histories,
+    search_visit_histories,
+)
+from appointments.representations import (
+    APPOINTMENT_DELTA_FIELDS,
+    APPOINTMENT_FIELDS,
+    represent_appointments,
+)
+from appointments.labs import filter_lab_observations, get_lab_trend
+from appointments.lab_import import import_lab_results
+from appointments.spreadsheets import (
+    CONTENT_TYPES,
+    SPREADSHEETS,
+    WRITERS,
+    get_spreadsheet_rows,
 )
 
 
+class ReleaseAvailabilityOnDestroyMixin:
+    """Frees the booked availability when an appointment is deleted."""
+
+    def perform_destroy(self, instance: Appointment):
+        with transaction.atomic():
+            if instance.status != BOOKING_STATUS.CANCELLED:
+                release_availability(instance)
+            instance.delete()
+
+
 class AvailabilityListAPIView(ListAPIView):
     permission_classes = (
         IsAuthenticated,
@@ -45,7 +112,9 @@ class BookAppointmentAPIView(CreateAPIView):
     serializer_class = AppointmentSerializer
 
 
-class AdminUpdateAppointmentAPIView(RetrieveUpdateDestroyAPIView):
+class AdminUpdateAppointmentAPIView(
+    ReleaseAvailabilityOnDestroyMixin, RetrieveUpdateDestroyAPIView
+):
     permission_classes = (
         IsAuthenticated,
         IsAdminUser,
@@ -58,33 +127,152 @@ class AdminUpdateAppointmentAPIView(RetrieveUpdateDestroyAPIView):
         )
 
 
-class AdminListAppointmentAPIView(ListAPIView):
+class AdminBulkUpdateAppointmentStatusAPIView(APIView):
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+    serializer_class = AppointmentBulkStatusSerializer
+
+    def post(self, request):
+        serializer = AppointmentBulkStatusSerializer(
+            data=request.data, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+        data = serializer.save()
+        return Response(data)
+
+
+class AdminSweeperMetricsAPIView(APIView):
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+    def get(self, request):
+        metrics = cache.get(SWEEPER_METRICS_CACHE_KEY)
+        if not metrics:
+            return Response(
+                {"detail": "The stale appointment sweeper has not run yet."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response(metrics)
+
+
+class AdminWorkloadReportAPIView(APIView):
+    """Daily appointment counts by status, booked and available minutes and
+    utilization of every medical professional, or of
+    `medical_professional_id`, from `start` to `end` inclusive (the last 30
+    days by default). Read from the precomputed daily workload rows."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+    def get(self, request):
+        serializer = WorkloadReportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        start = serializer.validated_data["start"]
+        end = serializer.validated_data["end"]
+
+        workloads = ProfessionalDailyWorkload.objects.filter(
+            day__gte=start, day__lte=end
+        )
+        if "medical_professional_id" in serializer.validated_data:
+            workloads = workloads.filter(
+                medical_professional_id=serializer.validated_data[
+                    "medical_professional_id"
+                ]
+            )
+        count_fields = [
+            field for field in WORKLOAD_FIELDS if field != "refreshed_at"
+        ]
+        # distinct patients do not add up across days
+        total_fields = [field for field in count_fields if field != "patients"]
+
+        professionals = {}
+        for workload in workloads.order_by(
+            "medical_professional_id", "day"
+        ).values("medical_professional_id", "day", *count_fields):
+            workload["utilization"] = _utilization(workload)
+            report = professionals.setdefault(
+                workload.pop("medical_professional_id"),
+                {field: 0 for field in total_fields},
+            )
+            for field in total_fields:
+                report[field] += workload[field]
+            report.setdefault("days", []).append(workload)
+
+        for medical_professional_id, report in professionals.items():
+            report["medical_professional"] = medical_professional_id
+            report["utilization"] = _utilization(report)
+        return Response(
+            {
+                "start": start,
+                "end": end,
+                "professionals": list(professionals.values()),
+            }
+        )
+
+
+def _utilization(workload: dict):
+    if not workload["available_minutes"]:
+        return None
+    return round(workload["booked_minutes"] / workload["available_minutes"], 4)
+
+
+class AdminListAppointmentAPIView(
+    VersionedListMixin,
+    DeltaListMixin,
+    RepresentationListMixin,
+    ListAPIView,
+):
     permission_classes = (
         IsAuthenticated,
         IsAdminUser,
     )
     serializer_class = AppointmentSerializer
+    representation_fields = APPOINTMENT_FIELDS
+    represent_rows = staticmethod(represent_appointments)
+    etag_fields = delta_fields = APPOINTMENT_DELTA_FIELDS
 
     def get_queryset(self):
         return Appointment.objects.filter(
             medical_professional=self.request.user.medicalprofessional
         )
 
+    def get_tombstone_owners(self):
+        return {"medical_professional": self.request.user.medicalprofessional}
+
 
-class PatientAppointmentListAPIView(ListAPIView):
+class PatientAppointmentListAPIView(
+    VersionedListMixin,
+    DeltaListMixin,
+    RepresentationListMixin,
+    ListAPIView,
+):
     permission_classes = (
         IsAuthenticated,
         IsAccountVerified,
     )
     serializer_class = AppointmentSerializer
+    representation_fields = APPOINTMENT_FIELDS
+    represent_rows = staticmethod(represent_appointments)
+    etag_fields = delta_fields = APPOINTMENT_DELTA_FIELDS
 
     def get_queryset(self):
         return Appointment.objects.filter(
             patient=self.request.user.patient,
         )
 
+    def get_tombstone_owners(self):
+        return {"patient": self.request.user.patient}
+
 
-class PatientAppointmentUpdateAPIView(RetrieveUpdateDestroyAPIView):
+class PatientAppointmentUpdateAPIView(
+    ReleaseAvailabilityOnDestroyMixin, RetrieveUpdateDestroyAPIView
+):
     permission_classes = (
         IsAuthenticated,
         IsAccountVerified,
@@ -97,16 +285,26 @@ class PatientAppointmentUpdateAPIView(RetrieveUpdateDestroyAPIView):
         )
 
 
-class VisitHistoryListAPIView(ListAPIView):
+class VisitHistoryListAPIView(DeltaListMixin, ListAPIView):
     permission_classes = (
         IsAuthenticated,
         IsAccountVerified,
     )
     serializer_class = VisitHistorySerializer
+    delta_fields = ("updated_at",) + tuple(
+        "appointment__" + field for field in APPOINTMENT_DELTA_FIELDS
+    )
 
     def get_queryset(self):
         patient = self.request.user.patient
-        return VisitHistory.objects.filter(patient=patient)
+        return (
+            get_visit_history_queryset()
+            .filter(patient=patient)
+            .order_by("-visit_date", "-pk")
+        )
+
+    def get_tombstone_owners(self):
+        return {"patient": self.request.user.patient}
 
 
 class VisitHistoryRetrieveAPIView(RetrieveAPIView):
@@ -118,7 +316,7 @@ class VisitHistoryRetrieveAPIView(RetrieveAPIView):
 
     def get_queryset(self):
         patient = self.request.user.patient
-        return VisitHistory.objects.filter(patient=patient)
+        return get_visit_history_queryset().filter(patient=patient)
 
 
 class AdminVisitHistoryView(APIView):
@@ -130,10 +328,11 @@ class AdminVisitHistoryView(APIView):
     def get(self, request):
         doctor = self.request.user.medicalprofessional
         appointment_id = self.request.query_params.get("appointment_id")
-        print(appointment_id, "HHHHHHHHHHHH")
-        vh = VisitHistory.objects.filter(
-            medical_professional=doctor, appointment=appointment_id
-        ).first()
+        vh = (
+            get_visit_history_queryset()
+            .filter(medical_professional=doctor, appointment=appointment_id)
+            .first()
+        )
         serializer = VisitHistorySerializer(vh)
 
         return Response(serializer.data)
@@ -148,3 +347,270 @@ class AdminVisitHistoryView(APIView):
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data)
+
+
+class AdminClinicalSearchMixin:
+    """Ranked full-text search of `q` over the records of the requesting
+    medical professional's patients, with highlighted snippets."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+    pagination_class = SearchResultsPagination
+    search_function = None
+
+    def get_queryset(self):
+        serializer = ClinicalSearchSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return self.search_function(
+            self.request.user.medicalprofessional,
+            serializer.validated_data["q"],
+        )
+
+
+class AdminVisitHistorySearchAPIView(AdminClinicalSearchMixin, ListAPIView):
+    serializer_class = VisitHistorySearchResultSerializer
+    search_function = staticmethod(search_visit_histories)
+
+
+class AdminMedicalHistorySearchAPIView(AdminClinicalSearchMixin, ListAPIView):
+    serializer_class = MedicalHistorySearchResultSerializer
+    search_function = staticmethod(search_medical_histories)
+
+
+class AdminLabObservationListCreateAPIView(ListCreateAPIView):
+    """Lab observations of one of the requesting medical professional's
+    visits. Accepts a single observation or a batch of them."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+    serializer_class = LabObservationSerializer
+
+    def get_visit_history(self):
+        visit_history = VisitHistory.objects.filter(
+            pk=self.kwargs["pk"],
+            medical_professional=self.request.user.medicalprofessional,
+        ).first()
+        if not visit_history:
+            raise NotFound("No visit history found for that id")
+        return visit_history
+
+    def get_queryset(self):
+        return self.get_visit_history().lab_observations.order_by(
+            "observed_at", "analyte_code"
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs["many"] = isinstance(kwargs.get("data"), list)
+        return super().get_serializer(*args, **kwargs)
+
+    def perform_create(self, serializer):
+        visit_history = self.get_visit_history()
+        serializer.save(
+            visit_history=visit_history, patient_id=visit_history.patient_id
+        )
+
+
+class AdminLabObservationSearchAPIView(ListAPIView):
+    """Lab observations filtered by patient, analyte, observation time,
+    value range and flag, newest first. `abnormal=true` keeps the results
+    outside their reference range."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+    serializer_class = LabObservationSerializer
+
+    def get_queryset(self):
+        serializer = LabObservationFilterSerializer(
+            data=self.request.query_params
+        )
+        serializer.is_valid(raise_exception=True)
+        return filter_lab_observations(**serializer.validated_data)
+
+
+class AdminLabTrendAPIView(APIView):
+    """Per hour, day or month aggregates of one analyte of a patient."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+    def get(self, request):
+        serializer = LabTrendSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(list(get_lab_trend(**serializer.validated_data)))
+
+
+class AdminLabImportAPIView(APIView):
+    """Imports a CSV or HL7 lab result file uploaded as `file`, see
+    appointments.lab_import. The file is read a line at a time."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+    parser_classes = (MultiPartParser,)
+
+    def post(self, request):
+        serializer = LabImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = io.TextIOWrapper(
+            serializer.validated_data["file"].file,
+            encoding="utf-8-sig",
+            errors="replace",
+            newline="",
+        )
+        report = import_lab_results(lines, serializer.validated_data["format"])
+        return Response(
+            report,
+            status=(
+                status.HTTP_400_BAD_REQUEST
+                if report["failed"] and not report["created"]
+                else status.HTTP_201_CREATED
+            ),
+        )
+
+
+"""
+    Bulk Export Section
+"""
+
+
+class AdminBulkExportAPIView(APIView):
+    """Kicks off a bulk export of the `types` of resources given (all by
+    default) changed `since` a time, see appointments.bulk_export. Poll the
+    returned status URL until the export is completed."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+    def post(self, request):
+        serializer = BulkExportRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        bulk_export = BulkExport.objects.create(
+            requested_by=request.user,
+            resource_types=serializer.validated_data["types"],
+            since=serializer.validated_data.get("since"),
+        )
+        transaction.on_commit(
+            lambda: run_bulk_export.delay(str(bulk_export.pk))
+        )
+        return Response(
+            BulkExportSerializer(
+                bulk_export, context={"request": request}
+            ).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={
+                "Content-Location": request.build_absolute_uri(
+                    reverse("bulk_export_status", args=[bulk_export.pk])
+                )
+            },
+        )
+
+
+class AdminBulkExportStatusAPIView(APIView):
+    """Status of a bulk export, 202 while it runs and 200 with the URL of
+    every file once it is done. Deleting an export deletes its files."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+    def get_object(self, pk):
+        bulk_export = BulkExport.objects.filter(
+            pk=pk, requested_by=self.request.user
+        ).first()
+        if not bulk_export:
+            raise NotFound("No export found for that id")
+        return bulk_export
+
+    def get(self, request, pk):
+        bulk_export = self.get_object(pk)
+        running = bulk_export.status in (
+            EXPORT_STATUS.PENDING,
+            EXPORT_STATUS.RUNNING,
+        )
+        return Response(
+            BulkExportSerializer(
+                bulk_export, context={"request": request}
+            ).data,
+            status=status.HTTP_202_ACCEPTED if running else status.HTTP_200_OK,
+        )
+
+    def delete(self, request, pk):
+        bulk_export = self.get_object(pk)
+        for output in bulk_export.output:
+            default_storage.delete(output["file"])
+        bulk_export.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class AdminBulkExportFileAPIView(APIView):
+    """Streams one gzipped NDJSON file of a completed bulk export."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+    def get(self, request, pk, resource_type):
+        bulk_export = BulkExport.objects.filter(
+            pk=pk, requested_by=request.user
+        ).first()
+        output = next(
+            (
+                output
+                for output in (bulk_export.output if bulk_export else [])
+                if output["type"] == resource_type
+            ),
+            None,
+        )
+        if not output:
+            raise NotFound("No export file found for that type")
+        return FileResponse(
+            default_storage.open(output["file"]),
+            as_attachment=True,
+            filename=f"{resource_type}.ndjson.gz",
+            content_type="application/gzip",
+        )
+
+
+class AdminSpreadsheetExportAPIView(APIView):
+    """Streams the staff member's appointments or availability, or all
+    patients, as a CSV (default) or XLSX `file_type` spreadsheet,
+    optionally limited to slots starting between `start` and `end`."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+    def get(self, request, name):
+        if name not in SPREADSHEETS:
+            raise NotFound("No spreadsheet found for that name")
+        serializer = SpreadsheetExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        file_type = serializer.validated_data["file_type"]
+        header, rows = get_spreadsheet_rows(
+            name,
+            request.user,
+            start=serializer.validated_data.get("start"),
+            end=serializer.validated_data.get("end"),
+        )
+        response = StreamingHttpResponse(
+            WRITERS[file_type](header, rows, sheet_name=name.title()),
+            content_type=CONTENT_TYPES[file_type],
+        )
+        response["Content-Disposition"] = (
+            'attachment; filename="{}.{}"'.format(name, file_type)
+        )
+        return response
@@ -0,0 +1,300 @@
+"""
+Daily workload of every medical professional.
+
+ProfessionalDailyWorkload rows hold each professional's appointment counts
+by status, booked minutes and availability minutes per day. They are
+recomputed for a range of days at a time with a few grouped queries
+bounded on the indexed start times, so reports only read the precomputed
+rows.
+
+Every write to an appointment or availability marks the (professional,
+day) pairs it touches with a ProfessionalWorkloadChange, and the periodic
+refresh only recomputes those. Saves and deletes, queryset deletes
+included, are marked by the signals in users.signals; bulk updates mark
+their rows themselves.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from appointments.choices import BOOKING_STATUS
+from appointments.models import (
+    Appointment,
+    Availability,
+    ProfessionalDailyWorkload,
+    ProfessionalWorkloadChange,
+)
+
+# ProfessionalDailyWorkload field counting the appointments of each status
+STATUS_FIELDS = {
+    BOOKING_STATUS.PENDING: "pending",
+    BOOKING_STATUS.ACCEPTED: "accepted",
+    BOOKING_STATUS.ACTIVE: "active",
+    BOOKING_STATUS.COMPLETED: "completed",
+    BOOKING_STATUS.CANCELLED: "cancelled",
+    BOOKING_STATUS.EXPIRED: "expired",
+    BOOKING_STATUS.NO_SHOW: "no_show",
+}
+# statuses that kept the professional's time taken
+BOOKED_STATUSES = (
+    BOOKING_STATUS.PENDING,
+    BOOKING_STATUS.ACCEPTED,
+    BOOKING_STATUS.ACTIVE,
+    BOOKING_STATUS.COMPLETED,
+    BOOKING_STATUS.NO_SHOW,
+)
+WORKLOAD_FIELDS = [
+    "appointments",
+    *STATUS_FIELDS.values(),
+    "patients",
+    "booked_minutes",
+    "available_minutes",
+    "refreshed_at",
+]
+# fields that decide which workload rows an appointment or slot counts in
+WORKLOAD_DAY_FIELDS = {
+    "medical_professional",
+    "medical_professional_id",
+    "start_time",
+    "end_time",
+}
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _minutes(duration) -> int:
+    return int(duration.total_seconds() // 60) if duration else 0
+
+
+def _appointment_rows(start, end, medical_professional_ids=None) -> dict:
+    appointments = Appointment.objects.filter(
+        start_time__gte=start, start_time__lt=end
+    )
+    if medical_professional_ids is not None:
+        appointments = appointments.filter(
+            medical_professional_id__in=medical_professional_ids
+        )
+    aggregates = {
+        "appointments": Count("id"),
+        "patients": Count("patient_id", distinct=True),
+        "booked": Sum(
+            F("end_time") - F("start_time"),
+            filter=Q(status__in=BOOKED_STATUSES),
+        ),
+    }
+    for status, field in STATUS_FIELDS.items():
+        aggregates[field] = Count("id", filter=Q(status=status))
+
+    rows = (
+        appointments.annotate(day=TruncDate("start_time"))
+        .order_by()
+        .values("medical_professional_id", "day")
+        .annotate(**aggregates)
+    )
+    return {
+        (row.pop("medical_professional_id"), row.pop("day")): row
+        for row in rows
+    }
+
+
+def _available_minutes(start, end, medical_professional_ids=None) -> dict:
+    """Minutes of availability, booked or not, of every professional and
+    day. Coalesced slots can span several days, so each slot is split on
+    day boundaries."""
+    slots = Availability.objects.filter(start_time__lt=end, end_time__gt=start)
+    if medical_professional_ids is not None:
+        slots = slots.filter(
+            medical_professional_id__in=medical_professional_ids
+        )
+
+    minutes = defaultdict(int)
+    for medical_professional_id, slot_start, slot_end in slots.values_list(
+        "medical_professional_id", "start_time", "end_time"
+    ).iterator(chunk_size=2000):
+        slot_start, slot_end = max(slot_start, start), min(slot_end, end)
+        day = timezone.localdate(slot_start)
+        while slot_start < slot_end:
+            day_end = _day_start(day + timedelta(days=1))
+            minutes[(medical_professional_id, day)] += _minutes(
+                min(slot_end, day_end) - slot_start
+            )
+            slot_start, day = day_end, day + timedelta(days=1)
+    return minutes
+
+
+def refresh_workload(start_day, end_day, medical_professional_ids=None):
+    """Recompute the workload rows of the days from `start_day` up to, but
+    not including, `end_day`. Returns the number of rows written.
+
+    The sweeper deletes free availability once it is
+    STALE_AVAILABILITY_RETENTION old, so the availability minutes of days it
+    may have reached are kept as they were last computed."""
+    start, end = _day_start(start_day), _day_start(end_day)
+    swept_before = timezone.localdate(
+        timezone.now() - settings.STALE_AVAILABILITY_RETENTION
+    ) + timedelta(days=1)
+    appointment_rows = _appointment_rows(start, end, medical_professional_ids)
+    available_minutes = _available_minutes(
+        start, end, medical_professional_ids
+    )
+
+    current, swept = [], []
+    for key in appointment_rows.keys() | available_minutes.keys():
+        medical_professional_id, day = key
+        row = appointment_rows.get(key, {})
+        workload = ProfessionalDailyWorkload(
+            medical_professional_id=medical_professional_id,
+            day=day,
+            appointments=row.get("appointments", 0),
+            patients=row.get("patients", 0),
+            booked_minutes=_minutes(row.get("booked")),
+            available_minutes=available_minutes.get(key, 0),
+            **{field: row.get(field, 0) for field in STATUS_FIELDS.values()},
+        )
+        (swept if day < swept_before else current).append(workload)
+
+    # days with nothing left, e.g. after all their appointments were deleted
+    existing = ProfessionalDailyWorkload.objects.filter(
+        day__gte=max(start_day, swept_before), day__lt=end_day
+    )
+    if medical_professional_ids is not None:
+        existing = existing.filter(
+            medical_professional_id__in=medical_professional_ids
+        )
+    current_keys = {
+        (workload.medical_professional_id, workload.day)
+        for workload in current
+    }
+    stale_ids = [
+        workload_id
+        for workload_id, medical_professional_id, day in existing.values_list(
+            "id", "medical_professional_id", "day"
+        )
+        if (medical_professional_id, day) not in current_keys
+    ]
+
+    with transaction.atomic():
+        ProfessionalDailyWorkload.objects.filter(id__in=stale_ids).delete()
+        ProfessionalDailyWorkload.objects.bulk_create(
+            current,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["medical_professional", "day"],
+            update_fields=WORKLOAD_FIELDS,
+        )
+        ProfessionalDailyWorkload.objects.bulk_create(
+            swept,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["medical_professional", "day"],
+            update_fields=[
+                field
+                for field in WORKLOAD_FIELDS
+                if field != "available_minutes"
+            ],
+        )
+    return len(current) + len(swept)
+
+
+def get_workload_days(model, rows) -> set:
+    """The (medical_professional_id, day) pairs whose workload rows count
+    `rows` of `model`, given as (medical_professional_id, start_time,
+    end_time). An appointment counts on the day it starts, a slot on every
+    day it covers."""
+    days = set()
+    for medical_professional_id, start_time, end_time in rows:
+        day = last_day = timezone.localdate(start_time)
+        if model is Availability and end_time > start_time:
+            last_day = timezone.localdate(end_time - timedelta(microseconds=1))
+        while day <= last_day:
+            days.add((medical_professional_id, day))
+            day += timedelta(days=1)
+    return days
+
+
+def mark_workload_changed(model, rows):
+    """Mark the days `rows` of `model` count in, see get_workload_days, as
+    needing a refresh. Rows of other models are ignored."""
+    if model not in (Appointment, Availability):
+        return
+    days = get_workload_days(model, rows)
+    if not days:
+        return
+    changed_at = timezone.now()
+    # a stable order keeps concurrent upserts from deadlocking
+    ProfessionalWorkloadChange.objects.bulk_create(
+        [
+            ProfessionalWorkloadChange(
+                medical_professional_id=medical_professional_id,
+                day=day,
+                changed_at=changed_at,
+            )
+            for medical_professional_id, day in sorted(days, key=str)
+        ],
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["medical_professional", "day"],
+        update_fields=["changed_at"],
+    )
+
+
+def mark_workload_of(queryset):
+    """Mark the days of the appointments or slots of `queryset`."""
+    if queryset.model not in (Appointment, Availability):
+        return
+    mark_workload_changed(
+        queryset.model,
+        queryset.values_list(
+            "medical_professional_id", "start_time", "end_time"
+        ),
+    )
+
+
+def refresh_changed_workload(batch_size=None) -> int:
+    """Recompute the workload rows of the marked days, a batch of marks at a
+    time, then clear the marks no write has renewed in the meantime. Marks
+    renewed during the run are left for the next one. Returns the number of
+    rows written."""
+    batch_size = batch_size or settings.WORKLOAD_REFRESH_BATCH_SIZE
+    changes = ProfessionalWorkloadChange.objects.order_by(
+        "day", "medical_professional_id"
+    )
+    written, after = 0, None
+    while True:
+        batch = changes
+        if after:
+            day, medical_professional_id = after
+            batch = batch.filter(
+                Q(day__gt=day)
+                | Q(
+                    day=day,
+                    medical_professional_id__gt=medical_professional_id,
+                )
+            )
+        batch = list(
+            batch.values_list(
+                "id", "medical_professional_id", "day", "changed_at"
+            )[:batch_size]
+        )
+        if not batch:
+            return written
+
+        medical_professional_ids = defaultdict(set)
+        for _, medical_professional_id, day, _ in batch:
+            medical_professional_ids[day].add(medical_professional_id)
+        for day, ids in medical_professional_ids.items():
+            written += refresh_workload(day, day + timedelta(days=1), ids)
+
+        refreshed = Q()
+        for change_id, _, _, changed_at in batch:
+            refreshed |= Q(id=change_id, changed_at=changed_at)
+        ProfessionalWorkloadChange.objects.filter(refreshed).delete()
+        _, medical_professional_id, day, _ = batch[-1]
+        after = (day, medical_professional_id)
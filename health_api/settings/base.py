@@ -28,6 +28,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     # apps - alphasorted
     "appointments",
     "users",
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "users.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -146,11 +148,11 @@ REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 1000,
     "DEFAULT_PARSER_CLASSES": [
-        "rest_framework.parsers.JSONParser",
+        "users.parsers.FastJSONParser",
         "rest_framework.parsers.MultiPartParser",
         "rest_framework.parsers.FormParser",
     ],
-    "DEFAULT_RENDERER_CLASSES": ["rest_framework.renderers.JSONRenderer"],
+    "DEFAULT_RENDERER_CLASSES": ["users.renderers.FastJSONRenderer"],
     "EXCEPTION_HANDLER": "users.utils.custom_exception_handler",
     "TEST_REQUEST_DEFAULT_FORMAT": "json",
 }
@@ -192,5 +194,98 @@ CELERY_ACCEPT_CONTENT = ["application/json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    "sweep-stale-appointments": {
+        "task": "sweep_stale_appointments",
+        "schedule": timedelta(minutes=15),
+    },
+    "send-appointment-reminders": {
+        "task": "send_appointment_reminders",
+        "schedule": timedelta(minutes=5),
+    },
+    "create-appointment-partitions": {
+        "task": "create_appointment_partitions",
+        "schedule": timedelta(days=1),
+    },
+    "refresh-professional-workload": {
+        "task": "refresh_professional_workload",
+        "schedule": timedelta(minutes=15),
+    },
+    "rollup-vital-signs": {
+        "task": "rollup_vital_signs",
+        "schedule": timedelta(minutes=5),
+    },
+    "prune-tombstones": {
+        "task": "prune_tombstones",
+        "schedule": timedelta(days=1),
+    },
+}
 
 HOSPITAL_ADDRESS = "Ishaga Rd, Idi-Araba, Lagos 102215, Lagos"
+
+# Stale appointment sweeper, see appointments.tasks.sweep_stale_appointments
+APPOINTMENT_SWEEPER_BATCH_SIZE = 1000
+STALE_AVAILABILITY_RETENTION = timedelta(days=1)
+
+# Monthly partitions kept ready ahead of time once the appointment table is
+# partitioned, see appointments.partitioning
+APPOINTMENT_PARTITION_MONTHS_AHEAD = 3
+
+# How long before an appointment starts reminders are mailed
+APPOINTMENT_REMINDER_WINDOWS = [timedelta(hours=24), timedelta(hours=1)]
+APPOINTMENT_REMINDER_BATCH_SIZE = 1000
+
+# Device vital sign ingestion, see users.ingest
+VITALS_INGEST_CHUNK_SIZE = 5000
+VITALS_INGEST_USE_COPY = True
+VITALS_INGEST_MAX_REPORTED_ERRORS = 1000
+
+# Vital sign rollups, see users.rollups. Each run re-reads readings created
+# this long before the previous run to pick up late commits.
+VITALS_ROLLUP_OVERLAP = timedelta(minutes=10)
+VITALS_ROLLUP_CHUNK_SIZE = 5000
+
+# How long grouped patient cohort statistics are cached, see users.analytics
+COHORT_ANALYTICS_CACHE_TTL = 60 * 10
+
+# Changed professional days whose workload is recomputed per batch, see
+# appointments.workload
+WORKLOAD_REFRESH_BATCH_SIZE = 1000
+WORKLOAD_REPORT_MAX_DAYS = 366
+
+# Unfiltered admin changelists of tables with more rows than this are
+# counted from the planner's estimate, see users.utils.EstimatedCountPaginator
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Days ahead whose availability is edited inline on the medical professional
+# admin page, all other slots are paged in by its slot manager
+ADMIN_AVAILABILITY_INLINE_DAYS = 14
+ADMIN_AVAILABILITY_PAGE_SIZE = 50
+
+# Patient charts served to clinicians, see users.chart
+PATIENT_CHART_RECENT_VITALS = 20
+PATIENT_CHART_CACHE_TTL = 60 * 10
+
+# Lab result file imports, see appointments.lab_import
+LAB_IMPORT_CHUNK_SIZE = 2000
+LAB_IMPORT_MAX_REPORTED_ERRORS = 1000
+
+# Rows read per round trip by bulk exports, see appointments.bulk_export
+BULK_EXPORT_CHUNK_SIZE = 2000
+
+# Library encoding API responses and decoding JSON request bodies, "orjson",
+# "msgspec" or "json" for the standard library, which is also used when the
+# library is not installed, see users.renderers
+API_JSON_BACKEND = "orjson"
+
+# Responses of at least this many bytes are compressed, with brotli when it
+# is installed and gzip otherwise, see users.middleware
+COMPRESSION_MIN_LENGTH = 1024
+COMPRESSION_BROTLI_QUALITY = 5
+
+# Delta sync of lists with ?since=, see users.sync. Deleted rows are
+# remembered for TOMBSTONE_RETENTION, and each sync also returns the rows
+# changed in the DELTA_SYNC_OVERLAP before `since`.
+TOMBSTONE_RETENTION = timedelta(days=90)
+TOMBSTONE_PRUNE_BATCH_SIZE = 5000
+DELTA_SYNC_OVERLAP = timedelta(minutes=1)
@@ -1,9 +1,28 @@
+import json
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_GET, require_POST
 from users.models import User, Patient, MedicalProfessional
 from appointments.models import Availability
+from appointments.utils import coalesce_professional_availability
+from appointments.workload import mark_workload_of
+from users.search import TrigramSearchAdminMixin
+from users.utils import EstimatedCountPaginator
 
 
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(TrigramSearchAdminMixin, admin.ModelAdmin):
     list_display = (
         "email",
         "first_name",
@@ -16,19 +35,20 @@ class UserAdmin(admin.ModelAdmin):
         "email",
         "first_name",
         "last_name",
-        "gender",
     )
 
     list_filter = (
         "gender",
         "is_email_verified",
     )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     class Meta:
         model = User
 
 
-class PatientAdmin(admin.ModelAdmin):
+class PatientAdmin(TrigramSearchAdminMixin, admin.ModelAdmin):
     list_display = (
         "email",
         "blood_group",
@@ -43,11 +63,15 @@ class PatientAdmin(admin.ModelAdmin):
         "user__first_name",
         "user__last_name",
     )
+    trigram_user_fields = ("user",)
 
     list_filter = (
         "blood_group",
         "genotype",
     )
+    list_select_related = ("user",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def email(self, obj: Patient):
         return obj.user.email
@@ -57,10 +81,28 @@ class PatientAdmin(admin.ModelAdmin):
 
 
 class AvailabilityInline(admin.TabularInline):
+    """Only the slots of the next ADMIN_AVAILABILITY_INLINE_DAYS days, so the
+    change page stays the same size however long the schedule gets. All
+    other slots are listed by the slot manager below the inline."""
+
     model = Availability
+    extra = 0
+    ordering = ("start_time",)
 
+    def get_queryset(self, request):
+        now = timezone.now()
+        return (
+            super()
+            .get_queryset(request)
+            .filter(
+                end_time__gte=now,
+                start_time__lt=now
+                + timedelta(days=settings.ADMIN_AVAILABILITY_INLINE_DAYS),
+            )
+        )
 
-class MedicalProfessionalAdmin(admin.ModelAdmin):
+
+class MedicalProfessionalAdmin(TrigramSearchAdminMixin, admin.ModelAdmin):
     list_display = (
         "email",
         "medical_license_number",
@@ -73,11 +115,15 @@ class MedicalProfessionalAdmin(admin.ModelAdmin):
         "user__first_name",
         "user__last_name",
     )
+    trigram_user_fields = ("user",)
 
     list_filter = (
         "specialization",
         "department",
     )
+    list_select_related = ("user",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = [
         AvailabilityInline,
     ]
@@ -85,6 +131,147 @@ class MedicalProfessionalAdmin(admin.ModelAdmin):
     def email(self, obj: MedicalProfessional):
         return obj.user.email
 
+    def get_urls(self):
+        return [
+            path(
+                "<path:object_id>/availability/",
+                self.admin_site.admin_view(self.availability_view),
+                name="users_medicalprofessional_availability",
+            ),
+            path(
+                "<path:object_id>/availability/bulk/",
+                self.admin_site.admin_view(self.availability_bulk_view),
+                name="users_medicalprofessional_availability_bulk",
+            ),
+        ] + super().get_urls()
+
+    def _get_professional(self, request, object_id, change=False):
+        medical_professional = get_object_or_404(
+            MedicalProfessional, pk=object_id
+        )
+        has_permission = (
+            self.has_change_permission(request, medical_professional)
+            if change
+            else self.has_view_or_change_permission(
+                request, medical_professional
+            )
+        )
+        if not has_permission:
+            raise PermissionDenied
+        return medical_professional
+
+    @staticmethod
+    def _get_page_number(request) -> int:
+        try:
+            return max(int(request.GET.get("page", 1)), 1)
+        except ValueError:
+            return 1
+
+    @method_decorator(require_GET)
+    def availability_view(self, request, object_id):
+        """One page of a professional's slots as JSON, filtered by
+        `when` (upcoming, past or all) and `is_booked`."""
+        medical_professional = self._get_professional(request, object_id)
+        now = timezone.now()
+        when = request.GET.get("when", "upcoming")
+        slots = Availability.objects.filter(
+            medical_professional=medical_professional
+        )
+        if when == "upcoming":
+            slots = slots.filter(end_time__gte=now).order_by("start_time")
+        elif when == "past":
+            slots = slots.filter(end_time__lt=now).order_by("-start_time")
+        else:
+            slots = slots.order_by("-start_time")
+        if request.GET.get("is_booked") in ("0", "1"):
+            slots = slots.filter(is_booked=request.GET["is_booked"] == "1")
+
+        paginator = Paginator(
+            slots.values("id", "start_time", "end_time", "is_booked"),
+            settings.ADMIN_AVAILABILITY_PAGE_SIZE,
+        )
+        page = paginator.get_page(self._get_page_number(request))
+        return JsonResponse(
+            {
+                "count": paginator.count,
+                "page": page.number,
+                "num_pages": paginator.num_pages,
+                "results": list(page.object_list),
+            }
+        )
+
+    @method_decorator(require_POST)
+    def availability_bulk_view(self, request, object_id):
+        """Apply a bulk action to the selected free slots: `delete` them or
+        `shift` them by `minutes`. `merge` coalesces all of the
+        professional's free slots. Booked slots are left untouched, so a
+        shift onto one is refused, and shifted slots are merged with the
+        free slots they then overlap or touch."""
+        medical_professional = self._get_professional(
+            request, object_id, change=True
+        )
+        try:
+            data = json.loads(request.body)
+            action = data["action"]
+            ids = [uuid.UUID(str(slot_id)) for slot_id in data.get("ids", [])]
+            minutes = int(data.get("minutes", 0))
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({"detail": "Invalid request."}, status=400)
+
+        slots = Availability.objects.filter(
+            medical_professional=medical_professional,
+            is_booked=False,
+            id__in=ids,
+        )
+        if action == "delete":
+            updated, _ = slots.delete()
+        elif action == "shift":
+            if not minutes:
+                return JsonResponse(
+                    {"detail": "Minutes to shift by are required."},
+                    status=400,
+                )
+            shift = timedelta(minutes=minutes)
+            with transaction.atomic():
+                moved = list(
+                    slots.select_for_update().values_list(
+                        "start_time", "end_time"
+                    )
+                )
+                overlaps = Q()
+                for start_time, end_time in moved:
+                    overlaps |= Q(
+                        start_time__lt=end_time + shift,
+                        end_time__gt=start_time + shift,
+                    )
+                if (
+                    moved
+                    and Availability.objects.filter(
+                        overlaps,
+                        medical_professional=medical_professional,
+                        is_booked=True,
+                    ).exists()
+                ):
+                    return JsonResponse(
+                        {"detail": "Shifted slots would overlap a booking."},
+                        status=400,
+                    )
+                mark_workload_of(slots)
+                updated = slots.update(
+                    start_time=F("start_time") + shift,
+                    end_time=F("end_time") + shift,
+                    updated_at=timezone.now(),
+                )
+                mark_workload_of(slots)
+                coalesce_professional_availability(medical_professional.id)
+        elif action == "merge":
+            updated = coalesce_professional_availability(
+                medical_professional.id
+            )
+        else:
+            return JsonResponse({"detail": "Unknown action."}, status=400)
+        return JsonResponse({"updated": updated})
+
     class Meta:
         model = MedicalProfessional
 
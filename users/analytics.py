@@ -0,0 +1,237 @@
+"""
+Patient cohort analytics for staff dashboards.
+
+The cohort's columns are read with a single values_list query and every
+statistic is computed on whole NumPy arrays, grouped by integer codes,
+so no model instance is ever built. Results are cached for
+COHORT_ANALYTICS_CACHE_TTL seconds per set of filters.
+
+Smoking and alcohol prevalence are rates among the patients whose answer
+is known; those without one are counted apart.
+"""
+
+import hashlib
+import json
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from appointments.models import Appointment
+from users.choices import ALCOHOL_CONSUMPTION, SMOKING_STATUS
+from users.models import Patient
+
+COHORT_COLUMNS = (
+    "bmi",
+    "genotype",
+    "blood_group",
+    "smoking_status",
+    "alcohol_consumption",
+)
+GROUP_BY_COLUMNS = COHORT_COLUMNS[1:]
+# upper bounds of the WHO adult BMI categories
+BMI_CATEGORIES = ("underweight", "normal", "overweight", "obese")
+BMI_CATEGORY_BOUNDS = np.array([18.5, 25.0, 30.0])
+
+
+def get_cohort_queryset(
+    specialization=None, department=None, start=None, end=None
+):
+    """Patients, optionally only those with an appointment with a medical
+    professional of `specialization` or `department` starting between
+    `start` and `end`."""
+    patients = Patient.objects.all()
+    appointment_filters = {}
+    if specialization:
+        appointment_filters["medical_professional__specialization"] = (
+            specialization
+        )
+    if department:
+        appointment_filters["medical_professional__department__iexact"] = (
+            department
+        )
+    if start:
+        appointment_filters["start_time__gte"] = start
+    if end:
+        appointment_filters["start_time__lt"] = end
+    if appointment_filters:
+        # EXISTS keeps one row per patient however many appointments match
+        patients = patients.filter(
+            Exists(
+                Appointment.objects.filter(
+                    patient=OuterRef("pk"), **appointment_filters
+                )
+            )
+        )
+    return patients.order_by()
+
+
+def load_cohort(queryset) -> dict:
+    """The cohort's columns as NumPy arrays. Missing BMIs are NaN and
+    missing categories are empty strings."""
+    rows = list(queryset.values_list(*COHORT_COLUMNS))
+    if not rows:
+        return {
+            column: np.array([], dtype=float if column == "bmi" else str)
+            for column in COHORT_COLUMNS
+        }
+
+    bmi, *categories = zip(*rows)
+    cohort = {"bmi": np.array(bmi, dtype=float)}
+    for column, values in zip(GROUP_BY_COLUMNS, categories):
+        cohort[column] = np.array([value or "" for value in values], dtype=str)
+    return cohort
+
+
+def _group_codes(cohort: dict, group_by: list):
+    """Group keys and, for every patient, the index of its group."""
+    size = len(cohort["bmi"])
+    if not group_by:
+        return [()], np.zeros(size, dtype=np.intp)
+    keys = np.stack([cohort[column] for column in group_by], axis=1)
+    unique_keys, codes = np.unique(keys, axis=0, return_inverse=True)
+    return [tuple(key) for key in unique_keys.tolist()], codes.reshape(-1)
+
+
+def _bmi_stats(bmi, codes, group_count: int) -> dict:
+    known = ~np.isnan(bmi)
+    known_codes = codes[known]
+    known_bmi = bmi[known]
+
+    counts = np.bincount(known_codes, minlength=group_count)
+    sums = np.bincount(known_codes, weights=known_bmi, minlength=group_count)
+    squares = np.bincount(
+        known_codes, weights=known_bmi**2, minlength=group_count
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+        stds = np.sqrt(np.maximum(squares / counts - means**2, 0))
+
+    minimums = np.full(group_count, np.inf)
+    maximums = np.full(group_count, -np.inf)
+    np.minimum.at(minimums, known_codes, known_bmi)
+    np.maximum.at(maximums, known_codes, known_bmi)
+
+    # medians: sort by group then BMI, and pick the middle of every group
+    order = np.lexsort((known_bmi, known_codes))
+    sorted_bmi = known_bmi[order]
+    group_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    lower = group_starts + np.maximum(counts - 1, 0) // 2
+    upper = group_starts + counts // 2
+    medians = np.full(group_count, np.nan)
+    has_bmi = counts > 0
+    medians[has_bmi] = (
+        sorted_bmi[lower[has_bmi]] + sorted_bmi[upper[has_bmi]]
+    ) / 2
+
+    categories = np.digitize(known_bmi, BMI_CATEGORY_BOUNDS)
+    distribution = np.bincount(
+        known_codes * len(BMI_CATEGORIES) + categories,
+        minlength=group_count * len(BMI_CATEGORIES),
+    ).reshape(group_count, len(BMI_CATEGORIES))
+
+    return {
+        "counts": counts,
+        "means": means,
+        "stds": stds,
+        "minimums": minimums,
+        "maximums": maximums,
+        "medians": medians,
+        "distribution": distribution,
+    }
+
+
+def _answer_counts(answers, choices, codes, group_count: int):
+    """Per group, the patients who answered yes and those who gave any of
+    the `choices` at all."""
+    known = np.isin(answers, choices.values)
+    return (
+        np.bincount(
+            codes, weights=answers == choices.YES, minlength=group_count
+        ),
+        np.bincount(codes, weights=known, minlength=group_count),
+    )
+
+
+def _rate(numerators, denominators):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return numerators / denominators
+
+
+def _number(value, digits=2):
+    return None if not np.isfinite(value) else round(float(value), digits)
+
+
+def compute_cohort_stats(cohort: dict, group_by: list) -> list:
+    keys, codes = _group_codes(cohort, group_by)
+    group_count = len(keys) if len(codes) else 0
+    if not group_count:
+        return []
+
+    patients = np.bincount(codes, minlength=group_count)
+    smokers, smoking_known = _answer_counts(
+        cohort["smoking_status"], SMOKING_STATUS, codes, group_count
+    )
+    drinkers, alcohol_known = _answer_counts(
+        cohort["alcohol_consumption"],
+        ALCOHOL_CONSUMPTION,
+        codes,
+        group_count,
+    )
+    smoking_rates = _rate(smokers, smoking_known)
+    alcohol_rates = _rate(drinkers, alcohol_known)
+    bmi = _bmi_stats(cohort["bmi"], codes, group_count)
+
+    groups = []
+    for index, key in enumerate(keys):
+        groups.append(
+            {
+                "group": {
+                    column: value or None
+                    for column, value in zip(group_by, key)
+                },
+                "patients": int(patients[index]),
+                "smoking_prevalence": _number(smoking_rates[index], 4),
+                "smoking_status_unknown": int(
+                    patients[index] - smoking_known[index]
+                ),
+                "alcohol_prevalence": _number(alcohol_rates[index], 4),
+                "alcohol_consumption_unknown": int(
+                    patients[index] - alcohol_known[index]
+                ),
+                "bmi": {
+                    "count": int(bmi["counts"][index]),
+                    "mean": _number(bmi["means"][index]),
+                    "std": _number(bmi["stds"][index]),
+                    "min": _number(bmi["minimums"][index]),
+                    "median": _number(bmi["medians"][index]),
+                    "max": _number(bmi["maximums"][index]),
+                    "distribution": dict(
+                        zip(
+                            BMI_CATEGORIES,
+                            bmi["distribution"][index].tolist(),
+                        )
+                    ),
+                },
+            }
+        )
+    return groups
+
+
+def get_cohort_stats(group_by: list, **filters) -> dict:
+    """Grouped cohort statistics, served from the cache while fresh."""
+    params = json.dumps(
+        {"group_by": group_by, **filters}, sort_keys=True, default=str
+    )
+    cache_key = "cohort_stats_{}".format(
+        hashlib.md5(params.encode()).hexdigest()
+    )
+    stats = cache.get(cache_key)
+    if stats is None:
+        cohort = load_cohort(get_cohort_queryset(**filters))
+        stats = {
+            "patients": len(cohort["bmi"]),
+            "groups": compute_cohort_stats(cohort, group_by),
+        }
+        cache.set(cache_key, stats, settings.COHORT_ANALYTICS_CACHE_TTL)
+    return stats
@@ -0,0 +1,83 @@
+"""
+Patient chart for clinicians.
+
+A chart holds a patient's demographics, medical history, most recent vital
+signs, visit history with test results and uploads, and upcoming
+appointments. It is read with one query per relation, however long the
+patient's history, and the serialized chart is cached per patient. The
+signals in users.signals drop the cached chart whenever any of its records
+change.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.utils import timezone
+from appointments.choices import BOOKING_STATUS
+from appointments.models import Appointment, VisitHistory
+from users.models import Patient, VitalSigns
+
+UPCOMING_STATUSES = (BOOKING_STATUS.PENDING, BOOKING_STATUS.ACCEPTED)
+
+
+def get_chart_cache_key(patient_id) -> str:
+    # ids come in both as UUIDs and as hex strings
+    return f"patient_chart:{uuid.UUID(str(patient_id)).hex}"
+
+
+def invalidate_patient_chart(*patient_ids):
+    cache.delete_many([get_chart_cache_key(pk) for pk in patient_ids])
+
+
+def get_patient_chart_queryset():
+    return Patient.objects.select_related("user").prefetch_related(
+        "medical_history",
+        Prefetch(
+            "vital_signs",
+            queryset=VitalSigns.objects.filter(
+                recorded_at__isnull=False
+            ).order_by("-recorded_at")[
+                : settings.PATIENT_CHART_RECENT_VITALS
+            ],
+            to_attr="recent_vital_signs",
+        ),
+        Prefetch(
+            "visithistory_set",
+            queryset=VisitHistory.objects.select_related(
+                "medical_professional__user"
+            )
+            .prefetch_related("test_results", "uploads")
+            .order_by("-visit_date"),
+            to_attr="visit_histories",
+        ),
+        Prefetch(
+            "appointments",
+            queryset=Appointment.objects.filter(
+                status__in=UPCOMING_STATUSES, end_time__gte=timezone.now()
+            )
+            .select_related("medical_professional__user")
+            .order_by("start_time"),
+            to_attr="upcoming_appointments",
+        ),
+    )
+
+
+def get_patient_chart(patient_id):
+    """The serialized chart of a patient, or None if there is no such
+    patient."""
+    from users.serializers import PatientChartSerializer
+
+    try:
+        key = get_chart_cache_key(patient_id)
+    except ValueError:
+        return None
+    chart = cache.get(key)
+    if chart is None:
+        patient = get_patient_chart_queryset().filter(id=patient_id).first()
+        if not patient:
+            return None
+        chart = PatientChartSerializer(patient).data
+        cache.set(key, chart, settings.PATIENT_CHART_CACHE_TTL)
+    return chart
@@ -50,3 +50,9 @@ class BLOODGROUP(TextChoices):
     AB = "AB"
     O_POSITIVE = "O+"
     O_NEGATIVE = "O-"
+
+
+class ROLLUP_RESOLUTION(TextChoices):
+    HOUR = "hour"
+    DAY = "day"
+    MONTH = "month"
@@ -0,0 +1,176 @@
+"""
+    Bulk ingestion of device vital sign readings.
+
+    Rows are checked with plain Python instead of a serializer, grouped in
+    chunks, and each chunk is written with one COPY (PostgreSQL) or one bulk
+    insert. Invalid rows are reported back by position and never stop the
+    valid rows around them from being stored.
+"""
+
+import csv
+import io
+import math
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from users.chart import invalidate_patient_chart
+from users.models import Patient, VitalSigns
+from users.parsers import UndecodableLine
+
+INTEGER_MEASUREMENTS = {
+    "systolic_pressure",
+    "diastolic_pressure",
+    "heart_rate",
+    "respiratory_rate",
+}
+COPY_COLUMNS = ("id", "patient_id", "recorded_at") + VitalSigns.MEASUREMENTS
+
+
+class RowError(Exception):
+    pass
+
+
+def _clean_measurement(row: dict, measurement: str):
+    value = row.get(measurement)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise RowError({measurement: "A number is required."})
+    # the stdlib json module decodes NaN and Infinity
+    if not math.isfinite(value):
+        raise RowError({measurement: "A number is required."})
+    if measurement in INTEGER_MEASUREMENTS:
+        if value != int(value):
+            raise RowError({measurement: "A whole number is required."})
+        value = int(value)
+
+    low, high = VitalSigns.RANGES[measurement]
+    if not low <= value <= high:
+        raise RowError(
+            {measurement: "Must be between {} and {}.".format(low, high)}
+        )
+    return value
+
+
+def _clean_recorded_at(value):
+    if not isinstance(value, str):
+        raise RowError({"recorded_at": "An ISO 8601 datetime is required."})
+    try:
+        recorded_at = datetime.fromisoformat(value)
+    except ValueError:
+        raise RowError({"recorded_at": "An ISO 8601 datetime is required."})
+    if timezone.is_naive(recorded_at):
+        recorded_at = recorded_at.replace(tzinfo=dt_timezone.utc)
+    return recorded_at
+
+
+def clean_vital_signs_row(row, patient_id=None) -> dict:
+    """Check a raw reading and return the model fields for it. When
+    `patient_id` is given, it is used in place of the row's own."""
+    if isinstance(row, UndecodableLine):
+        raise RowError({"detail": str(row)})
+    if not isinstance(row, dict):
+        raise RowError({"detail": "Each reading must be an object."})
+
+    try:
+        patient_id = uuid.UUID(str(patient_id or row.get("patient_id")))
+    except ValueError:
+        raise RowError({"patient_id": "A valid patient id is required."})
+
+    cleaned = {
+        "patient_id": patient_id,
+        "recorded_at": _clean_recorded_at(row.get("recorded_at")),
+    }
+    for measurement in VitalSigns.MEASUREMENTS:
+        cleaned[measurement] = _clean_measurement(row, measurement)
+    if all(
+        cleaned[measurement] is None for measurement in VitalSigns.MEASUREMENTS
+    ):
+        raise RowError({"detail": "At least one reading is required."})
+    return cleaned
+
+
+def _copy_chunk(rows: list):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(
+            [uuid.uuid4().hex]
+            + [
+                "" if row[column] is None else row[column]
+                for column in COPY_COLUMNS[1:]
+            ]
+        )
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+                VitalSigns._meta.db_table, ", ".join(COPY_COLUMNS)
+            ),
+            buffer,
+        )
+
+
+def _write_chunk(chunk: list, errors: list) -> int:
+    """Store the readings of `chunk`, a list of (position, cleaned row)
+    pairs, whose patient exists. Returns the number stored."""
+    patient_ids = set(
+        Patient.objects.filter(
+            id__in={row["patient_id"] for _, row in chunk}
+        ).values_list("id", flat=True)
+    )
+    rows = []
+    for position, row in chunk:
+        if row["patient_id"] in patient_ids:
+            rows.append(row)
+        else:
+            errors.append(
+                {
+                    "row": position,
+                    "errors": {"patient_id": "No patient found for that id."},
+                }
+            )
+    if not rows:
+        return 0
+
+    with transaction.atomic():
+        if settings.VITALS_INGEST_USE_COPY and connection.vendor == (
+            "postgresql"
+        ):
+            _copy_chunk(rows)
+        else:
+            VitalSigns.objects.bulk_create(
+                [VitalSigns(**row) for row in rows]
+            )
+    # neither COPY nor bulk_create send signals
+    invalidate_patient_chart(*{row["patient_id"] for row in rows})
+    return len(rows)
+
+
+def ingest_vital_signs(rows, patient_id=None) -> dict:
+    """Store an iterable of raw readings a chunk at a time. Returns how many
+    were created and the position and errors of the rejected ones."""
+    chunk_size = settings.VITALS_INGEST_CHUNK_SIZE
+    created, errors, chunk = 0, [], []
+    position = -1
+    for position, row in enumerate(rows):
+        try:
+            chunk.append((position, clean_vital_signs_row(row, patient_id)))
+        except RowError as exc:
+            errors.append({"row": position, "errors": exc.args[0]})
+
+        if len(chunk) >= chunk_size:
+            created += _write_chunk(chunk, errors)
+            chunk = []
+    if chunk:
+        created += _write_chunk(chunk, errors)
+
+    return {
+        "received": position + 1,
+        "created": created,
+        "failed": len(errors),
+        "errors": errors[: settings.VITALS_INGEST_MAX_REPORTED_ERRORS],
+    }
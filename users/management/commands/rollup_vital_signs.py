@@ -0,0 +1,24 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the hourly, daily and monthly vital sign rollups from every "
+        "reading"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        from django.utils import timezone
+        from users.rollups import rollup_vital_signs, set_watermark
+
+        started_at = timezone.now()
+        recomputed = rollup_vital_signs(chunk_size=options["chunk_size"])
+        set_watermark(started_at)
+        logger.info("Rolled up {} hours of vital signs".format(recomputed))
@@ -0,0 +1,154 @@
+"""
+Negotiated response compression.
+
+Text responses of at least COMPRESSION_MIN_LENGTH bytes are compressed with
+brotli when it is installed and accepted by the client, and with gzip
+otherwise, whole or as they stream. Files that are already compressed,
+e.g. exports and uploads, are left alone. Strong ETags stay strong with
+the content coding added to them, see users.versions.
+"""
+
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence, compress_string
+from users.versions import ETAG_ENCODING_SUFFIXES, get_etag_tags
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_CONTENT_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "text/",
+)
+ACCEPT_ENCODING_QUALITY = re.compile(r";\s*q=([0-9.]+)")
+
+
+def get_accepted_encodings(header: str) -> dict:
+    """Quality of every content coding of an Accept-Encoding header."""
+    encodings = {}
+    for item in header.split(","):
+        coding, _, parameters = item.strip().partition(";")
+        if not coding:
+            continue
+        quality = ACCEPT_ENCODING_QUALITY.search(";" + parameters)
+        try:
+            encodings[coding.lower()] = (
+                float(quality.group(1)) if quality else 1.0
+            )
+        except ValueError:
+            continue
+    return encodings
+
+
+def choose_encoding(header: str):
+    accepted = get_accepted_encodings(header)
+    default = accepted.get("*", 0)
+    if brotli and accepted.get("br", default) > 0:
+        return "br"
+    if accepted.get("gzip", default) > 0:
+        return "gzip"
+    return None
+
+
+def get_revalidated_encoding(request, etag):
+    """Content coding of the body the client revalidates `etag` for, as
+    told by the tag it sent back."""
+    if not etag or not etag.startswith('"'):
+        return None
+    tags = get_etag_tags(request)
+    for suffix in ETAG_ENCODING_SUFFIXES:
+        if '{}{}"'.format(etag[:-1], suffix) in tags:
+            return suffix[1:]
+    return None
+
+
+def compress_brotli_sequence(sequence):
+    compressor = brotli.Compressor(
+        mode=brotli.MODE_TEXT, quality=settings.COMPRESSION_BROTLI_QUALITY
+    )
+    for item in sequence:
+        data = compressor.process(item)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """GZipMiddleware with brotli, a size threshold and strong ETags."""
+
+    # as GZipMiddleware, against BREACH
+    max_random_bytes = 100
+
+    def process_response(self, request, response):
+        if response.status_code == 304:
+            # tagged as the body the client holds, which is unencoded when
+            # it was too small to compress
+            encoding = get_revalidated_encoding(request, response.get("ETag"))
+            if encoding:
+                self.add_etag_encoding(response, encoding)
+            return response
+        if response.has_header("Content-Encoding") or not response.get(
+            "Content-Type", ""
+        ).startswith(COMPRESSIBLE_CONTENT_TYPES):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        if "no-transform" in response.get("Cache-Control", ""):
+            return response
+        if (
+            not response.streaming
+            and len(response.content) < settings.COMPRESSION_MIN_LENGTH
+        ):
+            return response
+
+        encoding = choose_encoding(
+            request.META.get("HTTP_ACCEPT_ENCODING", "")
+        )
+        if not encoding:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                return response
+            response.streaming_content = (
+                compress_brotli_sequence(response.streaming_content)
+                if encoding == "br"
+                else compress_sequence(
+                    response.streaming_content,
+                    max_random_bytes=self.max_random_bytes,
+                )
+            )
+            del response.headers["Content-Length"]
+        else:
+            compressed_content = (
+                brotli.compress(
+                    response.content,
+                    mode=brotli.MODE_TEXT,
+                    quality=settings.COMPRESSION_BROTLI_QUALITY,
+                )
+                if encoding == "br"
+                else compress_string(
+                    response.content, max_random_bytes=self.max_random_bytes
+                )
+            )
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response.headers["Content-Length"] = str(len(response.content))
+
+        self.add_etag_encoding(response, encoding)
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    def add_etag_encoding(self, response, encoding: str):
+        # each coding of a body is a different representation
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = '{}-{}"'.format(etag[:-1], encoding)
@@ -0,0 +1,167 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:33
+
+import re
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+BATCH_SIZE = 1000
+# VitalSigns.RANGES as of this migration, readings outside them (typos like
+# "72000", temperatures in fahrenheit) are dropped
+RANGES = {
+    "systolic_pressure": (40, 300),
+    "diastolic_pressure": (20, 200),
+    "heart_rate": (20, 300),
+    "temperature": (25, 45),
+    "respiratory_rate": (4, 80),
+}
+PARSED_FIELDS = list(RANGES)
+
+
+def to_number(value, field):
+    number = (float if field == "temperature" else int)(float(value))
+    low, high = RANGES[field]
+    return number if low <= number <= high else None
+
+
+def parse_number(value, field):
+    match = NUMBER_RE.search(value or "")
+    return to_number(match.group(), field) if match else None
+
+
+def parse_readings(apps, schema_editor):
+    VitalSigns = apps.get_model("users", "VitalSigns")
+    readings = VitalSigns.objects.order_by("pk").iterator(
+        chunk_size=BATCH_SIZE
+    )
+    batch = []
+    for reading in readings:
+        pressures = NUMBER_RE.findall(reading.blood_pressure or "")
+        if len(pressures) == 2:
+            reading.systolic_pressure = to_number(
+                pressures[0], "systolic_pressure"
+            )
+            reading.diastolic_pressure = to_number(
+                pressures[1], "diastolic_pressure"
+            )
+        reading.heart_rate = parse_number(
+            reading.heart_rate_text, "heart_rate"
+        )
+        reading.temperature = parse_number(
+            reading.temperature_text, "temperature"
+        )
+        reading.respiratory_rate = parse_number(
+            reading.respiratory_rate_text, "respiratory_rate"
+        )
+        batch.append(reading)
+        if len(batch) == BATCH_SIZE:
+            VitalSigns.objects.bulk_update(batch, PARSED_FIELDS)
+            batch = []
+    if batch:
+        VitalSigns.objects.bulk_update(batch, PARSED_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0015_remove_testresult_patient_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="vitalsigns",
+            options={
+                "ordering": ["-recorded_at"],
+                "verbose_name_plural": "Vital signs",
+            },
+        ),
+        migrations.RenameField(
+            model_name="vitalsigns",
+            old_name="heart_rate",
+            new_name="heart_rate_text",
+        ),
+        migrations.RenameField(
+            model_name="vitalsigns",
+            old_name="temperature",
+            new_name="temperature_text",
+        ),
+        migrations.RenameField(
+            model_name="vitalsigns",
+            old_name="respiratory_rate",
+            new_name="respiratory_rate_text",
+        ),
+        # the text readings were never timestamped, so they keep no
+        # recorded_at rather than the time of this migration
+        migrations.AddField(
+            model_name="vitalsigns",
+            name="recorded_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name="vitalsigns",
+            name="systolic_pressure",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="vitalsigns",
+            name="diastolic_pressure",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="vitalsigns",
+            name="heart_rate",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="vitalsigns",
+            name="temperature",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="vitalsigns",
+            name="respiratory_rate",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(parse_readings, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="vitalsigns",
+            name="recorded_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, null=True
+            ),
+        ),
+        migrations.RemoveField(
+            model_name="vitalsigns",
+            name="blood_pressure",
+        ),
+        migrations.RemoveField(
+            model_name="vitalsigns",
+            name="heart_rate_text",
+        ),
+        migrations.RemoveField(
+            model_name="vitalsigns",
+            name="temperature_text",
+        ),
+        migrations.RemoveField(
+            model_name="vitalsigns",
+            name="respiratory_rate_text",
+        ),
+        migrations.AlterField(
+            model_name="vitalsigns",
+            name="patient",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="vital_signs",
+                to="users.patient",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="vitalsigns",
+            index=models.Index(
+                fields=["patient", "recorded_at"],
+                name="users_vital_patient_3f3f04_idx",
+            ),
+        ),
+    ]
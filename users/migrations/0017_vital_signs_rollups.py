@@ -0,0 +1,107 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:37
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+import django.db.models.functions.datetime
+import django.utils.timezone
+import users.utils
+from django.db import migrations, models
+
+
+def seed_anthropometrics(apps, schema_editor):
+    Patient = apps.get_model("users", "Patient")
+    AnthropometricRecord = apps.get_model("users", "AnthropometricRecord")
+    AnthropometricRecord.objects.bulk_create(
+        [
+            AnthropometricRecord(
+                patient_id=patient_id, height=height, weight=weight, bmi=bmi
+            )
+            for patient_id, height, weight, bmi in Patient.objects.exclude(
+                height=None, weight=None
+            ).values_list("id", "height", "weight", "bmi")
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_vitalsigns_numeric_readings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnthropometricRecord',
+            fields=[
+                ('id', models.UUIDField(default=users.utils.get_uuid, editable=False, primary_key=True, serialize=False)),
+                ('height', models.FloatField(blank=True, null=True)),
+                ('weight', models.FloatField(blank=True, null=True)),
+                ('bmi', models.FloatField(blank=True, null=True)),
+                ('recorded_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-recorded_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='VitalSignsRollup',
+            fields=[
+                ('id', models.UUIDField(default=users.utils.get_uuid, editable=False, primary_key=True, serialize=False)),
+                ('resolution', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('month', 'Month')], max_length=5)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('systolic_pressure_min', models.FloatField(blank=True, null=True)),
+                ('systolic_pressure_max', models.FloatField(blank=True, null=True)),
+                ('systolic_pressure_sum', models.FloatField(blank=True, null=True)),
+                ('systolic_pressure_count', models.PositiveIntegerField(default=0)),
+                ('diastolic_pressure_min', models.FloatField(blank=True, null=True)),
+                ('diastolic_pressure_max', models.FloatField(blank=True, null=True)),
+                ('diastolic_pressure_sum', models.FloatField(blank=True, null=True)),
+                ('diastolic_pressure_count', models.PositiveIntegerField(default=0)),
+                ('heart_rate_min', models.FloatField(blank=True, null=True)),
+                ('heart_rate_max', models.FloatField(blank=True, null=True)),
+                ('heart_rate_sum', models.FloatField(blank=True, null=True)),
+                ('heart_rate_count', models.PositiveIntegerField(default=0)),
+                ('temperature_min', models.FloatField(blank=True, null=True)),
+                ('temperature_max', models.FloatField(blank=True, null=True)),
+                ('temperature_sum', models.FloatField(blank=True, null=True)),
+                ('temperature_count', models.PositiveIntegerField(default=0)),
+                ('respiratory_rate_min', models.FloatField(blank=True, null=True)),
+                ('respiratory_rate_max', models.FloatField(blank=True, null=True)),
+                ('respiratory_rate_sum', models.FloatField(blank=True, null=True)),
+                ('respiratory_rate_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+            },
+        ),
+        migrations.AddField(
+            model_name='vitalsigns',
+            name='created_at',
+            field=models.DateTimeField(db_default=django.db.models.functions.datetime.Now()),
+        ),
+        migrations.AddIndex(
+            model_name='vitalsigns',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['created_at'], name='users_vital_created_brin'),
+        ),
+        migrations.AddField(
+            model_name='anthropometricrecord',
+            name='patient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anthropometrics', to='users.patient'),
+        ),
+        migrations.AddField(
+            model_name='vitalsignsrollup',
+            name='patient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vital_signs_rollups', to='users.patient'),
+        ),
+        migrations.AddIndex(
+            model_name='anthropometricrecord',
+            index=models.Index(fields=['patient', 'recorded_at'], name='users_anthr_patient_9e91cb_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='vitalsignsrollup',
+            constraint=models.UniqueConstraint(fields=('patient', 'resolution', 'bucket_start'), name='unique_vital_signs_rollup_bucket'),
+        ),
+        migrations.RunPython(seed_anthropometrics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:43
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+CREATE_TRIGGER_SQL = """
+CREATE FUNCTION users_medicalhistory_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.medical_conditions, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.medications, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_medicalhistory_search_vector_update
+BEFORE INSERT OR UPDATE OF medical_conditions, medications
+ON users_medicalhistory FOR EACH ROW EXECUTE FUNCTION users_medicalhistory_search_vector_update();
+
+UPDATE users_medicalhistory SET medical_conditions = medical_conditions;
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS users_medicalhistory_search_vector_update ON users_medicalhistory;
+DROP FUNCTION IF EXISTS users_medicalhistory_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_vital_signs_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicalhistory',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER_SQL, DROP_TRIGGER_SQL),
+        migrations.AddIndex(
+            model_name='medicalhistory',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='medicalhistory_search_gin'),
+        ),
+    ]
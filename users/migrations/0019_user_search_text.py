@@ -0,0 +1,50 @@
+# Generated by Django 5.0.3 on 2026-10-19 11:46
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+CREATE_TRIGGER_SQL = """
+CREATE FUNCTION users_user_search_text_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_text := lower(
+        concat_ws(' ', NEW.email, NEW.first_name, NEW.last_name)
+    );
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_user_search_text_update
+BEFORE INSERT OR UPDATE OF email, first_name, last_name, search_text
+ON users_user FOR EACH ROW EXECUTE FUNCTION users_user_search_text_update();
+
+UPDATE users_user SET email = email;
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS users_user_search_text_update ON users_user;
+DROP FUNCTION IF EXISTS users_user_search_text_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0018_medicalhistory_search_vector'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='user',
+            name='search_text',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER_SQL, DROP_TRIGGER_SQL),
+        migrations.AddIndex(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_text'], name='user_search_text_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.3 on 2026-10-19 12:00
+
+import django.db.models.deletion
+import users.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0019_user_search_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientRecordExport',
+            fields=[
+                ('id', models.UUIDField(default=users.utils.get_uuid, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Running', 'Running'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Pending', max_length=10)),
+                ('file', models.FileField(blank=True, max_length=500, upload_to=users.utils.record_export_file_name)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='record_exports', to='users.patient')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -7,14 +7,18 @@ from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.cache import cache
 from django.core.validators import RegexValidator
+from django.contrib.postgres.indexes import BrinIndex, GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Now
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from phonenumber_field.modelfields import PhoneNumberField  # type: ignore
 from users.tasks import (
     send_account_verification_mail,
     send_forgot_password_mail,
 )
-from users.utils import get_uuid
+from users.utils import get_uuid, record_export_file_name
 from users.choices import (
     SPECIALIZATION_CHOICES,
     GENDER_CHOICES,
@@ -23,7 +27,9 @@ from users.choices import (
     PREFERRED_LANGUAGE,
     GENOTYPES,
     BLOODGROUP,
+    ROLLUP_RESOLUTION,
 )
+from appointments.choices import EXPORT_STATUS
 
 
 class User(AbstractUser):
@@ -58,10 +64,22 @@ class User(AbstractUser):
     is_phone_number_verified = models.BooleanField(
         _("phone number verified"), default=False
     )
+    # lower cased email and names, kept up to date by a database trigger and
+    # trigram indexed for admin and staff search, see users.search
+    search_text = models.TextField(default="", editable=False)
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            GinIndex(
+                fields=["search_text"],
+                opclasses=["gin_trgm_ops"],
+                name="user_search_text_trgm",
+            ),
+        ]
+
     objects = UserManager()
 
     @property
@@ -121,6 +139,8 @@ class Patient(models.Model):
     preferred_language = models.CharField(
         max_length=20, choices=PREFERRED_LANGUAGE.choices, default="English"
     )
+    # also moved by changes to the user and medical history, see users.sync
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self) -> str:
         return f"Patient <> {self.user.username}"
@@ -138,19 +158,164 @@ class MedicalHistory(models.Model):
     immunization_history = models.TextField(null=True, blank=True)
     family_medical_history = models.TextField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # kept up to date by a database trigger, see appointments.search
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            GinIndex(
+                fields=["search_vector"], name="medicalhistory_search_gin"
+            ),
+        ]
 
 
 # Define model for Vital Signs
 class VitalSigns(models.Model):
+    # numeric readings, in the units noted against each field
+    MEASUREMENTS = (
+        "systolic_pressure",
+        "diastolic_pressure",
+        "heart_rate",
+        "temperature",
+        "respiratory_rate",
+    )
+    # plausible (min, max) of each reading, anything outside is rejected
+    RANGES = {
+        "systolic_pressure": (40, 300),
+        "diastolic_pressure": (20, 200),
+        "heart_rate": (20, 300),
+        "temperature": (25, 45),
+        "respiratory_rate": (4, 80),
+    }
+
     id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
-    patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
-    blood_pressure = models.CharField(max_length=20, null=True, blank=True)
-    heart_rate = models.CharField(max_length=20, null=True, blank=True)
-    temperature = models.CharField(max_length=20, null=True, blank=True)
-    respiratory_rate = models.CharField(max_length=20, null=True, blank=True)
+    patient = models.ForeignKey(
+        Patient, on_delete=models.CASCADE, related_name="vital_signs"
+    )
+    # null for the untimestamped readings kept by migration 0016, which are
+    # left out of the histories, summaries and rollups
+    recorded_at = models.DateTimeField(default=timezone.now, null=True)
+    # mmHg
+    systolic_pressure = models.PositiveSmallIntegerField(null=True, blank=True)
+    diastolic_pressure = models.PositiveSmallIntegerField(
+        null=True, blank=True
+    )
+    # beats per minute
+    heart_rate = models.PositiveSmallIntegerField(null=True, blank=True)
+    # degrees celsius
+    temperature = models.FloatField(null=True, blank=True)
+    # breaths per minute
+    respiratory_rate = models.PositiveSmallIntegerField(null=True, blank=True)
+    # set by the database so COPY ingestion gets it too, rollups pick up new
+    # readings by it
+    created_at = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        verbose_name_plural = "Vital signs"
+        ordering = ["-recorded_at"]
+        indexes = [
+            models.Index(fields=["patient", "recorded_at"]),
+            BrinIndex(fields=["created_at"], name="users_vital_created_brin"),
+        ]
+
+
+class VitalSignsRollup(models.Model):
+    """Pre-aggregated readings of a patient per hour, day or month. Sums and
+    counts are kept instead of averages so buckets can be rolled up
+    further."""
+
+    id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
+    patient = models.ForeignKey(
+        Patient, on_delete=models.CASCADE, related_name="vital_signs_rollups"
+    )
+    resolution = models.CharField(
+        max_length=5, choices=ROLLUP_RESOLUTION.choices
+    )
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    systolic_pressure_min = models.FloatField(null=True, blank=True)
+    systolic_pressure_max = models.FloatField(null=True, blank=True)
+    systolic_pressure_sum = models.FloatField(null=True, blank=True)
+    systolic_pressure_count = models.PositiveIntegerField(default=0)
+    diastolic_pressure_min = models.FloatField(null=True, blank=True)
+    diastolic_pressure_max = models.FloatField(null=True, blank=True)
+    diastolic_pressure_sum = models.FloatField(null=True, blank=True)
+    diastolic_pressure_count = models.PositiveIntegerField(default=0)
+    heart_rate_min = models.FloatField(null=True, blank=True)
+    heart_rate_max = models.FloatField(null=True, blank=True)
+    heart_rate_sum = models.FloatField(null=True, blank=True)
+    heart_rate_count = models.PositiveIntegerField(default=0)
+    temperature_min = models.FloatField(null=True, blank=True)
+    temperature_max = models.FloatField(null=True, blank=True)
+    temperature_sum = models.FloatField(null=True, blank=True)
+    temperature_count = models.PositiveIntegerField(default=0)
+    respiratory_rate_min = models.FloatField(null=True, blank=True)
+    respiratory_rate_max = models.FloatField(null=True, blank=True)
+    respiratory_rate_sum = models.FloatField(null=True, blank=True)
+    respiratory_rate_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["bucket_start"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["patient", "resolution", "bucket_start"],
+                name="unique_vital_signs_rollup_bucket",
+            )
+        ]
+
+
+class Watermark(models.Model):
+    """How far a recurring job has got, e.g. the start of the last vital
+    signs rollup, see users.rollups. Kept in the database so it outlives
+    cache flushes and evictions."""
+
+    id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
+    name = models.CharField(max_length=100, unique=True)
+    value = models.DateTimeField()
+
+
+# Define model for height, weight and BMI history
+class AnthropometricRecord(models.Model):
+    id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
+    patient = models.ForeignKey(
+        Patient, on_delete=models.CASCADE, related_name="anthropometrics"
+    )
+    height = models.FloatField(null=True, blank=True)
+    weight = models.FloatField(null=True, blank=True)
+    bmi = models.FloatField(null=True, blank=True)
+    recorded_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["-recorded_at"]
+        indexes = [
+            models.Index(fields=["patient", "recorded_at"]),
+        ]
+
+
+class PatientRecordExport(models.Model):
+    """A downloadable zip of everything recorded about a patient, built by a
+    Celery task, see users.record_export."""
+
+    id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
+    patient = models.ForeignKey(
+        Patient, on_delete=models.CASCADE, related_name="record_exports"
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=EXPORT_STATUS.choices,
+        default=EXPORT_STATUS.PENDING,
+    )
+    file = models.FileField(
+        upload_to=record_export_file_name, max_length=500, blank=True
+    )
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
 
 
 """
@@ -178,3 +343,41 @@ class MedicalProfessional(models.Model):
 
     # Clinical Practice Information
     department = models.CharField(max_length=100, null=True, blank=True)
+    # also moved by changes to the user, see users.sync
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+
+class Tombstone(models.Model):
+    """A deleted row, kept for TOMBSTONE_RETENTION so clients syncing a list
+    with ?since= learn it is gone, see users.sync."""
+
+    id = models.UUIDField(primary_key=True, default=get_uuid, editable=False)
+    # label of the model of the row, e.g. appointments.appointment
+    model = models.CharField(max_length=100)
+    object_id = models.UUIDField()
+    # whose lists the row was in; no constraints as they may be deleted
+    # along with it
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.DO_NOTHING,
+        null=True,
+        db_constraint=False,
+        related_name="+",
+    )
+    medical_professional = models.ForeignKey(
+        MedicalProfessional,
+        on_delete=models.DO_NOTHING,
+        null=True,
+        db_constraint=False,
+        related_name="+",
+    )
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ["deleted_at"]
+        indexes = [
+            models.Index(fields=["model", "patient", "deleted_at"]),
+            models.Index(
+                fields=["model", "medical_professional", "deleted_at"]
+            ),
+        ]
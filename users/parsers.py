@@ -0,0 +1,66 @@
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from users.renderers import BACKEND_JSON, get_json_backend, loads
+
+
+class UndecodableLine:
+    """Stands in for a line of NDJSON that is not valid JSON, so the rows
+    around it can still be used."""
+
+    def __init__(self, line_number: int, error: str):
+        self.line_number = line_number
+        self.error = error
+
+    def __str__(self):
+        return "NDJSON parse error on line {}: {}".format(
+            self.line_number, self.error
+        )
+
+
+class NDJSONParser(BaseParser):
+    """Parses newline delimited JSON lazily, one object per line, so large
+    uploads are never held in memory as a whole. A line that cannot be
+    decoded is given as an UndecodableLine instead of failing the whole
+    body, part of which may already have been used."""
+
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if stream is None:
+            return iter(())
+        return self._iter_rows(stream, encoding)
+
+    def _iter_rows(self, stream, encoding):
+        backend = get_json_backend(encoding)
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                if backend == BACKEND_JSON:
+                    yield json.loads(line.decode(encoding))
+                else:
+                    yield loads(line, backend)
+            except ValueError as exc:
+                yield UndecodableLine(line_number, str(exc))
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser decoding with API_JSON_BACKEND, see users.renderers."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        backend = get_json_backend(encoding)
+        if backend == BACKEND_JSON:
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return loads(stream.read(), backend)
+        except ValueError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
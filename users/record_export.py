@@ -0,0 +1,129 @@
+"""
+Patient self-service download of their health record.
+
+A download is requested over the API and built by a Celery task into a zip
+holding one JSON file per resource type of appointments.bulk_export and
+the files uploaded to the patient's visits. Rows are read from a
+server-side cursor a chunk at a time and written straight to the zip
+entry, and uploads are copied from storage into the zip a block at a time,
+so neither the record nor any attachment is ever held in memory.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from appointments.bulk_export import RESOURCES, get_resource_values
+from appointments.choices import EXPORT_STATUS
+from appointments.models import MedicalUpload
+from users.models import PatientRecordExport
+
+logger = logging.getLogger(__name__)
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def write_json_array(archive: zipfile.ZipFile, name: str, rows) -> int:
+    """Write `rows` to the `name` entry of `archive` as a JSON array.
+    Returns the number of rows written."""
+    count = 0
+    with archive.open(name, "w", force_zip64=True) as entry:
+        entry.write(b"[")
+        for row in rows:
+            if count:
+                entry.write(b",\n")
+            entry.write(json.dumps(row, cls=DjangoJSONEncoder).encode())
+            count += 1
+        entry.write(b"]")
+    return count
+
+
+def write_attachments(archive: zipfile.ZipFile, patient_id) -> list:
+    """Copy the files uploaded to the visits of a patient into
+    `attachments/<visit id>/` of `archive`. Returns the entries written."""
+    attachments = []
+    uploads = (
+        MedicalUpload.objects.filter(visit_history__patient_id=patient_id)
+        .order_by()
+        .values_list("visit_history_id", "upload")
+    )
+    storage = MedicalUpload._meta.get_field("upload").storage
+    for visit_history_id, file_name in uploads.iterator(
+        chunk_size=settings.BULK_EXPORT_CHUNK_SIZE
+    ):
+        name = "attachments/{}/{}".format(
+            visit_history_id, os.path.basename(file_name)
+        )
+        try:
+            with storage.open(file_name, "rb") as source, archive.open(
+                name, "w", force_zip64=True
+            ) as entry:
+                shutil.copyfileobj(source, entry, COPY_BUFFER_SIZE)
+        except FileNotFoundError:
+            logger.warning("Medical upload {} is missing".format(file_name))
+            continue
+        attachments.append(name)
+    return attachments
+
+
+def write_patient_record(archive: zipfile.ZipFile, patient_id):
+    manifest = {"patient_id": patient_id, "resources": [], "attachments": []}
+    for resource_type in RESOURCES:
+        if resource_type == "Patient":
+            values = get_resource_values(resource_type, id=patient_id)
+        else:
+            values = get_resource_values(resource_type, patient_id=patient_id)
+        name = "record/{}.json".format(resource_type)
+        count = write_json_array(
+            archive,
+            name,
+            values.iterator(chunk_size=settings.BULK_EXPORT_CHUNK_SIZE),
+        )
+        manifest["resources"].append(
+            {"type": resource_type, "file": name, "count": count}
+        )
+    manifest["attachments"] = write_attachments(archive, patient_id)
+    manifest["generated_at"] = timezone.now()
+    archive.writestr(
+        "manifest.json",
+        json.dumps(manifest, cls=DjangoJSONEncoder, indent=2),
+    )
+
+
+def build_patient_record(export_id) -> PatientRecordExport:
+    record_export = PatientRecordExport.objects.select_related(
+        "patient__user"
+    ).get(id=export_id)
+    record_export.status = EXPORT_STATUS.RUNNING
+    record_export.save(update_fields=["status"])
+
+    try:
+        with tempfile.TemporaryFile() as raw:
+            with zipfile.ZipFile(
+                raw, "w", compression=zipfile.ZIP_DEFLATED
+            ) as archive:
+                write_patient_record(archive, record_export.patient_id)
+            raw.seek(0)
+            record_export.file.save(
+                "health-record-{}.zip".format(timezone.now().date()),
+                File(raw),
+                save=False,
+            )
+    except Exception as exc:
+        logger.exception("Patient record export {} failed".format(export_id))
+        record_export.status = EXPORT_STATUS.FAILED
+        record_export.error = str(exc)
+    else:
+        record_export.status = EXPORT_STATUS.COMPLETED
+    record_export.completed_at = timezone.now()
+    record_export.save(
+        update_fields=["status", "file", "error", "completed_at"]
+    )
+    return record_export
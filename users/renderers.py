@@ -0,0 +1,100 @@
+"""
+Fast JSON encoding and decoding for the REST API.
+
+API_JSON_BACKEND picks orjson or msgspec to encode responses and decode
+request bodies, with DRF's stdlib `json` renderer and parser used when it is
+"json" or the library is not installed. Both libraries encode strings,
+numbers, UUIDs, dates and times, lists and dicts in C, and values they do
+not know, e.g. lazy translations, go through DRF's own encoder.
+
+The output matches the stdlib renderer for what the serializers produce,
+but not for every value. Floats are written without a plus sign in the
+exponent (1e16 rather than 1e+16), and NaN and infinities become null
+where the stdlib renderer refuses them. msgspec also writes Decimals with
+all their digits and timedeltas as ISO 8601 durations, which the
+serializers already turn into strings anyway. orjson cannot encode
+integers wider than 64 bits, so data holding one is rendered by the
+stdlib.
+"""
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+BACKEND_JSON = "json"
+BACKEND_ORJSON = "orjson"
+BACKEND_MSGSPEC = "msgspec"
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z if orjson else 0
+# encodes everything the stdlib renderer does
+encode_default = JSONEncoder().default
+msgspec_encoder = (
+    msgspec.json.Encoder(enc_hook=encode_default, decimal_format="number")
+    if msgspec
+    else None
+)
+msgspec_decoder = msgspec.json.Decoder() if msgspec else None
+
+
+def get_json_backend(encoding="utf-8") -> str:
+    """API_JSON_BACKEND if it is installed and can read `encoding`."""
+    backend = settings.API_JSON_BACKEND
+    if (
+        (backend == BACKEND_ORJSON and orjson is None)
+        or (backend == BACKEND_MSGSPEC and msgspec is None)
+        # both libraries only read UTF-8
+        or encoding.lower().replace("-", "") != "utf8"
+    ):
+        return BACKEND_JSON
+    return backend
+
+
+def dumps(data, backend: str) -> bytes:
+    if backend == BACKEND_ORJSON:
+        return orjson.dumps(
+            data, default=encode_default, option=ORJSON_OPTIONS
+        )
+    return msgspec_encoder.encode(data)
+
+
+def loads(data: bytes, backend: str):
+    if backend == BACKEND_ORJSON:
+        return orjson.loads(data)
+    return msgspec_decoder.decode(data)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer encoding with API_JSON_BACKEND. Indented output, asked
+    for with an `indent` media type parameter, is left to the stdlib."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        backend = get_json_backend()
+        if (
+            data is None
+            or backend == BACKEND_JSON
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = dumps(data, backend)
+        except TypeError:
+            # e.g. integers orjson cannot encode, the stdlib encoder raises
+            # the same error for values it does not know either
+            return super().render(data, accepted_media_type, renderer_context)
+        # escaped by the stdlib renderer as they end lines in javascript
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+                b"\xe2\x80\xa9", b"\\u2029"
+            )
+        return ret
@@ -0,0 +1,221 @@
+"""
+Fast read path of the busiest list endpoints.
+
+Rows are read with .values() and turned into the same dicts the DRF
+serializers give for them by plain functions, one per model, so no model
+instance or serializer field is built per row. Patients and medical
+professionals referred to by a page are read once each however many rows
+refer to them, with one more query for the medical histories of the
+patients. The serializers stay in use for writes and single objects, and
+the tests check both give the same JSON.
+"""
+
+from collections import defaultdict
+
+from rest_framework import serializers
+from rest_framework.response import Response
+from users.models import MedicalHistory, MedicalProfessional, Patient, User
+
+# in the order of the serializer fields
+USER_FIELDS = (
+    "id",
+    "first_name",
+    "last_name",
+    "avatar",
+    "gender",
+    "date_of_birth",
+    "phone_number",
+    "address_1",
+    "address_2",
+    "state",
+    "country",
+    "email",
+    "is_email_verified",
+    "is_phone_number_verified",
+    "is_staff",
+    "date_joined",
+)
+PATIENT_FIELDS = (
+    "id",
+    "allergies",
+    "blood_group",
+    "genotype",
+    "smoking_status",
+    "alcohol_consumption",
+    "height",
+    "weight",
+    "bmi",
+    "emergency_contact",
+    "preferred_pharmacy",
+    "preferred_language",
+)
+MEDICAL_PROFESSIONAL_FIELDS = (
+    "id",
+    "medical_license_number",
+    "specialization",
+    "education_and_qualifications",
+    "work_history",
+    "certifications",
+    "department",
+)
+MEDICAL_HISTORY_FIELDS = (
+    "id",
+    "patient",
+    "medical_conditions",
+    "allergies",
+    "medications",
+    "immunization_history",
+    "family_medical_history",
+    "created_at",
+)
+
+# formats dates and datetimes as the serializers are set up to
+DATETIME_FIELD = serializers.DateTimeField()
+DATE_FIELD = serializers.DateField()
+AVATAR_STORAGE = User._meta.get_field("avatar").storage
+
+
+def format_datetime(value):
+    return None if value is None else DATETIME_FIELD.to_representation(value)
+
+
+def format_date(value):
+    return None if value is None else DATE_FIELD.to_representation(value)
+
+
+def get_user_values(prefix: str = "") -> list:
+    return [prefix + field for field in USER_FIELDS] + [
+        prefix + "medicalprofessional__id"
+    ]
+
+
+def represent_user(row: dict, request=None, prefix: str = "") -> dict:
+    """UserBaseSerializer of the user read with get_user_values(prefix)."""
+    avatar = row[prefix + "avatar"]
+    if avatar:
+        avatar = AVATAR_STORAGE.url(avatar)
+        if request is not None:
+            avatar = request.build_absolute_uri(avatar)
+    phone_number = row[prefix + "phone_number"]
+    first_name, last_name = (
+        row[prefix + "first_name"],
+        row[prefix + "last_name"],
+    )
+    address_1, address_2 = row[prefix + "address_1"], row[prefix + "address_2"]
+    state, country = row[prefix + "state"], row[prefix + "country"]
+    is_staff = row[prefix + "is_staff"]
+    return {
+        "id": str(row[prefix + "id"]),
+        "first_name": first_name,
+        "last_name": last_name,
+        "avatar": avatar or None,
+        "gender": row[prefix + "gender"],
+        "date_of_birth": format_date(row[prefix + "date_of_birth"]),
+        "phone_number": str(phone_number) if phone_number else phone_number,
+        "address_1": address_1,
+        "address_2": address_2,
+        "state": state,
+        "country": country,
+        "email": row[prefix + "email"],
+        "is_email_verified": row[prefix + "is_email_verified"],
+        "is_phone_number_verified": row[prefix + "is_phone_number_verified"],
+        "is_medical_professional": is_staff
+        or row[prefix + "medicalprofessional__id"] is not None,
+        "is_staff": is_staff,
+        "date_joined": format_datetime(row[prefix + "date_joined"]),
+        "full_address": ", ".join(
+            [address_1 or "", address_2 or "", state or "", country or ""]
+        ),
+        "full_name": "{} {}".format(first_name, last_name).strip(),
+    }
+
+
+def represent_medical_history(row: dict) -> dict:
+    return {
+        "id": str(row["id"]),
+        "patient": row["patient"],
+        "medical_conditions": row["medical_conditions"],
+        "allergies": row["allergies"],
+        "medications": row["medications"],
+        "immunization_history": row["immunization_history"],
+        "family_medical_history": row["family_medical_history"],
+        "created_at": format_datetime(row["created_at"]),
+    }
+
+
+def represent_patient(row: dict, medical_history: list, request=None):
+    """PatientSerializer of the patient read with PATIENT_FIELDS and
+    get_user_values("user__")."""
+    representation = {
+        "id": str(row["id"]),
+        "user": represent_user(row, request, prefix="user__"),
+    }
+    for field in PATIENT_FIELDS[1:]:
+        representation[field] = row[field]
+    representation["medical_history"] = medical_history
+    return representation
+
+
+def represent_medical_professional(row: dict, request=None) -> dict:
+    """MedicalProfessionalSerializer of the medical professional read with
+    MEDICAL_PROFESSIONAL_FIELDS and get_user_values("user__")."""
+    representation = {
+        "id": str(row["id"]),
+        "user": represent_user(row, request, prefix="user__"),
+    }
+    for field in MEDICAL_PROFESSIONAL_FIELDS[1:]:
+        representation[field] = row[field]
+    return representation
+
+
+def represent_medical_professionals(rows, request=None) -> list:
+    return [represent_medical_professional(row, request) for row in rows]
+
+
+def get_patient_representations(patient_ids, request=None) -> dict:
+    """PatientSerializer of every patient of `patient_ids` by id."""
+    medical_histories = defaultdict(list)
+    for row in MedicalHistory.objects.filter(
+        patient_id__in=patient_ids
+    ).values(*MEDICAL_HISTORY_FIELDS):
+        medical_histories[row["patient"]].append(
+            represent_medical_history(row)
+        )
+    return {
+        row["id"]: represent_patient(
+            row, medical_histories[row["id"]], request
+        )
+        for row in Patient.objects.filter(id__in=patient_ids).values(
+            *PATIENT_FIELDS, *get_user_values("user__")
+        )
+    }
+
+
+def get_medical_professional_representations(ids, request=None) -> dict:
+    """MedicalProfessionalSerializer of every medical professional of `ids`
+    by id."""
+    return {
+        row["id"]: represent_medical_professional(row, request)
+        for row in MedicalProfessional.objects.filter(id__in=ids).values(
+            *MEDICAL_PROFESSIONAL_FIELDS, *get_user_values("user__")
+        )
+    }
+
+
+class RepresentationListMixin:
+    """Lists the `representation_fields` values of the queryset turned into
+    dicts by `represent_rows(rows, request)` instead of by the serializer."""
+
+    representation_fields = ()
+    represent_rows = None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).values(
+            *self.representation_fields
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                self.represent_rows(page, request)
+            )
+        return Response(self.represent_rows(list(queryset), request))
@@ -0,0 +1,205 @@
+"""
+Hourly, daily and monthly rollups of vital sign readings.
+
+Hour buckets are recomputed from the raw readings ingested since the last
+run, then the days and months holding those hours are recomputed from
+the hour and day buckets. Every bucket is rebuilt from scratch and
+upserted, so running over the same readings twice is harmless.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from users.choices import ROLLUP_RESOLUTION
+from users.models import VitalSigns, VitalSignsRollup, Watermark
+
+WATERMARK_NAME = "vital_signs_rollup"
+ROLLUP_STATS = ("min", "max", "sum", "count")
+ROLLUP_FIELDS = ["count"] + [
+    f"{measurement}_{stat}"
+    for measurement in VitalSigns.MEASUREMENTS
+    for stat in ROLLUP_STATS
+]
+# resolution: (resolution it is built from, length of the source range a
+# single bucket can cover)
+PARENT_RESOLUTIONS = {
+    ROLLUP_RESOLUTION.DAY: (ROLLUP_RESOLUTION.HOUR, timedelta(days=1)),
+    ROLLUP_RESOLUTION.MONTH: (ROLLUP_RESOLUTION.DAY, timedelta(days=31)),
+}
+
+
+def _reading_aggregates() -> dict:
+    aggregates = {"count": Count("id")}
+    for measurement in VitalSigns.MEASUREMENTS:
+        aggregates[f"{measurement}_min"] = Min(measurement)
+        aggregates[f"{measurement}_max"] = Max(measurement)
+        aggregates[f"{measurement}_sum"] = Sum(measurement)
+        aggregates[f"{measurement}_count"] = Count(measurement)
+    return aggregates
+
+
+def _rollup_aggregates() -> dict:
+    aggregates = {"count": Sum("count")}
+    for measurement in VitalSigns.MEASUREMENTS:
+        aggregates[f"{measurement}_min"] = Min(f"{measurement}_min")
+        aggregates[f"{measurement}_max"] = Max(f"{measurement}_max")
+        aggregates[f"{measurement}_sum"] = Sum(f"{measurement}_sum")
+        aggregates[f"{measurement}_count"] = Sum(f"{measurement}_count")
+    return aggregates
+
+
+def _upsert_buckets(resolution: str, rows, buckets: set) -> set:
+    """Save the aggregated `rows` that belong to `buckets`, a set of
+    (patient_id, bucket_start) pairs. Returns the buckets saved."""
+    rollups = [
+        VitalSignsRollup(
+            patient_id=row["patient_id"],
+            resolution=resolution,
+            bucket_start=row["bucket"],
+            **{field: row[field] for field in ROLLUP_FIELDS},
+        )
+        for row in rows
+        if (row["patient_id"], row["bucket"]) in buckets
+    ]
+    VitalSignsRollup.objects.bulk_create(
+        rollups,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["patient", "resolution", "bucket_start"],
+        update_fields=ROLLUP_FIELDS,
+    )
+    return {(rollup.patient_id, rollup.bucket_start) for rollup in rollups}
+
+
+def _bucket_filter(buckets: set, field: str, length: timedelta) -> Q:
+    """Match the rows of each patient whose `field` falls in one of their
+    (patient_id, bucket_start) buckets, a bucket lasting `length`. Adjacent
+    buckets of a patient are merged so the filter stays short, but one
+    patient's buckets never widen the range read for another."""
+    runs = []
+    for patient_id, bucket_start in sorted(buckets):
+        end = bucket_start + length
+        if runs and runs[-1][0] == patient_id and runs[-1][2] >= bucket_start:
+            runs[-1][2] = max(runs[-1][2], end)
+        else:
+            runs.append([patient_id, bucket_start, end])
+
+    condition = Q()
+    for patient_id, start, end in runs:
+        condition |= Q(
+            patient_id=patient_id,
+            **{f"{field}__gte": start, f"{field}__lt": end},
+        )
+    return condition
+
+
+def rollup_hours(buckets: set) -> set:
+    """Recompute the given (patient_id, hour) buckets from the raw readings
+    with one grouped query."""
+    if not buckets:
+        return set()
+    rows = (
+        VitalSigns.objects.filter(
+            _bucket_filter(buckets, "recorded_at", timedelta(hours=1))
+        )
+        .annotate(bucket=Trunc("recorded_at", "hour"))
+        .order_by()
+        .values("patient_id", "bucket")
+        .annotate(**_reading_aggregates())
+    )
+    return _upsert_buckets(ROLLUP_RESOLUTION.HOUR, rows, buckets)
+
+
+def rollup_parents(resolution: str, child_buckets: set) -> set:
+    """Recompute the `resolution` buckets holding `child_buckets` from the
+    finer rollups they are built from."""
+    if not child_buckets:
+        return set()
+    child_resolution, length = PARENT_RESOLUTIONS[resolution]
+    buckets = {
+        (patient_id, _truncate(bucket_start, resolution))
+        for patient_id, bucket_start in child_buckets
+    }
+    rows = (
+        VitalSignsRollup.objects.filter(
+            _bucket_filter(buckets, "bucket_start", length),
+            resolution=child_resolution,
+        )
+        .annotate(bucket=Trunc("bucket_start", resolution))
+        .order_by()
+        .values("patient_id", "bucket")
+        .annotate(**_rollup_aggregates())
+    )
+    return _upsert_buckets(resolution, rows, buckets)
+
+
+def _truncate(moment, resolution: str):
+    moment = timezone.localtime(moment).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    if resolution == ROLLUP_RESOLUTION.MONTH:
+        moment = moment.replace(day=1)
+    return moment
+
+
+def rollup_vital_signs(since=None, chunk_size=None) -> int:
+    """Roll up the readings ingested after `since`, or all of them, a chunk
+    of hour buckets at a time. Returns the number of hour buckets
+    recomputed."""
+    chunk_size = chunk_size or settings.VITALS_ROLLUP_CHUNK_SIZE
+    readings = VitalSigns.objects.filter(recorded_at__isnull=False)
+    if since:
+        readings = readings.filter(created_at__gte=since)
+    touched_hours = (
+        readings.annotate(bucket=Trunc("recorded_at", "hour"))
+        .order_by("patient_id", "bucket")
+        .values_list("patient_id", "bucket")
+        .distinct()
+    )
+
+    recomputed, chunk = 0, set()
+    for bucket in touched_hours.iterator(chunk_size=chunk_size):
+        chunk.add(bucket)
+        if len(chunk) >= chunk_size:
+            recomputed += _rollup_chunk(chunk)
+            chunk = set()
+    if chunk:
+        recomputed += _rollup_chunk(chunk)
+    return recomputed
+
+
+def _rollup_chunk(hour_buckets: set) -> int:
+    day_buckets = rollup_parents(
+        ROLLUP_RESOLUTION.DAY, rollup_hours(hour_buckets)
+    )
+    rollup_parents(ROLLUP_RESOLUTION.MONTH, day_buckets)
+    return len(hour_buckets)
+
+
+def get_watermark():
+    return (
+        Watermark.objects.filter(name=WATERMARK_NAME)
+        .values_list("value", flat=True)
+        .first()
+    )
+
+
+def set_watermark(value):
+    Watermark.objects.update_or_create(
+        name=WATERMARK_NAME, defaults={"value": value}
+    )
+
+
+def rollup_new_vital_signs() -> int:
+    """Roll up the readings ingested since the previous run. Readings from
+    transactions that committed late are caught by re-reading an overlap
+    before the previous watermark."""
+    started_at = timezone.now()
+    watermark = get_watermark()
+    since = watermark - settings.VITALS_ROLLUP_OVERLAP if watermark else None
+    recomputed = rollup_vital_signs(since)
+    set_watermark(started_at)
+    return recomputed
@@ -0,0 +1,104 @@
+"""
+Trigram search over users by email and name.
+
+User.search_text holds the lower cased email, first and last name, rebuilt
+by a database trigger, with a pg_trgm GIN index on it. A plain
+`LIKE '%word%'` on that one column is answered from the index, unlike the
+`UPPER(...) LIKE` over several joined columns Django admin builds from
+search_fields. Related models search through a subquery on the users, so
+the LIKE only ever runs against the indexed column.
+
+pg_trgm cannot narrow a search down on a word shorter than a trigram, so
+such words only filter the rows the longer words of the term matched, and
+a term without a longer word matches nothing.
+"""
+
+import operator
+from functools import reduce
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import F, Q
+from users.models import User
+
+# pg_trgm cannot narrow down words shorter than a trigram
+MIN_SEARCH_WORD_LENGTH = 3
+
+
+def get_search_words(term: str) -> list:
+    return term.lower().split()
+
+
+def has_indexed_word(term: str) -> bool:
+    return any(
+        len(word) >= MIN_SEARCH_WORD_LENGTH for word in get_search_words(term)
+    )
+
+
+def _word_condition(word: str, user_fields, text_fields) -> Q:
+    conditions = []
+    for user_field in user_fields:
+        if not user_field:
+            conditions.append(Q(search_text__contains=word))
+        else:
+            conditions.append(
+                Q(
+                    **{
+                        f"{user_field}__in": User.objects.filter(
+                            search_text__contains=word
+                        ).values("id")
+                    }
+                )
+            )
+    for text_field in text_fields:
+        conditions.append(Q(**{f"{text_field}__icontains": word}))
+    return reduce(operator.or_, conditions)
+
+
+def trigram_search(queryset, term: str, user_fields=("",), text_fields=()):
+    """Keep the rows of `queryset` where every word of `term` is part of the
+    email or name of one of the users at `user_fields` ("" for the users of
+    the queryset themselves), or of one of the trigram indexed
+    `text_fields`."""
+    if not has_indexed_word(term):
+        return queryset.none()
+    for word in get_search_words(term):
+        queryset = queryset.filter(
+            _word_condition(word, user_fields, text_fields)
+        )
+    return queryset
+
+
+def search_users(term: str, queryset=None):
+    """Users matching `term`, closest matches first, with the id of their
+    patient or medical professional profile."""
+    queryset = User.objects.all() if queryset is None else queryset
+    return (
+        trigram_search(queryset, term)
+        .annotate(
+            similarity=TrigramWordSimilarity(term.lower(), "search_text"),
+            patient_id=F("patient__id"),
+            medical_professional_id=F("medicalprofessional__id"),
+        )
+        .order_by("-similarity", "email")
+    )
+
+
+class TrigramSearchAdminMixin:
+    """Answers the admin search box from the trigram indexed user search
+    text instead of search_fields. Set `trigram_user_fields` to the paths
+    of the users to search through and `trigram_text_fields` to other
+    trigram indexed text fields."""
+
+    trigram_user_fields = ("",)
+    trigram_text_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        queryset = trigram_search(
+            queryset,
+            search_term,
+            self.trigram_user_fields,
+            self.trigram_text_fields,
+        )
+        return queryset, False
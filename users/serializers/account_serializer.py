@@ -6,6 +6,7 @@ from django.contrib.auth.password_validation import (
 from django.contrib.auth import authenticate
 from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
+from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.core.cache import cache
 
@@ -14,7 +15,21 @@ from users.models import (
     Patient,
     MedicalProfessional,
     MedicalHistory,
+    VitalSigns,
+    AnthropometricRecord,
+    PatientRecordExport,
 )
+from users.choices import ROLLUP_RESOLUTION, SPECIALIZATION_CHOICES
+from appointments.choices import EXPORT_STATUS
+from appointments.models import (
+    Appointment,
+    MedicalUpload,
+    TestResult,
+    VisitHistory,
+)
+from users.analytics import GROUP_BY_COLUMNS
+from users.chart import invalidate_patient_chart
+from users.search import MIN_SEARCH_WORD_LENGTH, has_indexed_word
 from users.utils import check_verification_pin
 
 import logging
@@ -452,17 +467,34 @@ class PatientSerializer(serializers.ModelSerializer):
             )
         return validated_data
 
+    def _record_anthropometrics(self, patient):
+        AnthropometricRecord.objects.create(
+            patient=patient,
+            height=patient.height,
+            weight=patient.weight,
+            bmi=patient.bmi,
+        )
+
     def create(self, validated_data):
         if hasattr(validated_data, "height") and hasattr(
             validated_data, "weight"
         ):
             self._calc_bmi(validated_data)
-        return super().create(validated_data)
+        with transaction.atomic():
+            patient = super().create(validated_data)
+            if patient.height is not None or patient.weight is not None:
+                self._record_anthropometrics(patient)
+        return patient
 
     def update(self, instance, validated_data):
         if "height" in validated_data and "weight" in validated_data:
             self._calc_bmi(validated_data)
-        return super().update(instance, validated_data)
+        previous = (instance.height, instance.weight, instance.bmi)
+        with transaction.atomic():
+            patient = super().update(instance, validated_data)
+            if (patient.height, patient.weight, patient.bmi) != previous:
+                self._record_anthropometrics(patient)
+        return patient
 
 
 class MedicalProfessionalSerializer(serializers.ModelSerializer):
@@ -484,3 +516,249 @@ class MedicalProfessionalSerializer(serializers.ModelSerializer):
             "id",
             "user",
         )
+
+
+class VitalSignsListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        vital_signs = VitalSigns.objects.bulk_create(
+            [VitalSigns(**attrs) for attrs in validated_data],
+            batch_size=1000,
+        )
+        # bulk_create sends no signals
+        invalidate_patient_chart(
+            *{attrs["patient"].id for attrs in validated_data}
+        )
+        return vital_signs
+
+
+class VitalSignsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = VitalSigns
+        list_serializer_class = VitalSignsListSerializer
+        fields = (
+            "id",
+            "patient",
+            "recorded_at",
+            "systolic_pressure",
+            "diastolic_pressure",
+            "heart_rate",
+            "temperature",
+            "respiratory_rate",
+        )
+        read_only_fields = (
+            "id",
+            "patient",
+        )
+        extra_kwargs = {
+            "recorded_at": {"allow_null": False},
+            **{
+                measurement: {"min_value": low, "max_value": high}
+                for measurement, (low, high) in VitalSigns.RANGES.items()
+            },
+        }
+
+    def validate(self, attrs):
+        if not any(
+            attrs.get(measurement) is not None
+            for measurement in VitalSigns.MEASUREMENTS
+        ):
+            raise serializers.ValidationError(
+                {"detail": _("At least one reading is required.")}
+            )
+        return attrs
+
+
+class VitalSignsRangeSerializer(serializers.Serializer):
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        start, end = attrs.get("start"), attrs.get("end")
+        if start and end and start > end:
+            raise serializers.ValidationError(
+                {"detail": _("start must be before end.")}
+            )
+        return attrs
+
+
+class VitalSignsHistorySerializer(VitalSignsRangeSerializer):
+    resolution = serializers.ChoiceField(
+        choices=ROLLUP_RESOLUTION.choices, default=ROLLUP_RESOLUTION.DAY
+    )
+
+
+class AnthropometricRecordSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AnthropometricRecord
+        fields = (
+            "id",
+            "height",
+            "weight",
+            "bmi",
+            "recorded_at",
+        )
+        read_only_fields = fields
+
+
+class CohortAnalyticsSerializer(VitalSignsRangeSerializer):
+    group_by = serializers.CharField(required=False, default="")
+    specialization = serializers.ChoiceField(
+        choices=SPECIALIZATION_CHOICES.choices, required=False
+    )
+    department = serializers.CharField(required=False)
+
+    def validate_group_by(self, value):
+        group_by = [column for column in value.split(",") if column]
+        invalid = set(group_by) - set(GROUP_BY_COLUMNS)
+        if invalid or len(set(group_by)) != len(group_by):
+            raise serializers.ValidationError(
+                _("Group by distinct columns out of: {}.").format(
+                    ", ".join(GROUP_BY_COLUMNS)
+                )
+            )
+        return group_by
+
+
+class UserSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(min_length=3, max_length=200)
+    role = serializers.ChoiceField(
+        choices=("patient", "medical_professional"), required=False
+    )
+
+    def validate_q(self, value):
+        if not has_indexed_word(value):
+            raise serializers.ValidationError(
+                _("Include a word of at least {} characters.").format(
+                    MIN_SEARCH_WORD_LENGTH
+                )
+            )
+        return value
+
+
+class UserSearchResultSerializer(serializers.ModelSerializer):
+    similarity = serializers.FloatField(read_only=True)
+    patient_id = serializers.UUIDField(read_only=True)
+    medical_professional_id = serializers.UUIDField(read_only=True)
+
+    class Meta:
+        model = User
+        fields = (
+            "id",
+            "email",
+            "first_name",
+            "last_name",
+            "patient_id",
+            "medical_professional_id",
+            "similarity",
+        )
+
+
+class ChartMedicalProfessionalSerializer(serializers.ModelSerializer):
+    full_name = serializers.CharField(source="user.full_name", read_only=True)
+
+    class Meta:
+        model = MedicalProfessional
+        fields = (
+            "id",
+            "full_name",
+            "specialization",
+            "department",
+        )
+
+
+class ChartTestResultSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TestResult
+        fields = (
+            "id",
+            "blood_tests",
+            "imaging_studies",
+            "electrocardiogram",
+            "other_tests",
+        )
+
+
+class ChartMedicalUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MedicalUpload
+        fields = (
+            "id",
+            "upload",
+        )
+
+
+class ChartVisitHistorySerializer(serializers.ModelSerializer):
+    medical_professional = ChartMedicalProfessionalSerializer(read_only=True)
+    test_results = ChartTestResultSerializer(many=True, read_only=True)
+    uploads = ChartMedicalUploadSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = VisitHistory
+        fields = (
+            "id",
+            "appointment",
+            "medical_professional",
+            "visit_date",
+            "reason_for_visit",
+            "treatments_received",
+            "physician_notes",
+            "test_results",
+            "uploads",
+        )
+
+
+class ChartAppointmentSerializer(serializers.ModelSerializer):
+    medical_professional = ChartMedicalProfessionalSerializer(read_only=True)
+
+    class Meta:
+        model = Appointment
+        fields = (
+            "id",
+            "medical_professional",
+            "note",
+            "status",
+            "start_time",
+            "end_time",
+        )
+
+
+class PatientChartSerializer(PatientSerializer):
+    """Read only chart of a patient, see users.chart. The related records
+    are serialized without their patient, which the chart is about."""
+
+    recent_vital_signs = VitalSignsSerializer(many=True, read_only=True)
+    visit_histories = ChartVisitHistorySerializer(many=True, read_only=True)
+    upcoming_appointments = ChartAppointmentSerializer(
+        many=True, read_only=True
+    )
+
+    class Meta(PatientSerializer.Meta):
+        fields = PatientSerializer.Meta.fields + (
+            "recent_vital_signs",
+            "visit_histories",
+            "upcoming_appointments",
+        )
+        read_only_fields = fields
+
+
+class PatientRecordExportSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PatientRecordExport
+        fields = (
+            "id",
+            "status",
+            "download_url",
+            "error",
+            "created_at",
+            "completed_at",
+        )
+        read_only_fields = fields
+
+    def get_download_url(self, obj: PatientRecordExport):
+        if obj.status != EXPORT_STATUS.COMPLETED:
+            return None
+        return self.context["request"].build_absolute_uri(
+            reverse("patient_record_export_download", args=[obj.pk])
+        )
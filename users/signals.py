@@ -0,0 +1,143 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from appointments.models import (
+    Appointment,
+    Availability,
+    MedicalUpload,
+    TestResult,
+    VisitHistory,
+)
+from appointments.workload import (
+    WORKLOAD_DAY_FIELDS,
+    mark_workload_changed,
+    mark_workload_of,
+)
+from users.chart import invalidate_patient_chart
+from users.models import (
+    MedicalHistory,
+    MedicalProfessional,
+    Patient,
+    User,
+    VitalSigns,
+)
+from users.sync import add_tombstone, touch
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def invalidate_chart_of_patient(sender, instance, **kwargs):
+    invalidate_patient_chart(instance.id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_chart_of_user(sender, instance, **kwargs):
+    invalidate_patient_chart(
+        *Patient.objects.filter(user=instance).values_list("id", flat=True)
+    )
+
+
+@receiver(post_save, sender=MedicalHistory)
+@receiver(post_delete, sender=MedicalHistory)
+@receiver(post_save, sender=VitalSigns)
+@receiver(post_delete, sender=VitalSigns)
+@receiver(post_save, sender=VisitHistory)
+@receiver(post_delete, sender=VisitHistory)
+@receiver(post_save, sender=TestResult)
+@receiver(post_delete, sender=TestResult)
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def invalidate_chart_of_record(sender, instance, **kwargs):
+    invalidate_patient_chart(instance.patient_id)
+
+
+@receiver(post_save, sender=MedicalUpload)
+@receiver(post_delete, sender=MedicalUpload)
+def invalidate_chart_of_upload(sender, instance, **kwargs):
+    invalidate_patient_chart(
+        *VisitHistory.objects.filter(id=instance.visit_history_id).values_list(
+            "patient_id", flat=True
+        )
+    )
+
+
+@receiver(post_save, sender=User)
+def touch_profiles_of_user(sender, instance, created, update_fields, **kwargs):
+    # logging in only moves last_login, which no representation shows
+    if created or (update_fields and set(update_fields) <= {"last_login"}):
+        return
+    touch(Patient.objects.filter(user=instance))
+    touch(MedicalProfessional.objects.filter(user=instance))
+
+
+@receiver(post_save, sender=MedicalHistory)
+@receiver(post_delete, sender=MedicalHistory)
+def touch_patient_of_medical_history(sender, instance, **kwargs):
+    touch(Patient.objects.filter(id=instance.patient_id))
+
+
+@receiver(post_save, sender=TestResult)
+@receiver(post_delete, sender=TestResult)
+@receiver(post_save, sender=MedicalUpload)
+@receiver(post_delete, sender=MedicalUpload)
+def touch_visit_history_of_record(sender, instance, **kwargs):
+    touch(VisitHistory.objects.filter(id=instance.visit_history_id))
+
+
+@receiver(post_delete, sender=Appointment)
+@receiver(post_delete, sender=Availability)
+@receiver(post_delete, sender=VisitHistory)
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=MedicalProfessional)
+@receiver(post_delete, sender=MedicalHistory)
+def add_tombstone_of_row(sender, instance, **kwargs):
+    add_tombstone(instance)
+
+
+@receiver(pre_save, sender=Appointment)
+def add_tombstone_of_moved_appointment(
+    sender, instance, update_fields, **kwargs
+):
+    # a reassigned appointment leaves the list of its previous medical
+    # professional only
+    if instance._state.adding or (
+        update_fields is not None
+        and "medical_professional" not in update_fields
+        and "medical_professional_id" not in update_fields
+    ):
+        return
+    previous_id = (
+        Appointment.objects.filter(pk=instance.pk)
+        .values_list("medical_professional_id", flat=True)
+        .first()
+    )
+    if previous_id and previous_id != instance.medical_professional_id:
+        add_tombstone(instance, medical_professional_id=previous_id)
+
+
+@receiver(pre_save, sender=Appointment)
+@receiver(pre_save, sender=Availability)
+def mark_previous_workload_days(sender, instance, update_fields, **kwargs):
+    # the days the row counted in before it moved
+    if instance._state.adding or (
+        update_fields is not None
+        and not WORKLOAD_DAY_FIELDS & set(update_fields)
+    ):
+        return
+    mark_workload_of(sender.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_save, sender=Availability)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_delete, sender=Availability)
+def mark_workload_days(sender, instance, **kwargs):
+    mark_workload_changed(
+        sender,
+        [
+            (
+                instance.medical_professional_id,
+                instance.start_time,
+                instance.end_time,
+            )
+        ],
+    )
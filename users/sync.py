@@ -0,0 +1,122 @@
+"""
+Delta sync of API lists.
+
+Every synced model has an indexed updated_at. save() moves it, bulk
+updates set it themselves (see with_updated_at), and the signals in
+users.signals move the updated_at of the rows whose representation nests
+a changed row, e.g. the patient of a saved medical history. Deleted rows
+leave a Tombstone behind for TOMBSTONE_RETENTION.
+
+A list sent ?since=<the synced_at of the last sync> gives only the rows
+changed since then, oldest change first, with the ids of the rows deleted
+since then. The window starts DELTA_SYNC_OVERLAP before `since` so rows
+saved by transactions still open during the last sync are not missed;
+clients must expect a few rows they already have.
+"""
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+from users.models import MedicalProfessional, Patient, Tombstone
+
+SINCE_FIELD = serializers.DateTimeField()
+
+
+def with_updated_at(model, values: dict) -> dict:
+    """`values` of a bulk update of `model`, which skips auto_now, with
+    updated_at set when the model has one."""
+    if any(
+        field.name == "updated_at" for field in model._meta.concrete_fields
+    ):
+        return {"updated_at": timezone.now(), **values}
+    return values
+
+
+def touch(queryset) -> int:
+    return queryset.update(updated_at=timezone.now())
+
+
+def add_tombstone(instance, **owners) -> Tombstone:
+    """Record that `instance` left the lists of its owners. `owners`, e.g.
+    medical_professional_id=, names them instead when the row only left
+    some of them."""
+    if not owners:
+        if isinstance(instance, Patient):
+            owners["patient_id"] = instance.pk
+        else:
+            owners["patient_id"] = getattr(instance, "patient_id", None)
+        if isinstance(instance, MedicalProfessional):
+            owners["medical_professional_id"] = instance.pk
+        else:
+            owners["medical_professional_id"] = getattr(
+                instance, "medical_professional_id", None
+            )
+    return Tombstone.objects.create(
+        model=instance._meta.label_lower, object_id=instance.pk, **owners
+    )
+
+
+def get_since(request):
+    value = request.query_params.get("since")
+    if not value:
+        return None
+    try:
+        since = SINCE_FIELD.to_internal_value(value)
+    except serializers.ValidationError:
+        raise serializers.ValidationError(
+            {"detail": "since must be an ISO 8601 date and time."}
+        )
+    if since < timezone.now() - settings.TOMBSTONE_RETENTION:
+        raise serializers.ValidationError(
+            {
+                "detail": "Deletions are only kept for {} days, fetch the "
+                "whole list instead.".format(settings.TOMBSTONE_RETENTION.days)
+            }
+        )
+    return since
+
+
+class DeltaListMixin:
+    """Lists only the rows changed since ?since=, with the ids of the rows
+    deleted since then, and the synced_at to send as `since` next time.
+    `delta_fields` are the updated_at lookups of the row and of the rows
+    its representation nests. The tombstones are those of the model of the
+    queryset with the `get_tombstone_owners()` of the list."""
+
+    delta_fields = ("updated_at",)
+    changed_after = None
+
+    def get_tombstone_owners(self) -> dict:
+        return {}
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.changed_after is None:
+            return queryset
+        changed = Q()
+        for field in self.delta_fields:
+            changed |= Q(**{field + "__gt": self.changed_after})
+        return queryset.filter(changed).order_by("updated_at", "pk")
+
+    def list(self, request, *args, **kwargs):
+        since = get_since(request)
+        if since is None:
+            return super().list(request, *args, **kwargs)
+
+        synced_at = timezone.now()
+        self.changed_after = since - settings.DELTA_SYNC_OVERLAP
+        response = super().list(request, *args, **kwargs)
+        deleted = Tombstone.objects.filter(
+            model=self.get_queryset().model._meta.label_lower,
+            deleted_at__gt=self.changed_after,
+            **self.get_tombstone_owners(),
+        ).values_list("object_id", flat=True)
+
+        data = response.data
+        if not isinstance(data, dict):
+            data = {"results": data}
+        data["deleted"] = [str(object_id) for object_id in deleted]
+        data["synced_at"] = SINCE_FIELD.to_representation(synced_at)
+        response.data = data
+        return response
@@ -2,6 +2,7 @@ import logging
 
 from health_api.celery import app as celery_app
 from django.conf import settings
+from django.core.cache import cache
 from datetime import datetime
 
 # from furl import furl
@@ -10,6 +11,8 @@ from users.utils import send_template_email
 
 logger = logging.getLogger(__name__)
 
+ROLLUP_LOCK_CACHE_KEY = "vital_signs_rollup_lock"
+
 
 # SITE_BASE_URL = furl(settings.FRONTEND_BASE_URL)
 
@@ -122,3 +125,103 @@ def send_appointment_update_mail(
     logger.info(
         "Appointment status update email sent to patient: {}".format(email)
     )
+
+
+@celery_app.task(name="send_appointment_reminder_mail")
+def send_appointment_reminder_mail(
+    full_name: str,
+    recipient_name: str,
+    email: str,
+    appointment_date,
+    appointment_time,
+):
+    logger.info("Sending Appointment reminder email to: {}".format(email))
+
+    message = f"This is a reminder of your upcoming appointment with \
+        {recipient_name}. Please find the details below:"
+
+    send_template_email(
+        "appointment_notify.html",
+        email,
+        "Appointment Reminder",
+        **{
+            "full_name": full_name,
+            "message": message,
+            "appointment_date": appointment_date,
+            "appointment_time": appointment_time,
+            "hospital_address": settings.HOSPITAL_ADDRESS,
+            "year": datetime.now().year,
+        },
+    )
+
+    logger.info("Appointment reminder email sent to: {}".format(email))
+
+
+@celery_app.task(name="rollup_vital_signs")
+def rollup_vital_signs():
+    from users.rollups import rollup_new_vital_signs
+
+    # overlapping runs would move the watermark past each other's readings
+    if not cache.add(ROLLUP_LOCK_CACHE_KEY, True, 60 * 30):
+        logger.info("Vital signs are already being rolled up")
+        return 0
+
+    try:
+        recomputed = rollup_new_vital_signs()
+    finally:
+        cache.delete(ROLLUP_LOCK_CACHE_KEY)
+
+    logger.info("Rolled up {} hours of vital signs".format(recomputed))
+    return recomputed
+
+
+@celery_app.task(name="send_patient_record_ready_mail")
+def send_patient_record_ready_mail(full_name: str, email: str, requested_at):
+    logger.info("Sending health record ready email to: {}".format(email))
+
+    send_template_email(
+        "patient_record_ready.html",
+        email,
+        "Your Health Record Is Ready",
+        **{
+            "full_name": full_name,
+            "requested_at": requested_at,
+            "hospital_address": settings.HOSPITAL_ADDRESS,
+            "year": datetime.now().year,
+        },
+    )
+
+    logger.info("Health record ready email sent to: {}".format(email))
+
+
+@celery_app.task(name="build_patient_record_export")
+def build_patient_record_export(export_id):
+    from appointments.choices import EXPORT_STATUS
+    from users.record_export import build_patient_record
+
+    record_export = build_patient_record(export_id)
+    logger.info(
+        "Patient record export {} {}".format(export_id, record_export.status)
+    )
+    if record_export.status == EXPORT_STATUS.COMPLETED:
+        user = record_export.patient.user
+        send_patient_record_ready_mail.delay(
+            user.full_name, user.email, record_export.created_at.date()
+        )
+    return record_export.status
+
+
+@celery_app.task(name="prune_tombstones")
+def prune_tombstones():
+    from django.utils import timezone
+    from appointments.utils import delete_in_batches
+    from users.models import Tombstone
+
+    deleted, _ = delete_in_batches(
+        Tombstone.objects.filter(
+            deleted_at__lt=timezone.now() - settings.TOMBSTONE_RETENTION
+        ),
+        settings.TOMBSTONE_PRUNE_BATCH_SIZE,
+    )
+    logger.info("Pruned {} tombstones".format(deleted))
+    return deleted
@@ -1,3 +1,1066 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import operator
+import tempfile
+import unittest
+import uuid
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from appointments.choices import BOOKING_STATUS
+from appointments.serilaizers import AppointmentSerializer
+from appointments.models import (
+    Appointment,
+    Availability,
+    MedicalUpload,
+    TestResult,
+    VisitHistory,
+)
+from users.choices import ROLLUP_RESOLUTION
+from users.models import (
+    MedicalHistory,
+    MedicalProfessional,
+    Patient,
+    PatientRecordExport,
+    User,
+    VitalSigns,
+    VitalSignsRollup,
+    Watermark,
+)
+from users import renderers
+from users.parsers import FastJSONParser, NDJSONParser, UndecodableLine
+from users.search import search_users, trigram_search
+from users.rollups import (
+    WATERMARK_NAME,
+    _bucket_filter,
+    rollup_hours,
+    rollup_new_vital_signs,
+)
+from users.serializers import MedicalProfessionalSerializer
+from users.utils import EstimatedCountPaginator
+
+
+def create_users(prefix: str, count: int) -> list:
+    return User.objects.bulk_create(
+        [
+            User(
+                email=f"{prefix}{i}@example.com",
+                username=f"{prefix}{i}@example.com",
+                first_name=f"First{i}",
+                last_name=f"Last{i}",
+            )
+            for i in range(count)
+        ]
+    )
+
+
+class AdminChangelistQueryCountTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            "admin@example.com", "S3cure!pass-xyz"
+        )
+        self.client.force_login(self.admin)
+
+    def count_changelist_queries(self, url_name: str) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url_name: str, add_rows):
+        add_rows(2)
+        few_rows_queries = self.count_changelist_queries(url_name)
+        add_rows(20)
+        self.assertEqual(
+            self.count_changelist_queries(url_name), few_rows_queries
+        )
+
+    def test_user_changelist(self):
+        self.assertConstantQueries(
+            "admin:users_user_changelist",
+            lambda count: create_users(f"user{count}-", count),
+        )
+
+    def test_patient_changelist(self):
+        def add_patients(count):
+            Patient.objects.bulk_create(
+                [
+                    Patient(user=user)
+                    for user in create_users(f"patient{count}-", count)
+                ]
+            )
+
+        self.assertConstantQueries(
+            "admin:users_patient_changelist", add_patients
+        )
+
+    def test_medical_professional_changelist(self):
+        def add_medical_professionals(count):
+            MedicalProfessional.objects.bulk_create(
+                [
+                    MedicalProfessional(user=user, department="Cardiology")
+                    for user in create_users(f"doctor{count}-", count)
+                ]
+            )
+
+        self.assertConstantQueries(
+            "admin:users_medicalprofessional_changelist",
+            add_medical_professionals,
+        )
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def test_small_tables_are_counted_exactly(self):
+        create_users("count", 3)
+        paginator = EstimatedCountPaginator(User.objects.order_by("id"), 2)
+        self.assertEqual(paginator.count, 3)
+
+    def test_filtered_lists_are_counted_exactly(self):
+        create_users("filtered", 3)
+        paginator = EstimatedCountPaginator(
+            User.objects.filter(first_name="First1").order_by("id"), 2
+        )
+        self.assertEqual(paginator.count, 1)
+
+
+class MedicalProfessionalSlotManagerTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            "admin@example.com", "S3cure!pass-xyz"
+        )
+        self.client.force_login(self.admin)
+        self.doctor = MedicalProfessional.objects.create(
+            user=create_users("slots", 1)[0], department="Cardiology"
+        )
+        self.now = timezone.now()
+
+    def add_slots(self, count: int, start, is_booked=False) -> list:
+        return Availability.objects.bulk_create(
+            [
+                Availability(
+                    medical_professional=self.doctor,
+                    start_time=start + timedelta(hours=2 * i),
+                    end_time=start + timedelta(hours=2 * i + 1),
+                    is_booked=is_booked,
+                )
+                for i in range(count)
+            ]
+        )
+
+    def test_change_page_only_renders_upcoming_slots(self):
+        self.add_slots(2, self.now + timedelta(days=1))
+        self.add_slots(30, self.now - timedelta(days=90), is_booked=True)
+        self.add_slots(30, self.now + timedelta(days=60))
+
+        response = self.client.get(
+            reverse(
+                "admin:users_medicalprofessional_change",
+                args=[self.doctor.pk],
+            )
+        )
+        self.assertEqual(response.status_code, 200)
+        formset = response.context["inline_admin_formsets"][0].formset
+        self.assertEqual(len(formset.forms), 2)
+
+    def test_slots_are_paginated(self):
+        self.add_slots(60, self.now + timedelta(days=1))
+        self.add_slots(5, self.now - timedelta(days=30))
+        url = reverse(
+            "admin:users_medicalprofessional_availability",
+            args=[self.doctor.pk],
+        )
+
+        data = self.client.get(url, {"page": 2}).json()
+        self.assertEqual(data["count"], 60)
+        self.assertEqual(data["num_pages"], 2)
+        self.assertEqual(len(data["results"]), 10)
+
+        data = self.client.get(url, {"when": "past"}).json()
+        self.assertEqual(data["count"], 5)
+
+    def test_bulk_actions_leave_booked_slots_alone(self):
+        free = self.add_slots(2, self.now + timedelta(days=1))
+        booked = self.add_slots(1, self.now + timedelta(days=2), True)
+        url = reverse(
+            "admin:users_medicalprofessional_availability_bulk",
+            args=[self.doctor.pk],
+        )
+        ids = [str(slot.id) for slot in free + booked]
+
+        response = self.client.post(
+            url,
+            json.dumps({"action": "shift", "ids": ids, "minutes": 30}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.json(), {"updated": 2})
+        free[0].refresh_from_db()
+        self.assertEqual(
+            free[0].start_time, self.now + timedelta(days=1, minutes=30)
+        )
+
+        response = self.client.post(
+            url,
+            json.dumps({"action": "delete", "ids": ids}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.json(), {"updated": 2})
+        self.assertTrue(Availability.objects.get().is_booked)
+
+    def test_bulk_shift_checks_ids_and_overlaps(self):
+        start = self.now + timedelta(days=1)
+        first, second = self.add_slots(2, start)
+        self.add_slots(1, start + timedelta(hours=4), True)
+        url = reverse(
+            "admin:users_medicalprofessional_availability_bulk",
+            args=[self.doctor.pk],
+        )
+
+        def shift(ids, minutes):
+            return self.client.post(
+                url,
+                json.dumps(
+                    {"action": "shift", "ids": ids, "minutes": minutes}
+                ),
+                content_type="application/json",
+            )
+
+        self.assertEqual(shift(["not-a-uuid"], 30).status_code, 400)
+        # the second slot would run into the booking at 4h
+        response = shift([str(second.id)], 120)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            Availability.objects.get(pk=second.pk).start_time,
+            start + timedelta(hours=2),
+        )
+
+        # the first slot lands on the second and is merged with it
+        response = shift([str(first.id)], 90)
+        self.assertEqual(response.json(), {"updated": 1})
+        self.assertEqual(
+            list(
+                Availability.objects.filter(is_booked=False).values_list(
+                    "start_time", "end_time"
+                )
+            ),
+            [(start + timedelta(minutes=90), start + timedelta(hours=3))],
+        )
+
+
+class PatientChartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        doctor_user, patient_user = create_users("chart", 2)
+        doctor_user.is_staff = True
+        doctor_user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(doctor_user)
+        self.doctor = MedicalProfessional.objects.create(
+            user=doctor_user, department="Cardiology"
+        )
+        self.patient = Patient.objects.create(user=patient_user)
+        self.url = reverse("patient_chart", args=[self.patient.id])
+
+    def add_records(self, count: int):
+        now = timezone.now()
+        MedicalHistory.objects.bulk_create(
+            [MedicalHistory(patient=self.patient) for _ in range(count)]
+        )
+        VitalSigns.objects.bulk_create(
+            [
+                VitalSigns(patient=self.patient, heart_rate=60 + i)
+                for i in range(count)
+            ]
+        )
+        appointments = Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    patient=self.patient,
+                    medical_professional=self.doctor,
+                    status=BOOKING_STATUS.ACCEPTED,
+                    start_time=now + timedelta(days=i + 1),
+                    end_time=now + timedelta(days=i + 1, hours=1),
+                )
+                for i in range(count)
+            ]
+        )
+        visits = VisitHistory.objects.bulk_create(
+            [
+                VisitHistory(
+                    appointment=appointment,
+                    patient=self.patient,
+                    medical_professional=self.doctor,
+                )
+                for appointment in appointments
+            ]
+        )
+        TestResult.objects.bulk_create(
+            [
+                TestResult(
+                    patient=self.patient,
+                    visit_history=visit,
+                    blood_tests="",
+                    imaging_studies="",
+                    electrocardiogram="",
+                    other_tests="",
+                )
+                for visit in visits
+            ]
+        )
+        MedicalUpload.objects.bulk_create(
+            [
+                MedicalUpload(visit_history=visit, upload="report.pdf")
+                for visit in visits
+            ]
+        )
+
+    def count_chart_queries(self) -> int:
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_chart_is_read_in_constant_queries(self):
+        self.add_records(2)
+        few_records_queries = self.count_chart_queries()
+        self.add_records(20)
+        self.assertEqual(self.count_chart_queries(), few_records_queries)
+
+        chart = self.client.get(self.url).json()
+        self.assertEqual(len(chart["visit_histories"]), 22)
+        self.assertEqual(len(chart["visit_histories"][0]["test_results"]), 1)
+        self.assertEqual(len(chart["visit_histories"][0]["uploads"]), 1)
+        self.assertEqual(len(chart["upcoming_appointments"]), 22)
+
+    def test_chart_is_cached_until_a_record_changes(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertFalse(
+            [query for query in queries if "users_patient" in query["sql"]]
+        )
+
+        MedicalHistory.objects.create(
+            patient=self.patient, medical_conditions="Asthma"
+        )
+        chart = self.client.get(self.url).json()
+        self.assertEqual(
+            chart["medical_history"][0]["medical_conditions"], "Asthma"
+        )
+
+    def test_unknown_patient(self):
+        response = self.client.get(
+            reverse("patient_chart", args=[self.doctor.id])
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class PatientRecordExportTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        doctor_user, patient_user = create_users("record", 2)
+        patient_user.is_email_verified = True
+        patient_user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(patient_user)
+        doctor = MedicalProfessional.objects.create(user=doctor_user)
+        self.patient = Patient.objects.create(user=patient_user)
+        now = timezone.now()
+        visit = VisitHistory.objects.create(
+            appointment=Appointment.objects.create(
+                patient=self.patient,
+                medical_professional=doctor,
+                start_time=now,
+                end_time=now + timedelta(hours=1),
+            ),
+            patient=self.patient,
+            medical_professional=doctor,
+        )
+        MedicalUpload.objects.create(
+            visit_history=visit,
+            upload=default_storage.save(
+                "files/uploads/scan.pdf", ContentFile(b"%PDF scan")
+            ),
+        )
+        VitalSigns.objects.create(patient=self.patient, heart_rate=72)
+
+    def test_record_is_zipped_with_attachments_and_mailed(self):
+        url = reverse("patient_record_export")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["status"], "Pending")
+
+        response = self.client.get(
+            reverse("patient_record_export_status", args=[response.data["id"]])
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "Completed")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["record1@example.com"])
+
+        response = self.client.get(response.json()["download_url"])
+        archive = zipfile.ZipFile(
+            io.BytesIO(b"".join(response.streaming_content))
+        )
+        manifest = json.loads(archive.read("manifest.json"))
+        counts = {
+            resource["type"]: resource["count"]
+            for resource in manifest["resources"]
+        }
+        self.assertEqual(counts["Patient"], 1)
+        self.assertEqual(counts["VitalSigns"], 1)
+        self.assertEqual(counts["VisitHistory"], 1)
+        vitals = json.loads(archive.read("record/VitalSigns.json"))
+        self.assertEqual(vitals[0]["heart_rate"], 72)
+        (attachment,) = manifest["attachments"]
+        self.assertEqual(archive.read(attachment), b"%PDF scan")
+
+    def test_other_patients_exports_are_not_found(self):
+        other_user = create_users("other-record", 1)[0]
+        other_export = PatientRecordExport.objects.create(
+            patient=Patient.objects.create(user=other_user)
+        )
+        response = self.client.get(
+            reverse("patient_record_export_status", args=[other_export.pk])
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class FastJSONRendererTests(TestCase):
+    def setUp(self):
+        doctor_user, patient_user = create_users("json", 2)
+        now = timezone.now()
+        Appointment.objects.create(
+            patient=Patient.objects.create(user=patient_user),
+            medical_professional=MedicalProfessional.objects.create(
+                user=doctor_user
+            ),
+            start_time=now,
+            end_time=now + timedelta(hours=1),
+            note="Fasting\u2028bloods",
+        )
+        self.page = AppointmentSerializer(
+            Appointment.objects.all(), many=True
+        ).data
+
+    def render(self, data, backend: str) -> bytes:
+        with override_settings(API_JSON_BACKEND=backend):
+            return renderers.FastJSONRenderer().render(data)
+
+    @unittest.skipUnless(renderers.orjson, "orjson is not installed")
+    def test_orjson_matches_the_stdlib_renderer(self):
+        values = {
+            "id": uuid.uuid4(),
+            "at": timezone.now(),
+            "amount": Decimal("12.50"),
+            "label": gettext_lazy("Pending"),
+            "page": self.page,
+        }
+        self.assertEqual(
+            self.render(values, "orjson"), JSONRenderer().render(values)
+        )
+
+    @unittest.skipUnless(renderers.orjson, "orjson is not installed")
+    def test_orjson_falls_back_to_the_stdlib_for_wide_integers(self):
+        values = {"count": 2**70, "page": self.page}
+        self.assertEqual(
+            self.render(values, "orjson"), JSONRenderer().render(values)
+        )
+
+    @unittest.skipUnless(renderers.orjson, "orjson is not installed")
+    def test_float_differences(self):
+        self.assertEqual(self.render([1e16], "orjson"), b"[1e16]")
+        self.assertEqual(JSONRenderer().render([1e16]), b"[1e+16]")
+        self.assertEqual(self.render([float("nan")], "orjson"), b"[null]")
+
+    @unittest.skipUnless(renderers.msgspec, "msgspec is not installed")
+    def test_msgspec_matches_the_stdlib_renderer(self):
+        self.assertEqual(
+            self.render(self.page, "msgspec"), JSONRenderer().render(self.page)
+        )
+
+    def test_request_bodies_are_parsed(self):
+        for backend in ("json", "orjson", "msgspec"):
+            with override_settings(API_JSON_BACKEND=backend):
+                self.assertEqual(
+                    FastJSONParser().parse(io.BytesIO(b'{"a": [1, 2.5]}')),
+                    {"a": [1, 2.5]},
+                )
+                with self.assertRaises(ParseError):
+                    FastJSONParser().parse(io.BytesIO(b'{"a": NaN}'))
+
+
+class MedicalProfessionalListTests(TestCase):
+    def test_list_matches_the_serializer(self):
+        users = create_users("doctor-list", 3)
+        MedicalProfessional.objects.bulk_create(
+            [
+                MedicalProfessional(user=user, department=f"Ward {i}")
+                for i, user in enumerate(users)
+            ]
+        )
+        client = APIClient()
+        client.force_authenticate(users[0])
+        response = client.get("/api/v1/accounts/doctors/")
+        serializer = MedicalProfessionalSerializer(
+            MedicalProfessional.objects.all(),
+            many=True,
+            context={"request": response.wsgi_request},
+        )
+        by_id = operator.itemgetter("id")
+        self.assertEqual(
+            json.dumps(sorted(response.json()["results"], key=by_id)),
+            json.dumps(
+                sorted(
+                    json.loads(JSONRenderer().render(serializer.data)),
+                    key=by_id,
+                )
+            ),
+        )
+
+
+class VitalSignsTests(TestCase):
+    def setUp(self):
+        doctor_user, patient_user, other_user = create_users("vitals", 3)
+        doctor_user.is_staff = True
+        doctor_user.save()
+        User.objects.filter(pk=patient_user.pk).update(is_email_verified=True)
+        # read back so the ids are UUIDs rather than the hex they are made as
+        self.patient = Patient.objects.get(
+            pk=Patient.objects.create(user=patient_user).pk
+        )
+        self.other = Patient.objects.create(user=other_user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+        self.staff_client = APIClient()
+        self.staff_client.force_authenticate(doctor_user)
+        self.day = timezone.now().replace(
+            hour=12, minute=0, second=0, microsecond=0
+        ) - timedelta(days=3)
+
+    def add_readings(self):
+        VitalSigns.objects.bulk_create(
+            [
+                VitalSigns(
+                    patient=self.patient,
+                    recorded_at=self.day + timedelta(days=i // 2, hours=i),
+                    heart_rate=60 + 10 * i,
+                    temperature=36.5,
+                )
+                for i in range(4)
+            ]
+            + [VitalSigns(patient=self.other, heart_rate=100)]
+        )
+
+    def test_post_one_reading(self):
+        response = self.client.post(
+            reverse("vital_signs"),
+            {"systolic_pressure": 120, "diastolic_pressure": 80},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        reading = VitalSigns.objects.get()
+        self.assertEqual(reading.patient_id, self.patient.pk)
+        self.assertEqual(
+            (reading.systolic_pressure, reading.diastolic_pressure), (120, 80)
+        )
+
+    def test_post_list_is_one_insert(self):
+        readings = [{"heart_rate": 60 + i} for i in range(5)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("vital_signs"), readings, format="json"
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()), 5)
+        self.assertEqual(
+            sum(
+                query["sql"].startswith('INSERT INTO "users_vitalsigns"')
+                for query in queries.captured_queries
+            ),
+            1,
+        )
+        self.assertEqual(
+            VitalSigns.objects.filter(patient=self.patient).count(), 5
+        )
+
+    def test_invalid_readings_are_rejected(self):
+        for data in ({}, {"heart_rate": 900}, [{"heart_rate": 60}, {}]):
+            response = self.client.post(
+                reverse("vital_signs"), data, format="json"
+            )
+            self.assertEqual(response.status_code, 400, data)
+        self.assertFalse(VitalSigns.objects.exists())
+
+    def test_list_in_range(self):
+        self.add_readings()
+        response = self.client.get(
+            reverse("vital_signs"),
+            {
+                "start": (self.day + timedelta(hours=1)).isoformat(),
+                "end": (self.day + timedelta(days=1, hours=3)).isoformat(),
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [reading["heart_rate"] for reading in response.json()["results"]],
+            [80, 70],
+        )
+
+    def test_start_after_end(self):
+        response = self.client.get(
+            reverse("vital_signs"),
+            {
+                "start": self.day.isoformat(),
+                "end": (self.day - timedelta(days=1)).isoformat(),
+            },
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_daily_summary(self):
+        self.add_readings()
+        response = self.client.get(reverse("vital_signs_summary"))
+        self.assertEqual(response.status_code, 200)
+        summary = response.json()
+        self.assertEqual([day["count"] for day in summary], [2, 2])
+        self.assertEqual(
+            [
+                (day["heart_rate_min"], day["heart_rate_max"])
+                for day in summary
+            ],
+            [(60, 70), (80, 90)],
+        )
+        self.assertEqual(summary[0]["heart_rate_avg"], 65)
+        self.assertIsNone(summary[0]["systolic_pressure_avg"])
+
+    def test_untimestamped_readings_are_left_out(self):
+        self.add_readings()
+        # as kept by migration 0016 from the text readings
+        VitalSigns.objects.create(
+            patient=self.patient, recorded_at=None, heart_rate=50
+        )
+        response = self.client.get(reverse("vital_signs"))
+        self.assertEqual(response.json()["count"], 4)
+        response = self.client.get(reverse("vital_signs_summary"))
+        self.assertEqual([day["count"] for day in response.json()], [2, 2])
+        response = self.client.post(
+            reverse("vital_signs"),
+            {"recorded_at": None, "heart_rate": 60},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_staff_reads_and_writes_a_patients_readings(self):
+        self.add_readings()
+        response = self.staff_client.get(
+            reverse("staff_vital_signs"), {"patient_id": self.other.pk}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 1)
+        response = self.staff_client.post(
+            reverse("staff_vital_signs") + f"?patient_id={self.other.pk}",
+            {"respiratory_rate": 14},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            VitalSigns.objects.filter(patient=self.other).count(), 2
+        )
+        response = self.staff_client.get(
+            reverse("staff_vital_signs_summary"), {"patient_id": self.other.pk}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["count"], 2)
+
+    def test_staff_views_need_a_known_patient_and_staff(self):
+        response = self.staff_client.get(
+            reverse("staff_vital_signs"), {"patient_id": uuid.uuid4()}
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse("staff_vital_signs"), {"patient_id": self.other.pk}
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_unverified_account_is_refused(self):
+        client = APIClient()
+        client.force_authenticate(self.other.user)
+        self.assertEqual(client.get(reverse("vital_signs")).status_code, 403)
+
+
+class VitalSignsMigrationTests(unittest.TestCase):
+    migration = importlib.import_module(
+        "users.migrations.0016_vitalsigns_numeric_readings"
+    )
+
+    def test_readings_are_parsed(self):
+        parse_number = self.migration.parse_number
+        self.assertEqual(parse_number("72 bpm", "heart_rate"), 72)
+        self.assertEqual(parse_number("36.6 C", "temperature"), 36.6)
+        self.assertIsNone(parse_number("n/a", "heart_rate"))
+        self.assertIsNone(parse_number(None, "heart_rate"))
+
+    def test_out_of_range_readings_are_dropped(self):
+        to_number = self.migration.to_number
+        self.assertIsNone(self.migration.parse_number("72000", "heart_rate"))
+        self.assertIsNone(to_number("900", "heart_rate"))
+        # fahrenheit
+        self.assertIsNone(to_number("98.6", "temperature"))
+        self.assertIsNone(to_number("2", "respiratory_rate"))
+        self.assertEqual(to_number("300", "heart_rate"), 300)
+        self.assertEqual(to_number("25", "temperature"), 25.0)
+
+
+class VitalSignsIngestTests(TestCase):
+    def setUp(self):
+        (patient_user,) = create_users("ingest", 1)
+        User.objects.filter(pk=patient_user.pk).update(is_email_verified=True)
+        self.patient = Patient.objects.get(
+            pk=Patient.objects.create(user=patient_user).pk
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+        self.recorded_at = timezone.now().isoformat()
+
+    def post_ndjson(self, lines):
+        return self.client.post(
+            reverse("vital_signs_ingest"),
+            "\n".join(lines).encode(),
+            content_type="application/x-ndjson",
+        )
+
+    def reading(self, heart_rate):
+        return json.dumps(
+            {"recorded_at": self.recorded_at, "heart_rate": heart_rate}
+        )
+
+    def test_parser_gives_undecodable_lines_in_place(self):
+        rows = list(
+            NDJSONParser().parse(io.BytesIO(b'{"a": 1}\n\n{oops\n[2]\n'))
+        )
+        self.assertEqual(rows[0], {"a": 1})
+        self.assertIsInstance(rows[1], UndecodableLine)
+        self.assertEqual(rows[1].line_number, 3)
+        self.assertEqual(rows[2], [2])
+
+    @override_settings(VITALS_INGEST_CHUNK_SIZE=2)
+    def test_undecodable_line_is_a_row_error(self):
+        response = self.post_ndjson(
+            [
+                self.reading(60),
+                self.reading(61),
+                self.reading(62),
+                "{not json",
+                self.reading(63),
+                "[]",
+                self.reading(900),
+            ]
+        )
+
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual(
+            (report["received"], report["created"], report["failed"]),
+            (7, 4, 3),
+        )
+        self.assertEqual(
+            [error["row"] for error in report["errors"]], [3, 5, 6]
+        )
+        self.assertIn("line 4", report["errors"][0]["errors"]["detail"])
+        self.assertEqual(
+            sorted(
+                VitalSigns.objects.filter(patient=self.patient).values_list(
+                    "heart_rate", flat=True
+                )
+            ),
+            [60, 61, 62, 63],
+        )
+
+    @override_settings(API_JSON_BACKEND="json")
+    def test_non_finite_readings_are_row_errors(self):
+        response = self.post_ndjson(
+            [
+                self.reading(60),
+                '{"heart_rate": NaN, "recorded_at": "%s"}' % self.recorded_at,
+                '{"temperature": Infinity, "recorded_at": "%s"}'
+                % self.recorded_at,
+                '{"heart_rate": -Infinity, "recorded_at": "%s"}'
+                % self.recorded_at,
+            ]
+        )
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual((report["created"], report["failed"]), (1, 3))
+        self.assertEqual(
+            [error["row"] for error in report["errors"]], [1, 2, 3]
+        )
+
+    def test_nothing_decodable(self):
+        response = self.post_ndjson(["{", "}"])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["failed"], 2)
+        self.assertFalse(VitalSigns.objects.exists())
+
+    def test_json_array(self):
+        response = self.client.post(
+            reverse("vital_signs_ingest"),
+            [json.loads(self.reading(70)), {"heart_rate": 70}],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            (response.json()["created"], response.json()["errors"][0]["row"]),
+            (1, 1),
+        )
+
+
+class VitalSignsRollupTests(TestCase):
+    def setUp(self):
+        users = create_users("rollup", 2)
+        self.first, self.second = (
+            Patient.objects.get(pk=Patient.objects.create(user=user).pk)
+            for user in users
+        )
+        self.hour = timezone.now().replace(
+            month=1, day=10, hour=9, minute=0, second=0, microsecond=0
+        ) - timedelta(days=366)
+
+    def add_reading(self, patient, recorded_at, heart_rate):
+        return VitalSigns.objects.create(
+            patient=patient, recorded_at=recorded_at, heart_rate=heart_rate
+        )
+
+    def get_rollup(self, patient, resolution, bucket_start):
+        return VitalSignsRollup.objects.get(
+            patient=patient, resolution=resolution, bucket_start=bucket_start
+        )
+
+    def test_bucket_filter_is_per_patient(self):
+        late = self.hour + timedelta(days=300)
+        inside = [
+            self.add_reading(self.first, self.hour, 60),
+            self.add_reading(
+                self.first, self.hour + timedelta(minutes=90), 61
+            ),
+            self.add_reading(self.second, late, 62),
+        ]
+        # between the first patient's and the second patient's buckets
+        self.add_reading(self.first, self.hour + timedelta(days=100), 63)
+        self.add_reading(self.second, self.hour, 64)
+
+        condition = _bucket_filter(
+            {
+                (self.first.pk, self.hour),
+                (self.first.pk, self.hour + timedelta(hours=1)),
+                (self.second.pk, late),
+            },
+            "recorded_at",
+            timedelta(hours=1),
+        )
+        # the first patient's adjacent hours are read as one range
+        self.assertEqual(len(condition.children), 2)
+        self.assertEqual(
+            set(
+                VitalSigns.objects.filter(condition).values_list(
+                    "heart_rate", flat=True
+                )
+            ),
+            {reading.heart_rate for reading in inside},
+        )
+
+    def test_hours_days_and_months_are_rolled_up(self):
+        for minutes, heart_rate in ((0, 60), (30, 80), (24 * 60, 70)):
+            self.add_reading(
+                self.first, self.hour + timedelta(minutes=minutes), heart_rate
+            )
+        self.add_reading(self.second, self.hour + timedelta(days=40), 90)
+
+        self.assertEqual(rollup_new_vital_signs(), 3)
+
+        hour = self.get_rollup(self.first, ROLLUP_RESOLUTION.HOUR, self.hour)
+        self.assertEqual(
+            (hour.count, hour.heart_rate_min, hour.heart_rate_max), (2, 60, 80)
+        )
+        day = self.get_rollup(
+            self.first,
+            ROLLUP_RESOLUTION.DAY,
+            self.hour.replace(hour=0),
+        )
+        self.assertEqual((day.count, day.heart_rate_sum), (2, 140))
+        month = self.get_rollup(
+            self.first,
+            ROLLUP_RESOLUTION.MONTH,
+            self.hour.replace(day=1, hour=0),
+        )
+        self.assertEqual(
+            (month.count, month.heart_rate_min, month.heart_rate_max),
+            (3, 60, 80),
+        )
+        self.assertEqual(
+            VitalSignsRollup.objects.filter(patient=self.second).count(), 3
+        )
+
+    def test_only_given_buckets_are_saved(self):
+        self.add_reading(self.first, self.hour, 60)
+        self.add_reading(self.first, self.hour + timedelta(hours=5), 70)
+
+        self.assertEqual(
+            rollup_hours({(self.first.pk, self.hour)}),
+            {(self.first.pk, self.hour)},
+        )
+        self.assertEqual(VitalSignsRollup.objects.count(), 1)
+
+    def test_watermark_is_kept_in_the_database(self):
+        self.add_reading(self.first, self.hour, 60)
+        self.assertEqual(rollup_new_vital_signs(), 1)
+        self.assertTrue(Watermark.objects.filter(name=WATERMARK_NAME).exists())
+
+        # rolled up readings are older than the overlap on the next run
+        VitalSigns.objects.update(
+            created_at=timezone.now() - timedelta(days=1)
+        )
+        self.add_reading(self.second, self.hour, 70)
+        cache.clear()
+
+        self.assertEqual(rollup_new_vital_signs(), 1)
+        self.assertEqual(Watermark.objects.count(), 1)
+
+
+class CohortAnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        users = create_users("cohort", 7)
+        staff = users.pop()
+        staff.is_staff = True
+        staff.save()
+        self.client = APIClient()
+        self.client.force_authenticate(staff)
+        for user, (genotype, smoking_status, alcohol_consumption) in zip(
+            users,
+            [
+                ("AA", "Y", "Y"),
+                ("AA", "N", "N"),
+                ("AA", "", "N"),
+                ("AA", "U", ""),
+                ("SS", "Y", "N"),
+                ("SS", "", "Y"),
+            ],
+        ):
+            Patient.objects.create(
+                user=user,
+                genotype=genotype,
+                smoking_status=smoking_status,
+                alcohol_consumption=alcohol_consumption,
+            )
+
+    def get_stats(self, **params):
+        response = self.client.get(reverse("cohort_analytics"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_unknown_answers_are_left_out_of_the_rates(self):
+        (group,) = self.get_stats()["groups"]
+        self.assertEqual(group["patients"], 6)
+        self.assertEqual(group["smoking_prevalence"], 0.6667)
+        self.assertEqual(group["smoking_status_unknown"], 3)
+        self.assertEqual(group["alcohol_prevalence"], 0.4)
+        self.assertEqual(group["alcohol_consumption_unknown"], 1)
+
+    def test_rates_per_group(self):
+        groups = {
+            group["group"]["genotype"]: group
+            for group in self.get_stats(group_by="genotype")["groups"]
+        }
+        self.assertEqual(groups["AA"]["smoking_prevalence"], 0.5)
+        self.assertEqual(groups["AA"]["smoking_status_unknown"], 2)
+        self.assertEqual(groups["SS"]["smoking_prevalence"], 1.0)
+        self.assertEqual(groups["SS"]["alcohol_prevalence"], 0.5)
+
+    def test_group_without_known_answers_has_no_rate(self):
+        groups = {
+            group["group"]["smoking_status"]: group
+            for group in self.get_stats(group_by="smoking_status")["groups"]
+        }
+        self.assertIsNone(groups[None]["smoking_prevalence"])
+        self.assertEqual(groups[None]["smoking_status_unknown"], 2)
+        self.assertEqual(groups["Y"]["smoking_prevalence"], 1.0)
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        names = [("John", "Smith"), ("Mary", "Smith"), ("Joan", "Baker")]
+        users = User.objects.bulk_create(
+            [
+                User(
+                    email=f"{first.lower()}@example.com",
+                    username=f"{first.lower()}@example.com",
+                    first_name=first,
+                    last_name=last,
+                )
+                for first, last in names
+            ]
+        )
+        self.john, self.mary, self.joan = users
+        Patient.objects.create(user=self.john)
+        staff = create_users("searcher", 1)[0]
+        staff.is_staff = True
+        staff.save()
+        self.client = APIClient()
+        self.client.force_authenticate(staff)
+
+    def search(self, q, **params):
+        return self.client.get(reverse("user_search"), {"q": q, **params})
+
+    def get_emails(self, q, **params):
+        response = self.search(q, **params)
+        self.assertEqual(response.status_code, 200)
+        return [user["email"] for user in response.json()["results"]]
+
+    def test_every_word_must_match(self):
+        self.assertEqual(
+            sorted(self.get_emails("smith")),
+            ["john@example.com", "mary@example.com"],
+        )
+        self.assertEqual(self.get_emails("smith mary"), ["mary@example.com"])
+
+    def test_short_words_narrow_longer_ones(self):
+        self.assertEqual(self.get_emails("jo smith"), ["john@example.com"])
+
+    def test_term_needs_a_word_the_index_can_use(self):
+        for q in ("jo", "jo ma"):
+            response = self.search(q)
+            self.assertEqual(response.status_code, 400, q)
+        self.assertFalse(trigram_search(User.objects.all(), "jo ma").exists())
+
+    def test_role(self):
+        self.assertEqual(
+            self.get_emails("smith", role="patient"), ["john@example.com"]
+        )
+
+    def test_closest_match_first(self):
+        self.assertEqual(
+            [user.email for user in search_users("joan")][0],
+            "joan@example.com",
+        )
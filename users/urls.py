@@ -68,10 +68,85 @@ urlpatterns = [
         views.PatientRetrieveUpdateView.as_view(),
         name="patient_info",
     ),
+    path(
+        "patient/record-export/",
+        views.PatientRecordExportAPIView.as_view(),
+        name="patient_record_export",
+    ),
+    path(
+        "patient/record-export/<str:pk>/",
+        views.PatientRecordExportStatusAPIView.as_view(),
+        name="patient_record_export_status",
+    ),
+    path(
+        "patient/record-export/<str:pk>/download/",
+        views.PatientRecordExportDownloadAPIView.as_view(),
+        name="patient_record_export_download",
+    ),
+    path(
+        "vitals/",
+        views.PatientVitalSignsAPIView.as_view(),
+        name="vital_signs",
+    ),
+    path(
+        "vitals/ingest/",
+        views.VitalSignsIngestAPIView.as_view(),
+        name="vital_signs_ingest",
+    ),
+    path(
+        "vitals/summary/",
+        views.VitalSignsSummaryAPIView.as_view(),
+        name="vital_signs_summary",
+    ),
+    path(
+        "vitals/history/",
+        views.VitalSignsHistoryAPIView.as_view(),
+        name="vital_signs_history",
+    ),
+    path(
+        "anthropometrics/",
+        views.AnthropometricRecordListAPIView.as_view(),
+        name="anthropometrics",
+    ),
     path("staff/patient/", views.PatientGetView.as_view(), name="get_patient"),
+    path(
+        "staff/patient/<str:patient_id>/chart/",
+        views.PatientChartAPIView.as_view(),
+        name="patient_chart",
+    ),
+    path(
+        "staff/patient/vitals/",
+        views.StaffPatientVitalSignsAPIView.as_view(),
+        name="staff_vital_signs",
+    ),
+    path(
+        "staff/patient/vitals/summary/",
+        views.StaffVitalSignsSummaryAPIView.as_view(),
+        name="staff_vital_signs_summary",
+    ),
+    path(
+        "staff/patient/vitals/history/",
+        views.StaffVitalSignsHistoryAPIView.as_view(),
+        name="staff_vital_signs_history",
+    ),
+    path(
+        "staff/patient/anthropometrics/",
+        views.StaffAnthropometricRecordListAPIView.as_view(),
+        name="staff_anthropometrics",
+    ),
     path(
         "staff/patient/medical-history/", views.MedicalHistoryAPIView.as_view()
     ),
+    path(
+        "staff/search/users/",
+        views.UserSearchAPIView.as_view(),
+        name="user_search",
+    ),
+    path(
+        "staff/analytics/cohorts/",
+        views.CohortAnalyticsAPIView.as_view(),
+        name="cohort_analytics",
+    ),
     path("staff/", views.MedicalProfessionalView.as_view(), name="staff_info"),
     path("doctors/", views.MedicalProfessionalListAPIView.as_view()),
 ]
@@ -6,10 +6,14 @@ from django.utils.html import strip_tags
 from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db.utils import IntegrityError
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
 from rest_framework.exceptions import ValidationError as DRFValidationError
 from rest_framework.views import exception_handler as drf_exception_handler
 from rest_framework.exceptions import APIException
+from rest_framework.pagination import PageNumberPagination
 import random
 import hashlib
 
@@ -129,6 +133,10 @@ def avatar_file_name(instance, filename):
     )
 
 
+def record_export_file_name(instance, filename):
+    return "/".join(["files", "record-exports", str(instance.id), filename])
+
+
 def medical_upload_file_name(instance, filename):
     return "/".join(
         [
@@ -187,3 +195,47 @@ def send_template_email(template, email, subject, **context):
         email,
         html_message=html_message,
     )
+
+
+class SearchResultsPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+def get_estimated_count(model, using="default") -> int:
+    """The planner's row estimate for `model`'s table, summed over its
+    partitions when it is partitioned, or -1 if it was never analyzed."""
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return -1
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT
+                COALESCE(SUM(reltuples) FILTER (WHERE relkind = 'r'), -1),
+                BOOL_OR(reltuples < 0 AND relkind = 'r')
+            FROM pg_class
+            WHERE oid = %s::regclass OR oid IN (
+                SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass
+            )
+            """,
+            [model._meta.db_table, model._meta.db_table],
+        )
+        estimate, never_analyzed = cursor.fetchone()
+    return -1 if never_analyzed else int(estimate)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Counts unfiltered lists of large tables from the planner's row
+    estimate instead of a full COUNT(*). Filtered lists and tables under
+    ADMIN_ESTIMATED_COUNT_THRESHOLD rows are counted exactly."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, "query") and not queryset.query.where:
+            estimate = get_estimated_count(queryset.model, queryset.db)
+            if estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
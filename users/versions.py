@@ -0,0 +1,82 @@
+"""
+ETags of API lists.
+
+A list's ETag hashes its URL, the user, and the number and latest
+`etag_fields` of the rows of its filtered queryset. Those are the
+updated_at of the rows and of the rows their representation nests, which
+the signals in users.signals move along with the nested rows, see
+users.sync. They are read with one aggregate query, so a client sending
+back an ETag that still matches gets a 304 before any row is read or
+serialized. An added or changed row moves the latest updated_at and a
+deleted one lowers the count.
+"""
+
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+# added to an ETag by users.middleware.CompressionMiddleware for every
+# content coding
+ETAG_ENCODING_SUFFIXES = ("-gzip", "-br")
+
+
+def get_etag(request, queryset, fields=("updated_at",)) -> str:
+    stamp = queryset.order_by().aggregate(
+        count=Count("pk"),
+        **{f"latest_{i}": Max(field) for i, field in enumerate(fields)},
+    )
+    stamp = "\n".join(
+        [request.get_full_path(), str(request.user.pk)]
+        + [str(stamp[key]) for key in sorted(stamp)]
+    )
+    return '"{}"'.format(hashlib.sha1(stamp.encode()).hexdigest())
+
+
+def get_etag_tags(request) -> list:
+    """The tags of the If-None-Match header, weak ones made strong."""
+    return [
+        tag.removeprefix("W/")
+        for tag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+    ]
+
+
+def etag_matches(request, etag: str) -> bool:
+    """Whether the If-None-Match header holds `etag`, as it was sent or as
+    changed by compression."""
+    for tag in get_etag_tags(request):
+        if tag == "*":
+            return True
+        for suffix in ETAG_ENCODING_SUFFIXES:
+            if tag.endswith(suffix + '"'):
+                tag = tag[: -len(suffix) - 1] + '"'
+        if tag == etag:
+            return True
+    return False
+
+
+class VersionedListMixin:
+    """Tags the list with an ETag made from its filtered rows, and answers
+    a matching If-None-Match with a 304 without reading the list.
+    `etag_fields` are the updated_at lookups of the row and of the rows
+    its representation nests."""
+
+    etag_fields = ("updated_at",)
+
+    def list(self, request, *args, **kwargs):
+        etag = get_etag(
+            request,
+            self.filter_queryset(self.get_queryset()),
+            self.etag_fields,
+        )
+        if etag_matches(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().list(request, *args, **kwargs)
+        response["ETag"] = etag
+        # lists are per user and must be revalidated on every use
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
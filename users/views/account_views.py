@@ -1,8 +1,17 @@
-from rest_framework.generics import CreateAPIView, ListAPIView
+from rest_framework.generics import (
+    CreateAPIView,
+    ListAPIView,
+    ListCreateAPIView,
+)
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
 from rest_framework import status
+from django.http import FileResponse
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Min
+from django.db.models.functions import TruncDate
 from django.utils.translation import gettext_lazy as _
 
 from users.serializers import (
@@ -20,17 +29,48 @@ from users.serializers import (
     PatientSerializer,
     MedicalProfessionalSerializer,
     MedicalHistorySerializer,
+    VitalSignsSerializer,
+    VitalSignsRangeSerializer,
+    VitalSignsHistorySerializer,
+    AnthropometricRecordSerializer,
+    CohortAnalyticsSerializer,
+    UserSearchSerializer,
+    UserSearchResultSerializer,
+    PatientRecordExportSerializer,
 )
 from users.models import (
     User,
     Patient,
     MedicalProfessional,
     MedicalHistory,
+    VitalSigns,
+    VitalSignsRollup,
+    PatientRecordExport,
 )
 from users.permissions import IsAccountVerified
+from users.ingest import ingest_vital_signs
+from users.analytics import get_cohort_stats
+from users.chart import get_patient_chart
+from users.search import search_users
+from users.sync import DeltaListMixin
+from users.versions import VersionedListMixin
+from users.representations import (
+    MEDICAL_PROFESSIONAL_FIELDS,
+    RepresentationListMixin,
+    get_user_values,
+    represent_medical_professionals,
+)
+from users.utils import SearchResultsPagination
+from users.parsers import FastJSONParser, NDJSONParser
+from users.tasks import build_patient_record_export
 from appointments.serilaizers import AppointmentSerializer
+from appointments.representations import (
+    APPOINTMENT_DELTA_FIELDS,
+    APPOINTMENT_FIELDS,
+    represent_appointments,
+)
 from appointments.models import Appointment
-from appointments.choices import BOOKING_STATUS
+from appointments.choices import BOOKING_STATUS, EXPORT_STATUS
 
 
 class AccountRegistrationView(CreateAPIView):
@@ -264,15 +304,118 @@ class PatientRetrieveUpdateView(APIView):
         return Response(serializer.data)
 
 
+class PatientRecordExportMixin:
+    permission_classes = (IsAuthenticated, IsAccountVerified)
+
+    def get_patient(self):
+        patient = Patient.objects.filter(user=self.request.user).first()
+        if not patient:
+            raise NotFound("No patient data found for this user.")
+        return patient
+
+    def get_object(self, pk):
+        record_export = PatientRecordExport.objects.filter(
+            pk=pk, patient__user=self.request.user
+        ).first()
+        if not record_export:
+            raise NotFound("No record export found for that id")
+        return record_export
+
+
+class PatientRecordExportAPIView(PatientRecordExportMixin, APIView):
+    """Lists the patient's record downloads, or requests a new one. The zip
+    is built by a Celery task, see users.record_export, and the patient is
+    emailed once it is ready."""
+
+    def get(self, request):
+        record_exports = PatientRecordExport.objects.filter(
+            patient=self.get_patient()
+        )
+        return Response(
+            PatientRecordExportSerializer(
+                record_exports, many=True, context={"request": request}
+            ).data
+        )
+
+    def post(self, request):
+        patient = self.get_patient()
+        record_export = PatientRecordExport.objects.filter(
+            patient=patient,
+            status__in=(EXPORT_STATUS.PENDING, EXPORT_STATUS.RUNNING),
+        ).first()
+        if not record_export:
+            record_export = PatientRecordExport.objects.create(patient=patient)
+            transaction.on_commit(
+                lambda: build_patient_record_export.delay(
+                    str(record_export.pk)
+                )
+            )
+        return Response(
+            PatientRecordExportSerializer(
+                record_export, context={"request": request}
+            ).data,
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class PatientRecordExportStatusAPIView(PatientRecordExportMixin, APIView):
+    """Status of a record download, 202 while it is built and 200 with its
+    download URL once it is done. Deleting a download deletes its file."""
+
+    def get(self, request, pk):
+        record_export = self.get_object(pk)
+        running = record_export.status in (
+            EXPORT_STATUS.PENDING,
+            EXPORT_STATUS.RUNNING,
+        )
+        return Response(
+            PatientRecordExportSerializer(
+                record_export, context={"request": request}
+            ).data,
+            status=status.HTTP_202_ACCEPTED if running else status.HTTP_200_OK,
+        )
+
+    def delete(self, request, pk):
+        record_export = self.get_object(pk)
+        if record_export.file:
+            record_export.file.delete(save=False)
+        record_export.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class PatientRecordExportDownloadAPIView(PatientRecordExportMixin, APIView):
+    """Streams the zip of a completed record download."""
+
+    def get(self, request, pk):
+        record_export = self.get_object(pk)
+        if not record_export.file:
+            raise NotFound("The record export is not ready yet")
+        return FileResponse(
+            record_export.file.open("rb"),
+            as_attachment=True,
+            filename="health-record.zip",
+            content_type="application/zip",
+        )
+
+
 """
     Medical Section
 """
 
 
-class MedicalProfessionalListAPIView(ListAPIView):
+class MedicalProfessionalListAPIView(
+    VersionedListMixin,
+    DeltaListMixin,
+    RepresentationListMixin,
+    ListAPIView,
+):
     permission_classes = (IsAuthenticated,)
     serializer_class = MedicalProfessionalSerializer
     queryset = MedicalProfessional.objects.all()
+    representation_fields = MEDICAL_PROFESSIONAL_FIELDS + tuple(
+        get_user_values("user__")
+    )
+    represent_rows = staticmethod(represent_medical_professionals)
 
 
 class MedicalProfessionalView(APIView):
@@ -312,12 +455,17 @@ class MedicalProfessionalView(APIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class MedicalProfessionalPatientsListAPIView(ListAPIView):
+class MedicalProfessionalPatientsListAPIView(
+    VersionedListMixin, RepresentationListMixin, ListAPIView
+):
     permission_classes = (
         IsAuthenticated,
         IsAdminUser,
     )
     serializer_class = AppointmentSerializer
+    representation_fields = APPOINTMENT_FIELDS
+    represent_rows = staticmethod(represent_appointments)
+    etag_fields = APPOINTMENT_DELTA_FIELDS
 
     def get_queryset(self):
         patients = Appointment.objects.filter(
@@ -351,6 +499,25 @@ class PatientGetView(APIView):
         return Response(serializer.data)
 
 
+class PatientChartAPIView(APIView):
+    """A patient's demographics, medical history, recent vital signs, visit
+    history and upcoming appointments in one response, see users.chart."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+    def get(self, request, patient_id):
+        chart = get_patient_chart(patient_id)
+        if chart is None:
+            return Response(
+                {"detail": "No patient found for that id"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response(chart)
+
+
 class MedicalHistoryAPIView(APIView):
     permission_classes = (IsAuthenticated,)
 
@@ -406,3 +573,254 @@ class MedicalHistoryAPIView(APIView):
             )
         medical_history.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+"""
+    Vital Signs Section
+"""
+
+
+class VitalSignsMixin:
+    def get_patient(self):
+        return self.request.user.patient
+
+    def get_vital_signs_queryset(self, patient):
+        serializer = VitalSignsRangeSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        queryset = VitalSigns.objects.filter(
+            patient=patient, recorded_at__isnull=False
+        )
+        if "start" in serializer.validated_data:
+            queryset = queryset.filter(
+                recorded_at__gte=serializer.validated_data["start"]
+            )
+        if "end" in serializer.validated_data:
+            queryset = queryset.filter(
+                recorded_at__lt=serializer.validated_data["end"]
+            )
+        return queryset
+
+
+class StaffVitalSignsMixin(VitalSignsMixin):
+    def get_patient(self):
+        patient_id = self.request.query_params.get("patient_id")
+        patient = Patient.objects.filter(id=patient_id).first()
+        if not patient:
+            raise NotFound("No patient found for that id")
+        return patient
+
+
+class PatientVitalSignsAPIView(VitalSignsMixin, ListCreateAPIView):
+    """Lists a patient's readings, newest first, optionally between `start`
+    and `end`. Accepts a single reading or a list of readings."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAccountVerified,
+    )
+    serializer_class = VitalSignsSerializer
+
+    def get_queryset(self):
+        return self.get_vital_signs_queryset(self.get_patient())
+
+    def get_serializer(self, *args, **kwargs):
+        if isinstance(kwargs.get("data"), list):
+            kwargs["many"] = True
+        return super().get_serializer(*args, **kwargs)
+
+    def perform_create(self, serializer):
+        serializer.save(patient=self.get_patient())
+
+
+class StaffPatientVitalSignsAPIView(
+    StaffVitalSignsMixin, PatientVitalSignsAPIView
+):
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+
+class VitalSignsIngestAPIView(APIView):
+    """Bulk ingestion of device readings, sent as a JSON array or as NDJSON.
+    Staff devices give a patient_id on every reading, readings sent by a
+    patient are always stored against that patient."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAccountVerified,
+    )
+    parser_classes = (
+        FastJSONParser,
+        NDJSONParser,
+    )
+
+    def post(self, request, *args, **kwargs):
+        rows = request.data
+        if isinstance(rows, dict):
+            return Response(
+                {"detail": _("Send a list of readings.")},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        patient_id = None if request.user.is_staff else request.user.patient.id
+        report = ingest_vital_signs(rows, patient_id)
+        return Response(
+            report,
+            status=(
+                status.HTTP_400_BAD_REQUEST
+                if report["failed"] and not report["created"]
+                else status.HTTP_201_CREATED
+            ),
+        )
+
+
+class VitalSignsSummaryAPIView(VitalSignsMixin, APIView):
+    """Daily minimum, maximum and average of each reading between `start`
+    and `end`."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAccountVerified,
+    )
+
+    def get(self, request, *args, **kwargs):
+        aggregates = {"count": Count("id")}
+        for measurement in VitalSigns.MEASUREMENTS:
+            aggregates[f"{measurement}_min"] = Min(measurement)
+            aggregates[f"{measurement}_max"] = Max(measurement)
+            aggregates[f"{measurement}_avg"] = Avg(measurement)
+
+        summary = (
+            self.get_vital_signs_queryset(self.get_patient())
+            .annotate(day=TruncDate("recorded_at"))
+            .order_by("day")
+            .values("day")
+            .annotate(**aggregates)
+        )
+        return Response(list(summary))
+
+
+class StaffVitalSignsSummaryAPIView(
+    StaffVitalSignsMixin, VitalSignsSummaryAPIView
+):
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+
+class VitalSignsHistoryAPIView(VitalSignsMixin, APIView):
+    """Long-range history of each reading, read from the hourly, daily or
+    monthly rollups (`resolution`, daily by default) between `start` and
+    `end`. Readings are picked up by the rollups every few minutes."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAccountVerified,
+    )
+
+    def get(self, request, *args, **kwargs):
+        serializer = VitalSignsHistorySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        filters = {"resolution": serializer.validated_data["resolution"]}
+        if "start" in serializer.validated_data:
+            filters["bucket_start__gte"] = serializer.validated_data["start"]
+        if "end" in serializer.validated_data:
+            filters["bucket_start__lt"] = serializer.validated_data["end"]
+        rollups = VitalSignsRollup.objects.filter(
+            patient=self.get_patient(), **filters
+        ).values()
+
+        history = []
+        for rollup in rollups:
+            point = {
+                "bucket_start": rollup["bucket_start"],
+                "count": rollup["count"],
+            }
+            for measurement in VitalSigns.MEASUREMENTS:
+                count = rollup[f"{measurement}_count"]
+                point[f"{measurement}_min"] = rollup[f"{measurement}_min"]
+                point[f"{measurement}_max"] = rollup[f"{measurement}_max"]
+                point[f"{measurement}_avg"] = (
+                    rollup[f"{measurement}_sum"] / count if count else None
+                )
+            history.append(point)
+        return Response(history)
+
+
+class StaffVitalSignsHistoryAPIView(
+    StaffVitalSignsMixin, VitalSignsHistoryAPIView
+):
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+
+class AnthropometricRecordListAPIView(VitalSignsMixin, ListAPIView):
+    """Height, weight and BMI history of a patient, newest first."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAccountVerified,
+    )
+    serializer_class = AnthropometricRecordSerializer
+
+    def get_queryset(self):
+        return self.get_patient().anthropometrics.all()
+
+
+class StaffAnthropometricRecordListAPIView(
+    StaffVitalSignsMixin, AnthropometricRecordListAPIView
+):
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+
+class UserSearchAPIView(ListAPIView):
+    """Users whose email or name contain every word of `q`, closest matches
+    first, optionally only patients or medical professionals (`role`)."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+    serializer_class = UserSearchResultSerializer
+    pagination_class = SearchResultsPagination
+
+    def get_queryset(self):
+        serializer = UserSearchSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        queryset = User.objects.all()
+        role = serializer.validated_data.get("role")
+        if role == "patient":
+            queryset = queryset.filter(patient__isnull=False)
+        elif role == "medical_professional":
+            queryset = queryset.filter(medicalprofessional__isnull=False)
+        return search_users(serializer.validated_data["q"], queryset)
+
+
+"""
+    Analytics Section
+"""
+
+
+class CohortAnalyticsAPIView(APIView):
+    """BMI statistics and distribution, smoking and alcohol prevalence of
+    patients grouped by any of `group_by` (comma separated genotype,
+    blood_group, smoking_status, alcohol_consumption). `specialization`,
+    `department`, `start` and `end` narrow the cohort down to patients with
+    matching appointments."""
+
+    permission_classes = (
+        IsAuthenticated,
+        IsAdminUser,
+    )
+
+    def get(self, request, *args, **kwargs):
+        serializer = CohortAnalyticsSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(get_cohort_stats(**serializer.validated_data))